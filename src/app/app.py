@@ -19,8 +19,19 @@ from dash.dependencies import Input, Output, State
 GOOGLE_API_DEVELOPER_KEY = "enter_key_here"
 CSE_ID = "enter_id_here"
 
-fighter_df = pd.read_csv("app_data/latest_fighter_stats.csv", index_col="index")
+# Fighters are picked by their integer code from data/fighter_dimension.csv, names
+# are only shown
+fighter_df = pd.read_csv("app_data/latest_fighter_stats.csv")
 weight_classes = pd.read_csv("app_data/weight_classes.csv")
+if "fighter_id" not in fighter_df.columns or "fighter_id" not in weight_classes.columns:
+    raise SystemExit(
+        "app_data is keyed by fighter name, run `python -m src.app.key_app_data` from "
+        "the repository root to key it by fighter_id"
+    )
+fighter_df = fighter_df.set_index("fighter_id")
+fighter_names = weight_classes.drop_duplicates("fighter_id").set_index("fighter_id")[
+    "fighter"
+]
 
 with open("app_data/model.sav", "rb") as mdl:
     model = pickle.load(mdl)
@@ -330,11 +341,12 @@ def set_no_of_rounds(no_of_rounds):
 @app.callback(Output("red-fighter", "options"), [Input("weightclass", "value")])
 def set_red_fighter(weightclass):
 
+    fighters = weight_classes[weight_classes["weight_class"] == weightclass]
     return [
-        {"label": i, "value": i}
-        for i in weight_classes[weight_classes["weight_class"] == weightclass][
-            "fighter"
-        ].sort_values()
+        {"label": name, "value": fighter_id}
+        for fighter_id, name in fighters.sort_values("fighter")[
+            ["fighter_id", "fighter"]
+        ].itertuples(index=False)
     ]
 
 
@@ -350,17 +362,15 @@ def set_red_fighter_value(options):
     [Input("weightclass", "value"), Input("red-fighter", "value")],
 )
 def set_blue_fighter(weightclass, red_fighter):
-    blue_weight_classes = weight_classes.copy()
-
-    if red_fighter in list(blue_weight_classes["fighter"]):
-        blue_weight_classes = blue_weight_classes.set_index("fighter")
-        blue_weight_classes = blue_weight_classes.drop(index=red_fighter).reset_index()
-
+    fighters = weight_classes[
+        (weight_classes["weight_class"] == weightclass)
+        & (weight_classes["fighter_id"] != red_fighter)
+    ]
     return [
-        {"label": i, "value": i}
-        for i in blue_weight_classes[
-            blue_weight_classes["weight_class"] == weightclass
-        ]["fighter"].sort_values()
+        {"label": name, "value": fighter_id}
+        for fighter_id, name in fighters.sort_values("fighter")[
+            ["fighter_id", "fighter"]
+        ].itertuples(index=False)
     ]
 
 
@@ -374,15 +384,15 @@ def set_blue_fighter_value(options):
 @app.callback(Output("red-image", "src"), [Input("red-fighter", "value")])
 def set_image_red(fighter1):
     # return
-    if fighter1:
-        return get_fighter_url(fighter1)
+    if fighter1 in fighter_names.index:
+        return get_fighter_url(fighter_names[fighter1])
 
 
 @app.callback(Output("blue-image", "src"), [Input("blue-fighter", "value")])
 def set_image_blue(fighter2):
     # return
-    if fighter2:
-        return get_fighter_url(fighter2)
+    if fighter2 in fighter_names.index:
+        return get_fighter_url(fighter_names[fighter2])
 
 
 @app.callback(
@@ -399,9 +409,10 @@ def set_image_blue(fighter2):
 def update_proba(nclicks, red, blue, weightclass, no_of_rounds, fight_type):
 
     if nclicks:
-        if not red:
+        # Fighter codes start at 0, a missing fighter is not in the index
+        if red not in fighter_df.index:
             return ("Select weight class", "Select weight class")
-        if not blue:
+        if blue not in fighter_df.index:
             return ("Select weight class", "Select weight class")
         if not weightclass:
             return ("Select weight class", "Select weight class")
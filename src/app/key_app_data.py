@@ -0,0 +1,55 @@
+import argparse
+from pathlib import Path
+from typing import Dict
+
+import pandas as pd
+
+from src.createdata.data_files_path import FIGHTER_DIMENSION
+from src.createdata.fighter_dimension import FighterDimension
+
+APP_DATA = Path(__file__).parent / "app_data"
+
+
+def fighter_codes_by_name(dimension: FighterDimension) -> Dict[str, int]:
+    # Names shared by several fighters cannot be told apart, they are left out
+    fighters = dimension.to_frame().drop_duplicates("fighter_name", keep=False)
+    return dict(zip(fighters["fighter_name"], fighters["fighter_id"]))
+
+
+def key_app_data(
+    app_data: Path = APP_DATA, dimension_path: Path = FIGHTER_DIMENSION
+) -> None:
+    """
+    Adds the fighter_id the app picks fighters by to app_data files keyed by fighter
+    name, latest_fighter_stats.csv and weight_classes.csv. Fighters whose name is not
+    in the fighter dimension, or is the name of several fighters, are dropped.
+    """
+    codes = fighter_codes_by_name(FighterDimension(dimension_path))
+    # The stats are keyed by the "index" column, the weight classes by "fighter"
+    for filename, name_column in [
+        ("latest_fighter_stats.csv", "index"),
+        ("weight_classes.csv", "fighter"),
+    ]:
+        filepath = app_data / filename
+        frame = pd.read_csv(filepath)
+        if "fighter_id" in frame.columns:
+            print(f"{filepath} is keyed by fighter_id already")
+            continue
+        fighter_ids = frame[name_column].map(codes)
+        dropped = fighter_ids.isna()
+        frame.insert(0, "fighter_id", fighter_ids)
+        frame = frame[~dropped].astype({"fighter_id": int})
+        frame.to_csv(filepath, index=False)
+        print(
+            f"Keyed {len(frame)} rows of {filepath} by fighter_id, dropped "
+            f"{dropped.sum()} rows without a single fighter of their name"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Key the fighters of app_data written by name by their fighter_id."
+    )
+    parser.add_argument("--app-data", type=Path, default=APP_DATA)
+    args = parser.parse_args()
+    key_app_data(args.app_data)
@@ -0,0 +1,207 @@
+import argparse
+import gzip
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+
+from src.createdata.http_cache import ResponseCache
+
+
+class FixtureServer:
+    """
+    Stand-in for ufcstats.com that answers from recorded pages.
+    It runs as a plain HTTP proxy, so the scrapers keep requesting the real
+    http://ufcstats.com urls and only need HTTP_PROXY pointed at it. The recorded pages
+    are a response cache directory, like the data/http_cache a normal run leaves behind.
+    Every answer is delayed by `latency` plus or minus `jitter` seconds, `error_rate` of
+    the requests get a 503, and urls matching `fail_pattern` get a `fail_status`, with
+    a Retry-After of `retry_after` seconds when set. They fail for good, or only the
+    first `fail_times` times they are requested when that is set.
+    Pages that were not recorded are a 404, nothing is ever fetched from the internet.
+    """
+
+    def __init__(
+        self,
+        fixtures_dir: Path,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        fail_pattern: Optional[str] = None,
+        fail_status: int = 500,
+        retry_after: Optional[float] = None,
+        fail_times: Optional[int] = None,
+        port: int = 0,
+    ):
+        self.fixtures = ResponseCache(fixtures_dir, offline=True)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.fail_pattern = re.compile(fail_pattern) if fail_pattern else None
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.fail_times = fail_times
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                server._answer(self)
+
+        return Handler
+
+    def _answer(self, handler: BaseHTTPRequestHandler) -> None:
+        with self._lock:
+            self.requests += 1
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        # As a proxy the request line carries the full url
+        url = handler.path
+        if self.fail_pattern is not None and self.fail_pattern.search(url):
+            with self._lock:
+                failing = self.fail_times is None or self.failures < self.fail_times
+                self.failures += failing
+            if failing:
+                self._send(handler, self.fail_status, b"", retry_after=self.retry_after)
+                return
+        if self.error_rate and random.random() < self.error_rate:
+            self._send(handler, 503, b"")
+            return
+
+        text = self.fixtures.get(url)
+        if text is None:
+            self._send(handler, 404, b"")
+            return
+        body = text.encode("utf-8")
+        if "gzip" in handler.headers.get("Accept-Encoding", ""):
+            self._send(handler, 200, gzip.compress(body, compresslevel=1), gzipped=True)
+        else:
+            self._send(handler, 200, body)
+
+    @staticmethod
+    def _send(
+        handler: BaseHTTPRequestHandler,
+        status: int,
+        body: bytes,
+        gzipped: bool = False,
+        retry_after: Optional[float] = None,
+    ) -> None:
+        handler.send_response(status)
+        handler.send_header("Content-Type", "text/html; charset=utf-8")
+        if retry_after is not None:
+            handler.send_header("Retry-After", f"{retry_after:g}")
+        if gzipped:
+            handler.send_header("Content-Encoding", "gzip")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def start(self) -> "FixtureServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FixtureServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--fixtures",
+        type=Path,
+        default=Path("data") / "http_cache",
+        help="Response cache directory holding the recorded pages.",
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=0.0, help="Delay added to every answer."
+    )
+    parser.add_argument(
+        "--jitter-ms", type=float, default=0.0, help="Random spread of the delay."
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Share of answers that are a 503."
+    )
+    parser.add_argument(
+        "--fail-pattern",
+        default=None,
+        help="Urls matching this regex always get the --fail-status.",
+    )
+    parser.add_argument(
+        "--fail-status",
+        type=int,
+        default=500,
+        help="Status the --fail-pattern urls get, 429 or 503 to test throttling.",
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=float,
+        default=None,
+        help="Retry-After seconds sent with the --fail-pattern answers.",
+    )
+
+
+def server_from_arguments(args: argparse.Namespace, port: int = 0) -> FixtureServer:
+    if not args.fixtures.exists():
+        raise SystemExit(
+            f"No recorded pages in {args.fixtures}, run "
+            "`python -m src.create_ufc_data` once to record them or point --fixtures "
+            "at a copy of data/http_cache."
+        )
+    return FixtureServer(
+        args.fixtures,
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+        fail_pattern=args.fail_pattern,
+        fail_status=args.fail_status,
+        retry_after=args.retry_after,
+        port=port,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve recorded ufcstats pages as an HTTP proxy."
+    )
+    add_server_arguments(parser)
+    parser.add_argument("--port", type=int, default=8899)
+    args = parser.parse_args()
+
+    server = server_from_arguments(args, port=args.port)
+    print(f"Serving {args.fixtures} as a proxy on {server.url}, stop with Ctrl+C")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
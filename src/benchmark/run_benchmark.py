@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from src.benchmark.fixture_server import add_server_arguments, server_from_arguments
+
+STAGES = ["links", "fights", "fighters"]
+
+
+def run_stage(stage: str, workers: int, parse_processes: int) -> Dict:
+    """
+    Runs one scraper stage from scratch against the proxy in HTTP_PROXY and measures it.
+    Meant to run in a process of its own, so that the data folder, the connection pool,
+    the rate limiter and the peak memory all belong to this stage alone.
+    """
+    from src.createdata.scrape_engine import ScrapeEngine
+    from src.createdata.scrape_fight_data import FightDataScraper
+    from src.createdata.scrape_fight_links import UFCLinks
+    from src.createdata.scrape_fighter_details import FighterDetailsScraper
+    from src.createdata.utils import set_page_observer, set_response_cache
+
+    fetch_times: List[float] = []
+    parse_times: List[float] = []
+    lock = threading.Lock()
+
+    def observe(url, page_type, fetch_seconds, parse_seconds) -> None:
+        with lock:
+            fetch_times.append(fetch_seconds)
+            parse_times.append(parse_seconds)
+
+    # Every page has to come from the stand-in server, not from a cache
+    set_response_cache(None)
+    set_page_observer(observe)
+    engine = ScrapeEngine(max_concurrency=workers, parse_processes=parse_processes)
+
+    start = time.perf_counter()
+    if stage == "links":
+        UFCLinks(engine=engine).get_event_and_fight_links()
+    elif stage == "fights":
+        FightDataScraper(engine=engine).create_fight_data_csv()
+    else:
+        FighterDetailsScraper(engine=engine).create_fighter_data_csv()
+    seconds = time.perf_counter() - start
+    engine.close()
+
+    def percentile_ms(times: List[float], q: float) -> float:
+        return float(np.percentile(times, q) * 1000) if times else 0.0
+
+    return {
+        "stage": stage,
+        "pages": len(fetch_times),
+        "seconds": seconds,
+        "pages_per_second": len(fetch_times) / seconds if seconds else 0.0,
+        "fetch_p50_ms": percentile_ms(fetch_times, 50),
+        "fetch_p99_ms": percentile_ms(fetch_times, 99),
+        "parse_p50_ms": percentile_ms(parse_times, 50),
+        "parse_p99_ms": percentile_ms(parse_times, 99),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_memory_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_stage_process(
+    stage: str, workers: int, parse_processes: int, proxy_url: str
+) -> Dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        result_path = Path(tmp_dir) / "result.json"
+        env = dict(os.environ)
+        env.pop("NO_PROXY", None)
+        env.pop("no_proxy", None)
+        env.update(
+            HTTP_PROXY=proxy_url,
+            http_proxy=proxy_url,
+            UFC_DATA_DIR=str(Path(tmp_dir) / "data"),
+        )
+        (Path(tmp_dir) / "data").mkdir()
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "src.benchmark.run_benchmark",
+                "--stage",
+                stage,
+                "--workers",
+                str(workers),
+                "--parse-processes",
+                str(parse_processes),
+                "--result",
+                str(result_path),
+            ],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        with open(result_path, "r") as f:
+            return json.load(f)
+
+
+def print_results(results: List[Dict]) -> None:
+    columns = [
+        ("stage", "{}", 9),
+        ("pages", "{}", 7),
+        ("seconds", "{:.2f}", 9),
+        ("pages_per_second", "{:.1f}", 10),
+        ("fetch_p50_ms", "{:.1f}", 11),
+        ("fetch_p99_ms", "{:.1f}", 11),
+        ("parse_p50_ms", "{:.1f}", 11),
+        ("parse_p99_ms", "{:.1f}", 11),
+        ("peak_memory_mb", "{:.0f}", 10),
+    ]
+    headers = [
+        "stage",
+        "pages",
+        "seconds",
+        "pages/s",
+        "fetch p50",
+        "fetch p99",
+        "parse p50",
+        "parse p99",
+        "peak MB",
+    ]
+    print(
+        "".join(header.rjust(width) for header, (_, _, width) in zip(headers, columns))
+    )
+    for result in results:
+        print(
+            "".join(fmt.format(result[key]).rjust(width) for key, fmt, width in columns)
+        )
+
+
+def compare_results(results: List[Dict], baseline_path: Path, tolerance: float) -> bool:
+    """
+    Reports every stage whose throughput fell more than `tolerance` below the baseline.
+    """
+    with open(baseline_path, "r") as f:
+        baseline = {result["stage"]: result for result in json.load(f)}
+
+    ok = True
+    for result in results:
+        if result["stage"] not in baseline:
+            continue
+        expected = baseline[result["stage"]]["pages_per_second"]
+        if result["pages_per_second"] < expected * (1 - tolerance):
+            print(
+                f'{result["stage"]}: {result["pages_per_second"]:.1f} pages/s, '
+                f"the baseline has {expected:.1f} pages/s"
+            )
+            ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the scrapers against recorded ufcstats pages, offline."
+    )
+    add_server_arguments(parser)
+    parser.add_argument(
+        "--stages", nargs="+", choices=STAGES, default=STAGES, help="Stages to run."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Concurrency of the scrape engine."
+    )
+    parser.add_argument(
+        "--parse-processes",
+        type=int,
+        default=None,
+        help="Parse processes of the scrape engine, 1 parses in the fetching threads.",
+    )
+    parser.add_argument(
+        "--save", type=Path, help="Write the results to this json file."
+    )
+    parser.add_argument(
+        "--compare",
+        type=Path,
+        help="Fail if pages/s dropped below the results saved in this json file.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Share of the baseline throughput a stage may lose with --compare.",
+    )
+    # Used by the benchmark itself to run a stage in a process of its own
+    parser.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--result", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.workers is None:
+        from src.createdata.utils import MAX_WORKERS
+
+        args.workers = MAX_WORKERS
+    if args.parse_processes is None:
+        from src.createdata.scrape_engine import PARSE_PROCESSES
+
+        args.parse_processes = PARSE_PROCESSES
+
+    if args.stage is not None:
+        with open(args.result, "w") as f:
+            json.dump(run_stage(args.stage, args.workers, args.parse_processes), f)
+        sys.exit(0)
+
+    with server_from_arguments(args) as server:
+        results = [
+            run_stage_process(stage, args.workers, args.parse_processes, server.url)
+            for stage in args.stages
+        ]
+
+    print_results(results)
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.compare is not None and not compare_results(
+        results, args.compare, args.tolerance
+    ):
+        sys.exit(1)
@@ -1,22 +1,240 @@
-import time
+import argparse
+import inspect
+from pathlib import Path
+
+from src.createdata.fighter_features import FighterFeatureStore
+from src.createdata.http_cache import ResponseCache
+from src.createdata.metrics import get_metrics
+from src.createdata.pipeline import Pipeline, Stage
 from src.createdata.preprocess import Preprocessor
+from src.createdata.preprocess_fighter_data import FighterDetailProcessor
+from src.createdata.scrape_engine import PARSE_PROCESSES, ScrapeBudget, ScrapeEngine
 from src.createdata.scrape_fight_data import FightDataScraper
 from src.createdata.scrape_fighter_details import FighterDetailsScraper
+from src.createdata.scrape_store import STORES, set_scrape_store
+from src.createdata.utils import MAX_WORKERS, set_response_cache
+
+from src.createdata.data_files_path import (  # isort:skip
+    FIGHTER_DETAILS,
+    FIGHTER_DETAILS_DATASET,
+    FIGHTER_DIMENSION,
+    FIGHTER_FEATURES_DATASET,
+    FIGHTER_STATE_DATASET,
+    METRICS_TEXTFILE,
+    PREPROCESSED_DATA,
+    PREPROCESSED_DATASET,
+    RAW_FIGHTS_DATASET,
+    RUN_REPORT,
+    TOTAL_EVENT_AND_FIGHTS,
+    UFC_DATA,
+    UFC_DATASET,
+)
+
+# Named parts of the pipeline that can be run on their own, every stage can be as well.
+SUBGRAPHS = {"scrape": ["fights", "fighters"], "preprocess": ["preprocess"]}
+
+# The parse processes import this module, only a direct run may scrape.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape and preprocess ufcstats data.")
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Replay every page from the response cache in data/http_cache, never "
+        "touching the network.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always download pages instead of consulting the response cache.",
+    )
+    parser.add_argument(
+        "--full-discovery",
+        action="store_true",
+        help="Read the full event and fighter listings instead of stopping at the "
+        "first known event.",
+    )
+    parser.add_argument(
+        "--no-fighter-refresh",
+        action="store_true",
+        help="Do not refresh the career stats of known fighters who fought since the "
+        "last run.",
+    )
+    parser.add_argument(
+        "--parse-processes",
+        type=int,
+        default=PARSE_PROCESSES,
+        help="Processes parsing the fetched pages, 1 parses them in the fetching "
+        "threads.",
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        help="Seconds the scrapers may take. Events and fighters are scraped newest "
+        "first, what is left when the time is up is scraped by the next run.",
+    )
+    parser.add_argument(
+        "--max-requests",
+        type=int,
+        help="Pages the scrapers may fetch, like --time-budget.",
+    )
+    parser.add_argument(
+        "--run",
+        default="all",
+        choices=["all", *SUBGRAPHS, "fights", "fighters"],
+        help="Part of the pipeline to run, the rest is taken as it is on disk.",
+    )
+    parser.add_argument(
+        "--no-csv",
+        action="store_true",
+        help="Only save data and preprocessed_data as Parquet in data/parquet, without "
+        "the csv files.",
+    )
+    parser.add_argument(
+        "--store",
+        choices=STORES,
+        default="files",
+        help="Where the scrapers keep the events and fighters they know of, the "
+        "pickles or an SQLite database in data/scrape_store.sqlite3.",
+    )
+    parser.add_argument(
+        "--rebuild-features",
+        action="store_true",
+        help="Compute the fighter features of every fight again instead of only those "
+        "of new fights, and check that the stored ones are identical.",
+    )
+    parser.add_argument(
+        "--feature-processes",
+        type=int,
+        default=1,
+        help="Processes computing the fighter features when they are computed for "
+        "every fight, each taking a share of the fighters. Worth it on long histories "
+        "with several cores.",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Keep names and other strings as categoricals and integers in 32 bits "
+        "while preprocessing, which takes less memory and writes the same files.",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=float,
+        help="Megabytes of memory preprocessing should stay within, it warns when it "
+        "went over.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Run every stage, even those whose inputs did not change since the last "
+        "run.",
+    )
+    args = parser.parse_args()
+
+    if args.offline and args.no_cache:
+        parser.error(
+            "--offline needs the response cache, it cannot be combined with --no-cache"
+        )
+    set_response_cache(None if args.no_cache else ResponseCache(offline=args.offline))
+    store = STORES[args.store]()
+    set_scrape_store(store)
+
+    # One concurrency budget shared by every page the scrapers fetch.
+    engine = ScrapeEngine(
+        max_concurrency=MAX_WORKERS,
+        parse_processes=args.parse_processes,
+        budget=ScrapeBudget(seconds=args.time_budget, max_requests=args.max_requests),
+    )
+
+    def create_fight_data() -> None:
+        print("Creating fight data \n")
+        fight_data_scraper = FightDataScraper(
+            engine=engine, full_discovery=args.full_discovery
+        )
+        # Scrapes raw ufc fight data from website
+        fight_data_scraper.create_fight_data_csv()
+
+    def create_fighter_data() -> None:
+        print("Creating fighter data \n")
+        fighter_details_scraper = FighterDetailsScraper(
+            engine=engine,
+            full_discovery=args.full_discovery,
+            refresh_active=not args.no_fighter_refresh,
+        )
+        # Scrapes raw ufc fighter data from website
+        fighter_details_scraper.create_fighter_data_csv()
+
+    def preprocess() -> None:
+        if not FIGHTER_DETAILS.exists() and engine.budget.spent():
+            print(
+                "No fighter data to preprocess yet, the scrape budget ran out first.\n"
+            )
+            return
+        print("Starting Preprocessing \n")
+        preprocessor = Preprocessor(
+            export_csv=not args.no_csv,
+            feature_store=FighterFeatureStore(rebuild=args.rebuild_features),
+            feature_processes=args.feature_processes,
+            compact=args.compact,
+            memory_budget=(
+                None
+                if args.memory_budget is None
+                else int(args.memory_budget * 2 ** 20)
+            ),
+        )
+        # Preprocesses the raw data and saves the csv files in data folder
+        preprocessor.process_raw_data()
 
-time_start = time.time()
-print("Creating fight data \n")
-fight_data_scraper = FightDataScraper()
-fight_data_scraper.create_fight_data_csv()  # Scrapes raw ufc fight data from website
-print(f'elapsed seconds = {(time.time() - time_start):.2f}')
-
-time_start = time.time()
-print("Creating fighter data \n")
-fighter_details_scraper = FighterDetailsScraper()
-fighter_details_scraper.create_fighter_data_csv()  # Scrapes raw ufc fighter data from website
-print(f'elapsed seconds = {(time.time() - time_start):.2f}')
-
-time_start = time.time()
-print("Starting Preprocessing \n")
-preprocessor = Preprocessor()
-preprocessor.process_raw_data()  # Preprocesses the raw data and saves the csv files in data folder
-print(f'elapsed seconds = {(time.time() - time_start):.3f}')
+    pipeline = Pipeline(
+        [
+            Stage(
+                "fights",
+                create_fight_data,
+                outputs=(
+                    TOTAL_EVENT_AND_FIGHTS,
+                    RAW_FIGHTS_DATASET,
+                    store.DISCOVERED_FIGHTERS_PATH,
+                    FIGHTER_DIMENSION,
+                ),
+                external=True,
+            ),
+            # Takes the new fighters from the fight pages the fights stage scraped
+            Stage(
+                "fighters",
+                create_fighter_data,
+                inputs=(store.DISCOVERED_FIGHTERS_PATH,),
+                outputs=(FIGHTER_DETAILS, FIGHTER_DETAILS_DATASET),
+                external=True,
+            ),
+            # The preprocessing code is an input too, changing it runs the stage again
+            Stage(
+                "preprocess",
+                preprocess,
+                inputs=(
+                    RAW_FIGHTS_DATASET,
+                    FIGHTER_DETAILS_DATASET,
+                    FIGHTER_DIMENSION,
+                    Path(inspect.getfile(Preprocessor)),
+                    Path(inspect.getfile(FighterDetailProcessor)),
+                    Path(inspect.getfile(FighterFeatureStore)),
+                ),
+                outputs=(
+                    UFC_DATA,
+                    PREPROCESSED_DATA,
+                    UFC_DATASET,
+                    PREPROCESSED_DATASET,
+                    FIGHTER_FEATURES_DATASET,
+                    FIGHTER_STATE_DATASET,
+                ),
+                # The csv files are only written with export_csv
+                options={"compact": args.compact, "export_csv": not args.no_csv},
+            ),
+        ],
+        subgraphs=SUBGRAPHS,
+    )
+    try:
+        # The rebuild is a check, it runs even when nothing changed
+        pipeline.run(args.run, force=args.force or args.rebuild_features)
+    finally:
+        engine.close()
+        store.close()
+        get_metrics().write_report(RUN_REPORT, METRICS_TEXTFILE)
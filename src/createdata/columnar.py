@@ -0,0 +1,234 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Collection, Dict, List, Optional
+
+import pandas as pd
+
+from src.createdata.pipeline import file_hash
+
+PART_FILE = "part.parquet"
+MANIFEST_FILE = "_manifest.json"
+
+
+def frame_digest(frame: pd.DataFrame) -> str:
+    digest = hashlib.sha256()
+    digest.update(repr(list(zip(frame.columns, frame.dtypes.astype(str)))).encode())
+    digest.update(pd.util.hash_pandas_object(frame, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+class PartitionedDataset:
+    """
+    A table saved as Parquet, one folder per partition, e.g. year=2020/part.parquet.
+    Rows are kept newest first like the csv files, partitions are read in descending
+    order. Saving a table only writes the partitions whose rows changed, so an update
+    with new events writes the current year and leaves the older years alone.
+
+    A dataset saved without partitions is a single part.parquet.
+    """
+
+    def __init__(self, path: Path, partition_name: str = "year"):
+        self.path = path
+        self.partition_name = partition_name
+        self.manifest_path = path / MANIFEST_FILE
+
+    def exists(self) -> bool:
+        return self.manifest_path.exists()
+
+    def _load_manifest(self) -> Dict:
+        if not self.exists():
+            return {"source": None, "partitions": {}}
+        with open(self.manifest_path.as_posix(), "r") as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest: Dict) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.as_posix(), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_path, self.manifest_path.as_posix())
+
+    def _partition_dir(self, partition: str) -> Path:
+        if partition == "":
+            return self.path
+        return self.path / f"{self.partition_name}={partition}"
+
+    def source(self) -> Optional[str]:
+        return self._load_manifest()["source"]
+
+    def partitions(self) -> List[str]:
+        return sorted(
+            self._load_manifest()["partitions"],
+            key=lambda partition: (len(partition), partition),
+            reverse=True,
+        )
+
+    def read(
+        self,
+        columns: Optional[List[str]] = None,
+        partitions: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """
+        Reads the dataset, only the `columns` asked for are read from the files. With
+        `partitions` only those of them that exist are read, at least one has to.
+        """
+        if not self.exists():
+            raise FileNotFoundError(f"Cannot find the dataset {self.path}")
+        frames = [
+            pd.read_parquet(self._partition_dir(partition) / PART_FILE, columns=columns)
+            for partition in self.partitions()
+            if partitions is None or partition in partitions
+        ]
+        frame = pd.concat(frames)
+        if frame.index.name is None:
+            frame.reset_index(drop=True, inplace=True)
+        return frame
+
+    def save(
+        self,
+        frame: pd.DataFrame,
+        partitions: Optional[pd.Series] = None,
+        source: Optional[str] = None,
+    ) -> List[str]:
+        """
+        Saves `frame` split by the values of `partitions`, a series aligned with it, or
+        as a single file without them. `source` is recorded to tell later whether the
+        data it came from changed. Returns the partitions that were written.
+        """
+        # An empty table is kept as a single file, so it is read with its columns
+        if frame.empty:
+            partitions = None
+        return self._write(self._groups(frame, partitions), source)
+
+    def update(
+        self, frame: pd.DataFrame, partitions: pd.Series, source: Optional[str] = None
+    ) -> List[str]:
+        """
+        Saves the partitions `frame` has rows of like `save`, the other partitions are
+        kept as they are.
+        """
+        groups = self._groups(frame, partitions)
+        # The single file of an empty table makes way for the partitions
+        kept = [partition for partition in self.partitions() if partition != ""]
+        return self._write(groups, source, kept_partitions=kept if groups else None)
+
+    @staticmethod
+    def _groups(
+        frame: pd.DataFrame, partitions: Optional[pd.Series]
+    ) -> Dict[str, pd.DataFrame]:
+        # Only a named index is data, row numbers would change every partition
+        # whenever rows are added on top
+        if frame.index.name is None:
+            frame = frame.reset_index(drop=True)
+            partitions = (
+                None if partitions is None else partitions.reset_index(drop=True)
+            )
+        if partitions is None:
+            return {"": frame}
+        keys = partitions.astype(str)
+        groups = {key: frame[keys == key] for key in keys.unique()}
+        if frame.index.name is None:
+            groups = {key: rows.reset_index(drop=True) for key, rows in groups.items()}
+        return groups
+
+    def _write(
+        self,
+        groups: Dict[str, pd.DataFrame],
+        source: Optional[str],
+        kept_partitions: Optional[Collection[str]] = (),
+        source_digests: Optional[Dict[str, str]] = None,
+    ) -> List[str]:
+        """
+        Writes the partitions in `groups` whose rows changed. Of the others only the
+        `kept_partitions` are kept, all of them when it is None.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        manifest = self._load_manifest()
+        written = []
+        digests = {}
+        for partition, rows in groups.items():
+            digests[partition] = frame_digest(rows)
+            part_path = self._partition_dir(partition) / PART_FILE
+            if (
+                manifest["partitions"].get(partition) == digests[partition]
+                and part_path.exists()
+            ):
+                continue
+            part_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = part_path.with_suffix(".tmp")
+            rows.to_parquet(
+                tmp_path, compression="snappy", index=rows.index.name is not None
+            )
+            os.replace(tmp_path, part_path)
+            written.append(partition)
+
+        for partition, digest in manifest["partitions"].items():
+            if partition in digests:
+                continue
+            if kept_partitions is None or partition in kept_partitions:
+                digests[partition] = digest
+                continue
+            part_dir = self._partition_dir(partition)
+            if partition == "":
+                os.remove((part_dir / PART_FILE).as_posix())
+            elif part_dir.exists():
+                shutil.rmtree(part_dir.as_posix())
+
+        manifest = {"source": source, "partitions": digests}
+        if source_digests is not None:
+            manifest["source_partitions"] = source_digests
+        self._save_manifest(manifest)
+        return written
+
+    def save_csv(
+        self, csv_path: Path, partition_column: Optional[str] = None, **read_csv_kwargs
+    ) -> List[str]:
+        """
+        Saves the csv file at `csv_path`, partitioned by the year of its
+        `partition_column` dates. Nothing is read when the file did not change since it
+        was last saved. A partitioned file is read line by line, one row a line like
+        the fight data, and only the years whose lines changed are parsed and written.
+        """
+        source = file_hash(csv_path)
+        manifest = self._load_manifest()
+        if self.exists() and manifest["source"] == source:
+            return []
+        if partition_column is None:
+            return self.save(pd.read_csv(csv_path, **read_csv_kwargs), source=source)
+
+        sep = read_csv_kwargs.get("sep", ",")
+        lines: Dict[str, List[str]] = {}
+        with open(csv_path.as_posix(), "r") as f:
+            header = f.readline()
+            column = header.rstrip("\n").split(sep).index(partition_column)
+            for line in f:
+                # Fights without a date go to year=nan, as when parsed with pandas
+                year = line.split(sep)[column][:4] or "nan"
+                lines.setdefault(year, []).append(line)
+        if not lines:
+            return self.save(pd.read_csv(csv_path, **read_csv_kwargs), source=source)
+
+        source_digests = {
+            year: hashlib.sha256("".join(year_lines).encode()).hexdigest()
+            for year, year_lines in lines.items()
+        }
+        stored_digests = manifest.get("source_partitions", {})
+        unchanged = [
+            year
+            for year, digest in source_digests.items()
+            if stored_digests.get(year) == digest and year in manifest["partitions"]
+        ]
+        # Each year is parsed on its own, the dtypes of the years are reconciled when
+        # the dataset is read
+        groups = {
+            year: pd.read_csv(
+                io.StringIO(header + "".join(year_lines)), **read_csv_kwargs
+            )
+            for year, year_lines in lines.items()
+            if year not in unchanged
+        }
+        return self._write(groups, source, unchanged, source_digests)
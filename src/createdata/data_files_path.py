@@ -1,7 +1,8 @@
 import os
 from pathlib import Path
 
-BASE_PATH = Path(os.getcwd()) / "data"
+# UFC_DATA_DIR points the scrapers at another data folder, the benchmarks use it
+BASE_PATH = Path(os.environ.get("UFC_DATA_DIR", Path(os.getcwd()) / "data"))
 EVENT_AND_FIGHT_LINKS_PICKLE = BASE_PATH / "event_and_fight_links.pickle"
 PAST_EVENT_LINKS_PICKLE = BASE_PATH / "past_event_links.pickle"
 PAST_FIGHTER_LINKS_PICKLE = BASE_PATH / "past_fighter_links.pickle"
@@ -11,3 +12,24 @@ TOTAL_EVENT_AND_FIGHTS = BASE_PATH / "raw_total_fight_data.csv"
 PREPROCESSED_DATA = BASE_PATH / "preprocessed_data.csv"
 FIGHTER_DETAILS = BASE_PATH / "raw_fighter_details.csv"
 UFC_DATA = BASE_PATH / "data.csv"
+HTTP_CACHE_DIR = BASE_PATH / "http_cache"
+FIGHT_RUN_JOURNAL = BASE_PATH / "fight_run_journal.jsonl"
+FIGHTER_RUN_JOURNAL = BASE_PATH / "fighter_run_journal.jsonl"
+NEW_FIGHTER_LINKS_PICKLE = BASE_PATH / "new_fighter_links.pickle"
+PENDING_EVENTS_PICKLE = BASE_PATH / "pending_events.pickle"
+FAILED_URLS = BASE_PATH / "failed_urls.json"
+PIPELINE_STATE = BASE_PATH / "pipeline_state.json"
+RUN_REPORT = BASE_PATH / "run_report.json"
+METRICS_TEXTFILE = BASE_PATH / "ufc_pipeline.prom"
+SHARD_DIR = BASE_PATH / "shards"
+FIGHTER_DIMENSION = BASE_PATH / "fighter_dimension.csv"
+SCRAPE_DB = BASE_PATH / "scrape_store.sqlite3"
+# Parquet copies of the tables, partitioned by the year of the event
+PARQUET_DIR = BASE_PATH / "parquet"
+RAW_FIGHTS_DATASET = PARQUET_DIR / "raw_total_fight_data"
+FIGHTER_DETAILS_DATASET = PARQUET_DIR / "raw_fighter_details"
+UFC_DATASET = PARQUET_DIR / "data"
+PREPROCESSED_DATASET = PARQUET_DIR / "preprocessed_data"
+# What preprocessing knows of every fighter, to only featurize new fights
+FIGHTER_FEATURES_DATASET = PARQUET_DIR / "fighter_features"
+FIGHTER_STATE_DATASET = PARQUET_DIR / "fighter_state"
@@ -0,0 +1,61 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, List
+
+from src.createdata.data_files_path import FAILED_URLS
+
+# A page that still fails after this many runs is given up on and reported.
+MAX_RUNS = 3
+
+
+class FailedUrlQueue:
+    """
+    Pages that could not be scraped, kept across runs so the next run retries them
+    before doing anything else. Every entry has the "kind" of page, its "url", the
+    last "error", how many "runs" it failed in, and whatever else the scraper needs to
+    put the result where it belongs.
+    """
+
+    def __init__(self, filepath: Path = FAILED_URLS):
+        self.filepath = filepath
+        self._entries: Dict[str, Dict] = {}
+        if self.filepath.exists():
+            with open(self.filepath.as_posix(), "r") as f:
+                self._entries = {entry["url"]: entry for entry in json.load(f)}
+
+    def entries(self, kind: str) -> List[Dict]:
+        return [entry for entry in self._entries.values() if entry["kind"] == kind]
+
+    def add(self, kind: str, url: str, error: str, **context) -> None:
+        entry = self._entries.get(url, {"runs": 0})
+        entry.update(context, kind=kind, url=url, error=error, runs=entry["runs"] + 1)
+        if entry["runs"] >= MAX_RUNS:
+            print(f'\nGiving up on {url} after {entry["runs"]} runs: {entry["error"]}')
+            self._entries.pop(url, None)
+        else:
+            self._entries[url] = entry
+
+    def update(self, url: str, **context) -> None:
+        self._entries[url].update(context)
+
+    @staticmethod
+    def describe(error: Exception) -> str:
+        return f"{type(error).__name__}: {error}"
+
+    def discard(self, url: str) -> None:
+        self._entries.pop(url, None)
+
+    def save(self) -> None:
+        if not self._entries:
+            if self.filepath.exists():
+                os.remove(self.filepath.as_posix())
+            return
+        self.filepath.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.filepath.parent.as_posix(), suffix=".tmp"
+        )
+        with os.fdopen(fd, "w") as f:
+            json.dump(list(self._entries.values()), f, indent=1)
+        os.replace(tmp_path, self.filepath.as_posix())
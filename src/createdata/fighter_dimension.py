@@ -0,0 +1,131 @@
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+
+from src.createdata.data_files_path import FIGHTER_DIMENSION
+
+
+def ufcstats_id(fighter_url: str) -> str:
+    # "http://ufcstats.com/fighter-details/1338e2c7480bdf9e"
+    return fighter_url.rstrip("/").rsplit("/", 1)[-1]
+
+
+def fighter_links_by_url(fighter_links: Dict[str, str]) -> Dict[str, str]:
+    """
+    Fighter links are kept as {url: name}, so that fighters who share a name are not
+    lost. Maps saved by older versions were {name: url}, they are turned around.
+    """
+    if all(key.startswith("http") for key in fighter_links):
+        return fighter_links
+    return {url: name for name, url in fighter_links.items()}
+
+
+def known_fighter_ids(*fighter_link_maps: Dict[str, str]) -> Dict[str, Optional[str]]:
+    """
+    The ufcstats ids of the fighters in saved fighter link maps, by name. Names shared
+    by several fighters map to None, there is no telling which of them a name meant.
+    """
+    fighter_links = {}
+    for fighter_link_map in fighter_link_maps:
+        fighter_links.update(fighter_link_map)
+
+    fighter_ids: Dict[str, Optional[str]] = {}
+    for url, name in fighter_links.items():
+        fighter_ids[name] = None if name in fighter_ids else ufcstats_id(url)
+    return fighter_ids
+
+
+class FighterDimension:
+    """
+    Dense integer codes for every fighter in the fight data, keyed by the ufcstats
+    fighter id. A fighter keeps its code for good and new fighters get the next one, so
+    the codes can be joined on across runs. Fighters of rows scraped before the fight
+    data recorded ufcstats ids are keyed by their name instead.
+    """
+
+    COLUMNS = ["fighter_id", "ufcstats_id", "fighter_name"]
+
+    def __init__(self, filepath: Path = FIGHTER_DIMENSION):
+        self.filepath = filepath
+        self.codes: Dict[str, int] = {}
+        self.name_codes: Dict[str, int] = {}
+        self.names: Dict[int, str] = {}
+        if self.filepath.exists():
+            dimension = pd.read_csv(self.filepath, dtype=str, keep_default_na=False)
+            for code, fighter_id, name in dimension[self.COLUMNS].itertuples(
+                index=False
+            ):
+                self._set(int(code), fighter_id or None, name)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _set(self, code: int, fighter_id: Optional[str], name: str) -> None:
+        if fighter_id is None:
+            self.name_codes[name] = code
+        else:
+            self.codes[fighter_id] = code
+        self.names[code] = name
+
+    def code(self, fighter_id: Optional[str], name: str) -> int:
+        code = self.codes.get(fighter_id) if fighter_id else self.name_codes.get(name)
+        if code is None:
+            code = len(self.names)
+            self._set(code, fighter_id or None, name)
+        return code
+
+    def add_fights(self, fights: pd.DataFrame) -> int:
+        """
+        Gives every fighter of the fights, newest first like the fight data, a code.
+        Names can change on ufcstats, fighters take the name of their newest fight.
+        Returns the number of new and renamed fighters.
+        """
+        size = len(self)
+        # The position and name of every fighter's newest fight
+        newest: Dict[int, Tuple[int, str]] = {}
+        for corner in ("R", "B"):
+            for position, (fighter_id, name) in enumerate(
+                zip(fights[f"{corner}_ufcstats_id"], fights[f"{corner}_fighter"])
+            ):
+                code = self.code(None if pd.isna(fighter_id) else fighter_id, name)
+                if code not in newest or position < newest[code][0]:
+                    newest[code] = (position, name)
+
+        renamed = 0
+        for code, (_, name) in newest.items():
+            if self.names[code] != name:
+                self.names[code] = name
+                renamed += 1
+        return len(self) - size + renamed
+
+    def codes_of(self, fighter_ids: pd.Series, names: pd.Series) -> pd.Series:
+        codes = fighter_ids.map(self.codes).fillna(
+            names[fighter_ids.isna()].map(self.name_codes)
+        )
+        if codes.isna().any():
+            missing = names[codes.isna()].unique().tolist()
+            raise KeyError(
+                f"{self.filepath} has no code for {missing}, run the fights stage first"
+            )
+        return codes.astype(int)
+
+    def to_frame(self) -> pd.DataFrame:
+        ids = {code: fighter_id for fighter_id, code in self.codes.items()}
+        return pd.DataFrame(
+            {
+                "fighter_id": list(self.names),
+                "ufcstats_id": [ids.get(code) for code in self.names],
+                "fighter_name": list(self.names.values()),
+            }
+        ).sort_values("fighter_id")
+
+    def save(self) -> None:
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.filepath.parent.as_posix(), suffix=".tmp"
+        )
+        with os.fdopen(fd, "w") as f:
+            self.to_frame().to_csv(f, index=False)
+        os.replace(tmp_path, self.filepath.as_posix())
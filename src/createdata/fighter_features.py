@@ -0,0 +1,421 @@
+import json
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.createdata.columnar import PartitionedDataset, frame_digest
+from src.createdata.preprocess_fighter_data import (
+    ALPHA,
+    NUMERICAL_COLUMNS,
+    RESULT_STATS,
+    WIN_BY_COLUMNS,
+)
+
+from src.createdata.data_files_path import (  # isort:skip
+    FIGHTER_FEATURES_DATASET,
+    FIGHTER_STATE_DATASET,
+)
+
+FEATURE_COLUMNS = [
+    *NUMERICAL_COLUMNS,
+    "total_rounds_fought",
+    "total_title_bouts",
+    "hero_fighter_id",
+    *RESULT_STATS,
+    *WIN_BY_COLUMNS,
+]
+
+# Running totals of every fighter, the streaks are counted from the first fight on
+# like FighterDetailProcessor does
+COUNT_COLUMNS = [
+    "fights",
+    "first_win_run",
+    "first_lose_run",
+    "win_run",
+    "longest_win_streak",
+    "wins",
+    "losses",
+    "total_rounds_fought",
+    "total_title_bouts",
+    *WIN_BY_COLUMNS,
+]
+(
+    FIGHTS,
+    FIRST_WIN_RUN,
+    FIRST_LOSE_RUN,
+    WIN_RUN,
+    LONGEST_WIN_STREAK,
+    WINS,
+    LOSSES,
+    ROUNDS,
+    TITLE_BOUTS,
+) = range(9)
+WIN_BY = slice(9, None)
+
+CORNERS = (("red", "R_", "B_"), ("blue", "B_", "R_"))
+
+# The state is kept in partitions of this many fighter codes, an update reads and
+# writes those of the fighters in the new fights
+STATE_PARTITION_SIZE = 64
+
+
+def _corner_column(column: str, hero: str, opp: str) -> str:
+    if column.startswith("hero_"):
+        return hero + column[len("hero_") :]
+    if column.startswith("opp_"):
+        return opp + column[len("opp_") :]
+    return column
+
+
+class FighterState:
+    """
+    What the features of a fighter's next fight are computed from: the exponentially
+    weighted averages of the numerical columns with the weight pandas keeps next to
+    each of them, and the running totals. Rows are fighter codes.
+    """
+
+    def __init__(self, size: int, frame: Optional[pd.DataFrame] = None):
+        self.averages = np.full((size, len(NUMERICAL_COLUMNS)), np.nan)
+        self.weights = np.ones((size, len(NUMERICAL_COLUMNS)))
+        self.counts = np.zeros((size, len(COUNT_COLUMNS)))
+        if frame is not None:
+            fighters = frame.index.to_numpy()
+            self.averages[fighters] = frame[NUMERICAL_COLUMNS].to_numpy()
+            self.weights[fighters] = frame[
+                [f"{column}_weight" for column in NUMERICAL_COLUMNS]
+            ].to_numpy()
+            self.counts[fighters] = frame[COUNT_COLUMNS].to_numpy()
+
+    def to_frame(self) -> pd.DataFrame:
+        fighters = np.flatnonzero(self.counts[:, FIGHTS])
+        frame = pd.concat(
+            [
+                pd.DataFrame(self.averages[fighters], columns=NUMERICAL_COLUMNS),
+                pd.DataFrame(
+                    self.weights[fighters],
+                    columns=[f"{column}_weight" for column in NUMERICAL_COLUMNS],
+                ),
+                pd.DataFrame(self.counts[fighters], columns=COUNT_COLUMNS),
+            ],
+            axis=1,
+        )
+        frame.index = pd.Index(fighters, name="fighter_id")
+        return frame
+
+    def add_fight(
+        self,
+        fighter: int,
+        values: np.ndarray,
+        won: bool,
+        last_round,
+        title_bout,
+        win_by: np.ndarray,
+    ) -> None:
+        # The steps of pandas' ewm(adjust=False), so the averages come out the same
+        average = self.averages[fighter]
+        weight = self.weights[fighter]
+        seen = ~np.isnan(average)
+        observed = ~np.isnan(values)
+        weight[seen] *= 1 - ALPHA
+        moved = seen & observed & (average != values)
+        average[moved] = (weight[moved] * average[moved] + ALPHA * values[moved]) / (
+            weight[moved] + ALPHA
+        )
+        weight[seen & observed] = 1.0
+        average[~seen & observed] = values[~seen & observed]
+
+        counts = self.counts[fighter]
+        if won:
+            if counts[FIRST_WIN_RUN] == counts[FIGHTS]:
+                counts[FIRST_WIN_RUN] += 1
+            counts[WIN_RUN] += 1
+            counts[LONGEST_WIN_STREAK] = max(
+                counts[LONGEST_WIN_STREAK], counts[WIN_RUN]
+            )
+            counts[WINS] += 1
+            counts[WIN_BY] += win_by
+        else:
+            if counts[FIRST_LOSE_RUN] == counts[FIGHTS]:
+                counts[FIRST_LOSE_RUN] += 1
+            counts[WIN_RUN] = 0
+            counts[LOSSES] += 1
+        counts[FIGHTS] += 1
+        counts[ROUNDS] += last_round
+        counts[TITLE_BOUTS] += title_bout
+
+
+class FighterFeatureStore:
+    """
+    Keeps the fighter features of every fight and the state of every fighter after
+    their latest fight in data/parquet, so that preprocessing only computes the
+    features of the fights added on top since its last run. Only the state of the
+    fighters in the new fights is read and updated.
+
+    The state records how far it got: the number of fights, how many of them each year
+    had and a digest of those of the newest year. When they do not match the fights
+    any more, e.g. a failed fight was scraped into its place further down, everything
+    is computed again. `rebuild` always does, which also catches changes to the fights
+    of earlier years, and checks that the features kept so far and those the state
+    gives are identical to the full computation.
+    """
+
+    def __init__(
+        self,
+        rebuild: bool = False,
+        features_path=FIGHTER_FEATURES_DATASET,
+        state_path=FIGHTER_STATE_DATASET,
+    ):
+        self.rebuild = rebuild
+        self.features = PartitionedDataset(features_path)
+        self.state = PartitionedDataset(state_path, partition_name="fighters")
+
+    @staticmethod
+    def _years(fights: pd.DataFrame) -> pd.Series:
+        return fights["date"].astype(str).str[:4]
+
+    @classmethod
+    def _high_water_mark(cls, fights: pd.DataFrame) -> Dict:
+        years = cls._years(fights)
+        newest_year = years.iat[0] if len(fights) else None
+        # Row numbers of the older fights change as new ones are added on top
+        newest_fights = fights[(years == newest_year).to_numpy()].reset_index(drop=True)
+        return {
+            "fights": len(fights),
+            "years": {year: int(count) for year, count in years.value_counts().items()},
+            "newest_year": newest_year,
+            "digest": frame_digest(newest_fights),
+        }
+
+    def _new_fights(self, fights: pd.DataFrame) -> Optional[int]:
+        # The number of fights added on top of those the state was brought up to, if
+        # they are still the oldest fights, as they were
+        if not (self.features.exists() and self.state.exists()):
+            return None
+        try:
+            mark = json.loads(self.state.source())
+        except (TypeError, ValueError):
+            mark = None
+        # States saved with a digest of all the fights are computed again
+        if not isinstance(mark, dict):
+            return None
+        new_fights = len(fights) - mark["fights"]
+        if new_fights < 0 or self._high_water_mark(fights.iloc[new_fights:]) != mark:
+            return None
+        return new_fights
+
+    def _stored_features(self, stored_fights: int) -> Optional[pd.DataFrame]:
+        features = self.features.read().sort_index(kind="mergesort")
+        # Features stored while the wins by method were counted as floats are computed
+        # again
+        if (
+            list(features.columns) != [*FEATURE_COLUMNS, "corner"]
+            or not all(
+                pd.api.types.is_integer_dtype(features[column])
+                for column in WIN_BY_COLUMNS
+            )
+            or len(features) != 2 * stored_fights
+        ):
+            return None
+        return features
+
+    def fighter_data(
+        self,
+        fights: pd.DataFrame,
+        calculate: Callable[[], Tuple[pd.DataFrame, pd.DataFrame]],
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        The features of the red and of the blue corner of `fights` like
+        FighterDetailProcessor._calculate_fighter_data returns them, which
+        `calculate` is called for when everything is computed again.
+        """
+        new_fights = self._new_fights(fights)
+        features = None
+        if new_fights is not None:
+            features = self._stored_features(len(fights) - new_fights)
+        if self.rebuild or features is None:
+            return self._rebuild(fights, calculate, features)
+
+        if new_fights:
+            state = self._load_state(fights, fights.iloc[:new_fights])
+            new_features = self._featurize(fights.iloc[:new_fights], state, len(fights))
+            features = pd.concat([features, new_features]).sort_index(kind="mergesort")
+            self._update(fights, features, state, new_fights)
+            print(f"Computed the fighter features of {new_fights} new fights")
+        return self._corner_frames(features, len(fights))
+
+    def _rebuild(self, fights, calculate, stored) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        print(f"Computing the fighter features of all {len(fights)} fights")
+        red_frame, blue_frame = calculate()
+        features = self._long_frame(red_frame, blue_frame, len(fights))
+        state = FighterState(self._state_size(fights))
+        featurized = self._featurize(fights, state, len(fights))
+        self._save(fights, features, state)
+        if self.rebuild:
+            self._check(features, featurized, stored)
+        return red_frame, blue_frame
+
+    def _check(self, features, featurized, stored) -> None:
+        differing = _differing_columns(features, featurized)
+        if differing:
+            raise ValueError(
+                "Fighter features computed fight by fight differ from the full "
+                f"computation in {differing}"
+            )
+        if stored is None:
+            print(
+                "No stored fighter features to check, the fights changed since they "
+                "were computed"
+            )
+            return
+        differing = _differing_columns(
+            features[features.index.isin(stored.index)], stored
+        )
+        if differing:
+            raise ValueError(
+                "The stored fighter features differed from the full computation in "
+                f"{differing}, they were computed again"
+            )
+        print("The stored fighter features are identical to the full computation")
+
+    def _state_size(self, fights: pd.DataFrame, frame=None) -> int:
+        codes = [fights["R_fighter_id"].max(), fights["B_fighter_id"].max()]
+        if frame is not None and len(frame):
+            codes.append(frame.index.max())
+        return int(max(codes)) + 1
+
+    @staticmethod
+    def _state_partitions(fighters) -> pd.Series:
+        return pd.Series(np.asarray(fighters) // STATE_PARTITION_SIZE, index=fighters)
+
+    def _load_state(
+        self, fights: pd.DataFrame, new_fights: pd.DataFrame
+    ) -> FighterState:
+        # Only the partitions of the fighters in the new fights
+        fighters = np.union1d(new_fights["R_fighter_id"], new_fights["B_fighter_id"])
+        partitions = set(self._state_partitions(fighters).astype(str))
+        stored = [
+            partition
+            for partition in self.state.partitions()
+            if partition in partitions
+        ]
+        frame = self.state.read(partitions=stored) if stored else None
+        return FighterState(self._state_size(fights, frame), frame)
+
+    def _feature_years(self, fights, features) -> pd.Series:
+        # Features are saved by the year of their fight
+        years = self._years(fights).to_numpy()[::-1]
+        return pd.Series(years[features.index], index=features.index)
+
+    def _save(self, fights, features, state: FighterState) -> None:
+        self.features.save(features, self._feature_years(fights, features))
+        frame = state.to_frame()
+        self.state.save(
+            frame,
+            self._state_partitions(frame.index),
+            source=json.dumps(self._high_water_mark(fights)),
+        )
+
+    def _update(self, fights, features, state: FighterState, new_fights: int) -> None:
+        # Only the years of the new fights and the fighters in them are written again
+        years = self._feature_years(fights, features)
+        in_new_years = years.isin(self._years(fights.iloc[:new_fights])).to_numpy()
+        self.features.update(features[in_new_years], years[in_new_years])
+        frame = state.to_frame()
+        self.state.update(
+            frame,
+            self._state_partitions(frame.index),
+            source=json.dumps(self._high_water_mark(fights)),
+        )
+
+    @staticmethod
+    def _featurize(fights, state: FighterState, fight_count: int) -> pd.DataFrame:
+        """
+        The features of `fights`, the newest on top, from the state of their fighters,
+        which is brought up to date with them. Fights are numbered from the oldest of
+        all `fight_count` fights, which the new ones are on top of.
+        """
+        last_rounds = fights["last_round"].fillna(0)
+        title_bouts = (fights["title_bout"] == True).to_numpy()
+        win_by = fights[WIN_BY_COLUMNS].to_numpy(dtype=float)
+        corners = []
+        for corner, hero, opp in CORNERS:
+            corners.append(
+                (
+                    corner,
+                    fights[hero + "fighter_id"].to_numpy(),
+                    fights[
+                        [
+                            _corner_column(column, hero, opp)
+                            for column in NUMERICAL_COLUMNS
+                        ]
+                    ].to_numpy(dtype=float),
+                    (fights["Winner"] == fights[hero + "fighter"]).to_numpy(),
+                    np.full((len(fights), len(NUMERICAL_COLUMNS)), np.nan),
+                    np.zeros((len(fights), len(COUNT_COLUMNS))),
+                )
+            )
+
+        # Fights are added in the order they happened
+        for row in reversed(range(len(fights))):
+            for _, fighters, values, won, averages, counts in corners:
+                fighter = fighters[row]
+                averages[row] = state.averages[fighter]
+                counts[row] = state.counts[fighter]
+                state.add_fight(
+                    fighter,
+                    values[row],
+                    won[row],
+                    last_rounds.iat[row],
+                    title_bouts[row],
+                    win_by[row],
+                )
+
+        fight_numbers = pd.Index(
+            fight_count - 1 - np.arange(len(fights)), name="fight_number"
+        )
+        frames = []
+        for corner, fighters, _, _, averages, counts in corners:
+            frame = pd.DataFrame(
+                averages, columns=NUMERICAL_COLUMNS, index=fight_numbers
+            )
+            # In 64 bits like the full computation
+            frame["total_rounds_fought"] = counts[:, ROUNDS].astype(
+                np.result_type(last_rounds.dtype, np.int64)
+            )
+            frame["total_title_bouts"] = counts[:, TITLE_BOUTS].astype(int)
+            frame["hero_fighter_id"] = fighters
+            for result_stat, column in zip(
+                RESULT_STATS,
+                [FIRST_WIN_RUN, FIRST_LOSE_RUN, LONGEST_WIN_STREAK, WINS, LOSSES],
+            ):
+                frame[result_stat] = counts[:, column].astype(int)
+            frame["draw"] = 0
+            for win_by_column, values in zip(WIN_BY_COLUMNS, counts[:, WIN_BY].T):
+                frame[win_by_column] = values.astype(int)
+            frame["corner"] = corner
+            frames.append(frame)
+        return pd.concat(frames).sort_index(kind="mergesort")
+
+    @staticmethod
+    def _long_frame(red_frame, blue_frame, fight_count: int) -> pd.DataFrame:
+        frames = []
+        for corner, frame in (("red", red_frame), ("blue", blue_frame)):
+            frame = frame[FEATURE_COLUMNS].copy()
+            frame["corner"] = corner
+            frame.index = pd.Index(fight_count - 1 - frame.index, name="fight_number")
+            frames.append(frame)
+        return pd.concat(frames).sort_index(kind="mergesort")
+
+    @staticmethod
+    def _corner_frames(features, fight_count: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        frames = []
+        for corner in ("red", "blue"):
+            frame = features[features["corner"] == corner].drop(columns="corner")
+            frame.index = pd.Index(fight_count - 1 - frame.index).rename(None)
+            frames.append(frame.sort_index())
+        return frames[0], frames[1]
+
+
+def _differing_columns(left: pd.DataFrame, right: pd.DataFrame) -> List[str]:
+    return [column for column in left.columns if not left[column].equals(right[column])]
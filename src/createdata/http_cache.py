@@ -0,0 +1,107 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+from src.createdata.data_files_path import HTTP_CACHE_DIR
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+# How long a cached page stays fresh, by url class. The first matching pattern wins and
+# None means the page never expires. Completed fight pages are pinned separately, see
+# `ResponseCache._is_immutable`.
+URL_TTLS = [
+    (re.compile(r"/statistics/events/completed"), 12 * HOUR),
+    (re.compile(r"/statistics/fighters\?"), DAY),
+    (re.compile(r"/event-details/"), DAY),
+    (re.compile(r"/fight-details/"), DAY),
+    (re.compile(r"/fighter-details/"), 7 * DAY),
+]
+DEFAULT_TTL = DAY
+
+
+class CacheMissError(Exception):
+    pass
+
+
+class ResponseCache:
+    """
+    Compressed, content addressed cache of fetched pages.
+    Page bodies are stored once under `objects/` by the sha256 of their content, and
+    every url has a small entry under `urls/` pointing at its current body.
+    In offline mode entries never expire and a miss raises CacheMissError instead of
+    going to the network.
+    """
+
+    def __init__(self, cache_dir: Path = HTTP_CACHE_DIR, offline: bool = False):
+        self.cache_dir = cache_dir
+        self.offline = offline
+
+    def get(self, url: str) -> Optional[str]:
+        entry = self._read_entry(url)
+        if entry is None:
+            return None
+        if not self.offline and not entry["immutable"]:
+            ttl = self._get_ttl(url)
+            if ttl is not None and time.time() - entry["fetched_at"] > ttl:
+                return None
+        object_path = self._object_path(entry["digest"])
+        if not object_path.exists():
+            return None
+        with gzip.open(object_path.as_posix(), "rb") as f:
+            return f.read().decode("utf-8")
+
+    def put(self, url: str, text: str) -> None:
+        body = text.encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()
+        object_path = self._object_path(digest)
+        if not object_path.exists():
+            self._atomic_write(object_path, gzip.compress(body))
+        entry = {
+            "url": url,
+            "digest": digest,
+            "fetched_at": time.time(),
+            "immutable": self._is_immutable(url, text),
+        }
+        self._atomic_write(self._entry_path(url), json.dumps(entry).encode("utf-8"))
+
+    @staticmethod
+    def _get_ttl(url: str) -> Optional[float]:
+        for pattern, ttl in URL_TTLS:
+            if pattern.search(url):
+                return ttl
+        return DEFAULT_TTL
+
+    @staticmethod
+    def _is_immutable(url: str, text: str) -> bool:
+        # Stats tables are only published once a fight has taken place, after that the
+        # page does not change.
+        return "/fight-details/" in url and "b-fight-details__table-body" in text
+
+    def _read_entry(self, url: str) -> Optional[dict]:
+        entry_path = self._entry_path(url)
+        if not entry_path.exists():
+            return None
+        with open(entry_path.as_posix(), "r") as f:
+            return json.load(f)
+
+    def _entry_path(self, url: str) -> Path:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return self.cache_dir / "urls" / key[:2] / f"{key}.json"
+
+    def _object_path(self, digest: str) -> Path:
+        return self.cache_dir / "objects" / digest[:2] / f"{digest}.gz"
+
+    @staticmethod
+    def _atomic_write(path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent.as_posix(), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path.as_posix())
@@ -0,0 +1,202 @@
+import bisect
+import contextlib
+import datetime
+import json
+import os
+import resource
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds in seconds of the latency histogram buckets, the last one is +Inf
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets=SECONDS_BUCKETS):
+        self.buckets = buckets
+        # One count per bucket plus the +Inf bucket, not cumulative
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> List[int]:
+        counts, total = [], 0
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+
+class Metrics:
+    """
+    Counters, histograms and stage timings of one run, safe to update from any thread.
+    Metrics are named and labelled the Prometheus way, e.g.
+    increment("ufc_http_requests_total", status="200").
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.stages: List[Dict] = []
+        self.started = datetime.datetime.now()
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, object]) -> Tuple[str, Labels]:
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    @contextlib.contextmanager
+    def stage(
+        self, name: str, memory: Optional[Callable[[], Optional[int]]] = None
+    ) -> Iterator[None]:
+        """
+        Records the wall and CPU time of the block, and the peak memory of the process
+        by the end of it. CPU time is that of the whole process, stages that run at the
+        same time share it. `memory` gives the bytes the stage's data takes after it,
+        which unlike the peak can go down again.
+        """
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        status = "failed"
+        try:
+            yield
+            status = "ok"
+        finally:
+            stage = {
+                "stage": name,
+                "status": status,
+                "wall_seconds": time.perf_counter() - wall_start,
+                "cpu_seconds": time.process_time() - cpu_start,
+                # ru_maxrss is in kilobytes on Linux
+                "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                * 1024,
+            }
+            frame_bytes = memory() if memory is not None else None
+            if frame_bytes is not None:
+                stage["frame_bytes"] = frame_bytes
+            with self._lock:
+                self.stages.append(stage)
+
+    def report(self) -> Dict:
+        with self._lock:
+            return {
+                "started": self.started.isoformat(timespec="seconds"),
+                "finished": datetime.datetime.now().isoformat(timespec="seconds"),
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "histograms": [
+                    {
+                        "name": name,
+                        "labels": dict(labels),
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "buckets": dict(
+                            zip(
+                                [str(bound) for bound in histogram.buckets] + ["+Inf"],
+                                histogram.cumulative_counts(),
+                            )
+                        ),
+                    }
+                    for (name, labels), histogram in sorted(self.histograms.items())
+                ],
+                "stages": list(self.stages),
+            }
+
+    def prometheus_text(self) -> str:
+        report = self.report()
+        lines = []
+
+        def sample(name: str, labels: Dict[str, str], value) -> str:
+            if not labels:
+                return f"{name} {value}"
+            label_text = ",".join(
+                f'{key}="{value}"' for key, value in sorted(labels.items())
+            )
+            return f"{name}{{{label_text}}} {value}"
+
+        typed = set()
+        for counter in report["counters"]:
+            if counter["name"] not in typed:
+                typed.add(counter["name"])
+                lines.append(f'# TYPE {counter["name"]} counter')
+            lines.append(sample(counter["name"], counter["labels"], counter["value"]))
+        for histogram in report["histograms"]:
+            name = histogram["name"]
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            for bound, count in histogram["buckets"].items():
+                lines.append(
+                    sample(
+                        f"{name}_bucket", {**histogram["labels"], "le": bound}, count
+                    )
+                )
+            lines.append(sample(f"{name}_sum", histogram["labels"], histogram["sum"]))
+            lines.append(
+                sample(f"{name}_count", histogram["labels"], histogram["count"])
+            )
+        for field in ("wall_seconds", "cpu_seconds", "peak_rss_bytes", "frame_bytes"):
+            stages = [stage for stage in report["stages"] if field in stage]
+            if not stages:
+                continue
+            lines.append(f"# TYPE ufc_stage_{field} gauge")
+            for stage in stages:
+                lines.append(
+                    sample(
+                        f"ufc_stage_{field}", {"stage": stage["stage"]}, stage[field]
+                    )
+                )
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, json_path: Path, textfile_path: Path) -> None:
+        """
+        Writes the JSON run report and the Prometheus textfile. Both are replaced
+        atomically, so a textfile collector never reads half a file.
+        """
+        _write_atomically(json_path, json.dumps(self.report(), indent=1))
+        _write_atomically(textfile_path, self.prometheus_text())
+
+
+def _write_atomically(filepath: Path, text: str) -> None:
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=filepath.parent.as_posix(), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, filepath.as_posix())
+
+
+_metrics: Optional[Metrics] = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = Metrics()
+    return _metrics
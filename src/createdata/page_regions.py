@@ -0,0 +1,49 @@
+from typing import Dict, Optional
+
+from bs4 import SoupStrainer
+from bs4.builder import builder_registry
+
+# lxml builds the trees faster when it is installed
+HTML_PARSER = "lxml" if builder_registry.lookup("lxml") else "html.parser"
+
+
+def _class_of(attrs) -> str:
+    cls = attrs.get("class", "")
+    return " ".join(cls) if isinstance(cls, list) else cls
+
+
+def _fight_region(name, attrs) -> bool:
+    # Stats tables, the method/round/time/referee box, both fighters and the bout title
+    return name == "tbody" or _class_of(attrs) in {
+        "b-fight-details__content",
+        "b-fight-details__person",
+        "b-fight-details__fight-title",
+    }
+
+
+def _event_region(name, attrs) -> bool:
+    # Date/location items and the rows linking to each fight
+    return (name == "li" and _class_of(attrs) == "b-list__box-list-item") or (
+        name == "tr" and "js-fight-details-click" in _class_of(attrs)
+    )
+
+
+def _fighter_region(name, attrs) -> bool:
+    return name == "li" and "b-list__box-list-item_type_block" in _class_of(attrs)
+
+
+# Only the parts of each kind of ufcstats page that the scrapers read are parsed, the
+# rest of the document is skipped by the tree builder.
+PAGE_REGIONS: Dict[str, SoupStrainer] = {
+    "event_listing": SoupStrainer("td"),
+    "event": SoupStrainer(_event_region),
+    "fight": SoupStrainer(_fight_region),
+    "fighter_listing": SoupStrainer("tbody"),
+    "fighter": SoupStrainer(_fighter_region),
+}
+
+
+def get_page_region(page_type: Optional[str]) -> Optional[SoupStrainer]:
+    if page_type is None:
+        return None
+    return PAGE_REGIONS[page_type]
@@ -0,0 +1,165 @@
+import concurrent.futures
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from src.createdata.data_files_path import PIPELINE_STATE
+from src.createdata.metrics import get_metrics
+
+
+class Stage(NamedTuple):
+    name: str
+    run: Callable[[], None]
+    # Files the stage reads and writes. A stage that reads another stage's output runs
+    # after it.
+    inputs: Tuple[Path, ...] = ()
+    outputs: Tuple[Path, ...] = ()
+    # Stages that read ufcstats.com cannot tell from their files whether anything
+    # changed, they always run and leave that to the scrapers' own incremental updates.
+    external: bool = False
+    # Settings that change what the stage writes, changing one runs the stage again
+    options: Optional[Dict[str, object]] = None
+
+
+def file_hash(filepath: Path) -> Optional[str]:
+    if not filepath.exists():
+        return None
+    digest = hashlib.sha256()
+    # A folder, like a Parquet dataset, hashes the names and contents of its files
+    filepaths = sorted(filepath.rglob("*")) if filepath.is_dir() else [filepath]
+    for member in filepaths:
+        if member.is_dir():
+            continue
+        if member != filepath:
+            digest.update(member.relative_to(filepath).as_posix().encode("utf-8"))
+        with open(member.as_posix(), "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Pipeline:
+    """
+    Runs stages in the order their inputs and outputs imply, with stages that do not
+    depend on each other running concurrently. The content hashes of every stage's
+    inputs and outputs are saved after it succeeds, along with its options, and a stage
+    is skipped when its inputs hash the same as then, its options are the same and its
+    outputs are still what it wrote.
+    """
+
+    def __init__(
+        self,
+        stages: Iterable[Stage],
+        subgraphs: Optional[Dict[str, List[str]]] = None,
+        state_path: Path = PIPELINE_STATE,
+    ):
+        self.stages: Dict[str, Stage] = {stage.name: stage for stage in stages}
+        self.subgraphs = {"all": list(self.stages), **(subgraphs or {})}
+        self.state_path = state_path
+        self.dependencies: Dict[str, Set[str]] = {
+            stage.name: {
+                other.name
+                for other in self.stages.values()
+                if other.name != stage.name and set(other.outputs) & set(stage.inputs)
+            }
+            for stage in self.stages.values()
+        }
+
+    def targets(self) -> List[str]:
+        return list(self.subgraphs) + [
+            name for name in self.stages if name not in self.subgraphs
+        ]
+
+    def _load_state(self) -> Dict[str, Dict]:
+        if not self.state_path.exists():
+            return {}
+        with open(self.state_path.as_posix(), "r") as f:
+            return json.load(f)
+
+    def _save_state(self, state: Dict[str, Dict]) -> None:
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.state_path.parent.as_posix(), suffix=".tmp"
+        )
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f, indent=1)
+        os.replace(tmp_path, self.state_path.as_posix())
+
+    @staticmethod
+    def _hashes(filepaths: Iterable[Path]) -> Dict[str, Optional[str]]:
+        return {filepath.name: file_hash(filepath) for filepath in filepaths}
+
+    def _is_unchanged(self, stage: Stage, state: Dict[str, Dict]) -> bool:
+        if stage.external or stage.name not in state:
+            return False
+        previous = state[stage.name]
+        return (
+            previous["inputs"] == self._hashes(stage.inputs)
+            and previous["outputs"] == self._hashes(stage.outputs)
+            and previous.get("options", {}) == (stage.options or {})
+        )
+
+    def run(self, target: str = "all", force: bool = False) -> None:
+        """
+        Runs the stages of the subgraph or the single stage named `target`. Stages
+        outside of it are not run, their outputs are taken as they are on disk.
+        `force` runs every stage even if its inputs are unchanged.
+        """
+        names = self.subgraphs.get(target, [target])
+        unknown = [name for name in names if name not in self.stages]
+        if unknown:
+            raise ValueError(f"Unknown pipeline stages {unknown}")
+
+        state = self._load_state()
+        waiting = {name: self.dependencies[name] & set(names) for name in names}
+        running: Dict[concurrent.futures.Future, str] = {}
+        errors = []
+
+        def run_stage(stage: Stage) -> Optional[Dict]:
+            if not force and self._is_unchanged(stage, state):
+                print(
+                    f"Skipping {stage.name}, its inputs and options are unchanged since "
+                    "the last run\n"
+                )
+                return None
+            input_hashes = self._hashes(stage.inputs)
+            time_start = time.time()
+            with get_metrics().stage(stage.name):
+                stage.run()
+            print(f"{stage.name}: elapsed seconds = {(time.time() - time_start):.2f}\n")
+            return {
+                "inputs": input_hashes,
+                "outputs": self._hashes(stage.outputs),
+                "options": stage.options or {},
+            }
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(names)) as executor:
+            while waiting or running:
+                if not errors:
+                    for name in [name for name, deps in waiting.items() if not deps]:
+                        del waiting[name]
+                        running[executor.submit(run_stage, self.stages[name])] = name
+                if not running:
+                    break
+
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        errors.append(future.exception())
+                        continue
+                    if future.result() is not None:
+                        # Saved as each stage finishes, a later failure keeps it done
+                        state[name] = future.result()
+                        self._save_state(state)
+                    for deps in waiting.values():
+                        deps.discard(name)
+
+        if errors:
+            raise errors[0]
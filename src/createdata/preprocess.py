@@ -1,146 +1,199 @@
-import math
+from typing import Optional
 
 import numpy as np
 import pandas as pd
 
+from src.createdata.columnar import PartitionedDataset
+from src.createdata.fighter_dimension import FighterDimension
+from src.createdata.fighter_features import FighterFeatureStore
+from src.createdata.metrics import get_metrics
 from src.createdata.preprocess_fighter_data import FighterDetailProcessor
 
 from src.createdata.data_files_path import (  # isort:skip
-    FIGHTER_DETAILS,
+    FIGHTER_DETAILS_DATASET,
+    FIGHTER_DIMENSION,
     PREPROCESSED_DATA,
-    TOTAL_EVENT_AND_FIGHTS,
+    PREPROCESSED_DATASET,
+    RAW_FIGHTS_DATASET,
     UFC_DATA,
+    UFC_DATASET,
 )
 
+# The career stats in the fighter details are as of today, not as of each fight, only
+# these are read
+FIGHTER_ATTRIBUTES = ["Height_cms", "Weight_lbs", "Reach_cms", "Stance", "DOB"]
+
+
+def _map_distinct(column: pd.Series, func) -> pd.Series:
+    # Columns like Fight_type hold a few distinct values, each is parsed once
+    return column.map({value: func(value) for value in column.unique()})
+
 
 class Preprocessor:
-    def __init__(self):
-        self.FIGHTER_DETAILS_PATH = FIGHTER_DETAILS
-        self.TOTAL_EVENT_AND_FIGHTS_PATH = TOTAL_EVENT_AND_FIGHTS
+    def __init__(
+        self,
+        export_csv: bool = True,
+        feature_store: Optional[FighterFeatureStore] = None,
+        feature_processes: int = 1,
+        compact: bool = False,
+        memory_budget: Optional[int] = None,
+    ):
+        self.FIGHTER_DETAILS_DATASET_PATH = FIGHTER_DETAILS_DATASET
+        self.FIGHTER_DIMENSION_PATH = FIGHTER_DIMENSION
+        self.RAW_FIGHTS_DATASET_PATH = RAW_FIGHTS_DATASET
         self.PREPROCESSED_DATA_PATH = PREPROCESSED_DATA
+        self.PREPROCESSED_DATASET_PATH = PREPROCESSED_DATASET
         self.UFC_DATA_PATH = UFC_DATA
+        self.UFC_DATASET_PATH = UFC_DATASET
+        # data.csv and preprocessed_data.csv are written next to the Parquet datasets
+        self.export_csv = export_csv
+        self.feature_store = (
+            feature_store if feature_store is not None else FighterFeatureStore()
+        )
+        self.feature_processes = feature_processes
+        # Strings as categoricals and integers in 32 bits, with the same output
+        self.compact = compact
+        # Bytes of peak memory the run is expected to stay within
+        self.memory_budget = memory_budget
         self.fights = None
         self.fighter_details = None
         self.store = None
+        self.years = None
 
     def process_raw_data(self):
         print("Reading Files")
-        self.fights, self.fighter_details = self._read_files()
-
-        print("Drop columns that contain information not yet occurred")
-        self._drop_future_fighter_details_columns()
-
-        print("Renaming Columns")
-        self._rename_columns()
-        self._replacing_winner_nans_draw()
-
-        print("Converting Percentages to Fractions")
-        self._convert_percentages_to_fractions()
-        self._create_title_bout_feature()
-        self._create_weight_classes()
-        self._convert_last_round_to_seconds()
-        self._convert_CTRL_to_seconds()
-        self._get_total_time_fought()
-        self.store = self._store_compiled_fighter_data_in_another_DF()
-        self._create_winner_feature()
-        self._create_fighter_attributes()
-        self._create_fighter_age()
-        self._save(filepath=self.UFC_DATA_PATH)
+        self.fights, self.fighter_details = self._step(self._read_files)
+        self._step(self._code_fighters)
+
+        self._step(self._replacing_winner_nans_draw)
+
+        print("Filling Missing Percentages and Control Times")
+        self._step(self._fill_missing_percentages)
+        self._step(self._create_title_bout_feature)
+        self._step(self._create_weight_classes)
+        self._step(self._fill_missing_CTRL_times)
+        self._step(self._get_total_time_fought)
+        if self.compact:
+            self._step(self._compact_fights)
+        self.store = self._step(self._store_compiled_fighter_data_in_another_DF)
+        self._step(self._create_winner_feature)
+        if self.compact:
+            self.store["Winner"] = self.store["Winner"].astype("category")
+        self._step(self._create_fighter_attributes)
+        self._step(self._create_fighter_age)
+        self.years = self.store["date"].dt.year
+        self._step(
+            self._save,
+            dataset_path=self.UFC_DATASET_PATH,
+            csv_path=self.UFC_DATA_PATH,
+            step_name="save_ufc_data",
+        )
 
         print("Fill NaNs")
-        self._fill_nas()
+        self._step(self._fill_nas)
         print("Dropping Non Essential Columns")
-        self._drop_non_essential_cols()
-        self._save(filepath=self.PREPROCESSED_DATA_PATH)
+        self._step(self._drop_non_essential_cols)
+        self._step(
+            self._save,
+            dataset_path=self.PREPROCESSED_DATASET_PATH,
+            csv_path=self.PREPROCESSED_DATA_PATH,
+            step_name="save_preprocessed_data",
+        )
+        self._check_memory_budget()
         print("Successfully preprocessed and saved ufc data!\n")
 
+    def _step(self, func, *args, step_name=None, **kwargs):
+        # Every step is timed on its own in the run report, with the memory its tables
+        # take after it
+        step_name = step_name or func.__name__.strip("_")
+        with get_metrics().stage(f"preprocess:{step_name}", memory=self._frame_bytes):
+            return func(*args, **kwargs)
+
+    def _frame_bytes(self) -> Optional[int]:
+        frames = [
+            frame
+            for frame in (self.fights, self.fighter_details, self.store)
+            if frame is not None
+        ]
+        if not frames:
+            return None
+        return sum(int(frame.memory_usage(deep=True).sum()) for frame in frames)
+
+    def _check_memory_budget(self):
+        # The memory the tables took after every step is in the run report, see _step
+        if self.memory_budget is None:
+            return
+        peak_rss = max(
+            (
+                stage["peak_rss_bytes"]
+                for stage in get_metrics().report()["stages"]
+                if stage["stage"].startswith("preprocess:")
+            ),
+            default=0,
+        )
+        if peak_rss > self.memory_budget:
+            get_metrics().increment(
+                "ufc_memory_budget_exceeded_total",
+                stage="preprocess",
+                compact=self.compact,
+            )
+            hint = "" if self.compact else ", --compact keeps the tables smaller"
+            print(
+                f"Preprocessing went up to {peak_rss / 2**20:.1f} MB, over its memory "
+                f"budget of {self.memory_budget / 2**20:.1f} MB{hint}."
+            )
+
     def _read_files(self):
         try:
-            fights_df = pd.read_csv(self.TOTAL_EVENT_AND_FIGHTS_PATH, sep=";")
+            fights_df = PartitionedDataset(self.RAW_FIGHTS_DATASET_PATH).read()
 
         except Exception as e:
-            raise FileNotFoundError("Cannot find the data/total_fight_data.csv")
+            raise FileNotFoundError("Cannot find the data/parquet/raw_total_fight_data")
 
         try:
-            fighter_details_df = pd.read_csv(
-                self.FIGHTER_DETAILS_PATH, index_col="fighter_name"
-            )
+            fighter_details_df = PartitionedDataset(
+                self.FIGHTER_DETAILS_DATASET_PATH
+            ).read(columns=FIGHTER_ATTRIBUTES)
 
         except Exception as e:
-            raise FileNotFoundError("Cannot find the data/fighter_details.csv")
+            raise FileNotFoundError("Cannot find the data/parquet/raw_fighter_details")
 
         return fights_df, fighter_details_df
 
-    def _drop_future_fighter_details_columns(self):
-        self.fighter_details.drop(
-            columns=[
-                "SLpM",
-                "Str_Acc",
-                "SApM",
-                "Str_Def",
-                "TD_Avg",
-                "TD_Acc",
-                "TD_Def",
-                "Sub_Avg",
-            ],
-            inplace=True,
-        )
-
-    def _rename_columns(self):
-        columns = [
-            "R_SIG_STR.",
-            "B_SIG_STR.",
-            "R_TOTAL_STR.",
-            "B_TOTAL_STR.",
-            "R_TD",
-            "B_TD",
-            "R_HEAD",
-            "B_HEAD",
-            "R_BODY",
-            "B_BODY",
-            "R_LEG",
-            "B_LEG",
-            "R_DISTANCE",
-            "B_DISTANCE",
-            "R_CLINCH",
-            "B_CLINCH",
-            "R_GROUND",
-            "B_GROUND",
-        ]
-
-        attempt_suffix = "_att"
-        landed_suffix = "_landed"
-
-        for column in columns:
-            self.fights[column + attempt_suffix] = self.fights[column].apply(
-                lambda X: int(X.split("of")[1])
-            )
-            self.fights[column + landed_suffix] = self.fights[column].apply(
-                lambda X: int(X.split("of")[0])
+    def _code_fighters(self):
+        # Fighters are joined and grouped on their integer code, names are not unique
+        dimension = FighterDimension(self.FIGHTER_DIMENSION_PATH)
+        for corner in ["R", "B"]:
+            self.fights.insert(
+                self.fights.columns.get_loc(corner + "_ufcstats_id"),
+                corner + "_fighter_id",
+                dimension.codes_of(
+                    self.fights[corner + "_ufcstats_id"],
+                    self.fights[corner + "_fighter"],
+                ),
             )
+        self.fights.drop(["R_ufcstats_id", "B_ufcstats_id"], axis=1, inplace=True)
 
-        self.fights.drop(columns, axis=1, inplace=True)
+        fighter_details = self.fighter_details[
+            self.fighter_details.index.isin(dimension.codes.keys())
+        ]
+        fighter_details.index = fighter_details.index.map(dimension.codes)
+        fighter_details.index.name = "fighter_id"
+        self.fighter_details = fighter_details
 
     def _replacing_winner_nans_draw(self):
         self.fights["Winner"].fillna("Draw", inplace=True)
 
-    def _convert_percentages_to_fractions(self):
+    def _fill_missing_percentages(self):
+        # The scraper stores percentages as fractions, a missing one is the pct of
+        # `0 of 0`.
+        # Taking a call here to consider 0 landed of 0 attempted as 0 percentage
         pct_columns = ["R_SIG_STR_pct", "B_SIG_STR_pct", "R_TD_pct", "B_TD_pct"]
-
-        def pct_to_frac(X):
-            if X != "---":
-                return float(X.replace("%", "")) / 100
-            else:
-                # if '---' means it's taking pct of `0 of 0`.
-                # Taking a call here to consider 0 landed of 0 attempted as 0 percentage
-                return 0
-
-        for column in pct_columns:
-            self.fights[column] = self.fights[column].apply(pct_to_frac)
+        self.fights[pct_columns] = self.fights[pct_columns].fillna(0)
 
     def _create_title_bout_feature(self):
-        self.fights["title_bout"] = self.fights["Fight_type"].apply(
-            lambda X: True if "Title Bout" in X else False
+        self.fights["title_bout"] = _map_distinct(
+            self.fights["Fight_type"], lambda X: True if "Title Bout" in X else False
         )
 
     def _create_weight_classes(self):
@@ -165,12 +218,14 @@ class Preprocessor:
                 if weight_class in X:
                     return weight_class
 
-            if X == "Catch Weight Bout" or "Catchweight Bout":
+            if X in ("Catch Weight Bout", "Catchweight Bout"):
                 return "Catch Weight"
             else:
                 return "Open Weight"
 
-        self.fights["weight_class"] = self.fights["Fight_type"].apply(make_weight_class)
+        self.fights["weight_class"] = _map_distinct(
+            self.fights["Fight_type"], make_weight_class
+        )
 
         renamed_weight_classes = {
             "Flyweight": "Flyweight",
@@ -189,38 +244,24 @@ class Preprocessor:
             "Open Weight": "OpenWeight",
         }
 
-        self.fights["weight_class"] = self.fights["weight_class"].apply(
-            lambda weight: renamed_weight_classes[weight]
+        self.fights["weight_class"] = self.fights["weight_class"].map(
+            renamed_weight_classes
         )
 
-    def _convert_last_round_to_seconds(self):
-        # Converting to seconds
-        self.fights["last_round_time"] = self.fights["last_round_time"].apply(
-            lambda X: int(X.split(":")[0]) * 60 + int(X.split(":")[1])
-        )
-
-    def _convert_CTRL_to_seconds(self):
-        # Converting to seconds
-        CTRL_columns = ["R_CTRL", "B_CTRL"]
-
-        def conv_to_sec(X):
-            if X != "--":
-                return int(X.split(":")[0]) * 60 + int(X.split(":")[1])
-            else:
-                # if '--' means there was no time spent on the ground.
-                # Taking a call here to consider this as 0 seconds
-                return 0
-
-        for column in CTRL_columns:
-            self.fights[column + "_time(seconds)"] = self.fights[column].apply(
-                conv_to_sec
+    def _fill_missing_CTRL_times(self):
+        # The scraper stores control times in seconds, a missing one means there was no
+        # time spent on the ground. Taking a call here to consider this as 0 seconds
+        for corner in ["R", "B"]:
+            self.fights[corner + "_CTRL_time(seconds)"] = (
+                self.fights[corner + "_CTRL_seconds"].fillna(0).astype(int)
             )
 
         # drop original columns
-        self.fights.drop(["R_CTRL", "B_CTRL"], axis=1, inplace=True)
+        self.fights.drop(["R_CTRL_seconds", "B_CTRL_seconds"], axis=1, inplace=True)
 
     def _get_total_time_fought(self):
-        # '1 Rnd + 2OT (15-3-3)' and '1 Rnd + 2OT (24-3-3)' is not included because it has 3 uneven timed rounds.
+        # '1 Rnd + 2OT (15-3-3)' and '1 Rnd + 2OT (24-3-3)' is not included because it
+        # has 3 uneven timed rounds.
         # We'll have to deal with it separately
         time_in_first_round = {
             "3 Rnd (5-5-5)": 5 * 60,
@@ -247,36 +288,69 @@ class Preprocessor:
             "1 Rnd + 2OT (24-3-3)": [24 * 60, 3 * 60],
         }
 
-        def get_total_time(row):
-            if row["Format"] in time_in_first_round.keys():
-                return (row["last_round"] - 1) * time_in_first_round[
-                    row["Format"]
-                ] + row["last_round_time"]
-
-            elif row["Format"] in exception_format_time.keys():
-
-                if (row["last_round"] - 1) >= 2:
-                    return (
-                        exception_format_time[row["Format"]][0]
-                        + (row["last_round"] - 2)
-                        * exception_format_time[row["Format"]][1]
-                        + row["last_round_time"]
-                    )
-                else:
-                    return (row["last_round"] - 1) * exception_format_time[
-                        row["Format"]
-                    ][0] + row["last_round_time"]
-
-        self.fights["total_time_fought(seconds)"] = self.fights.apply(
-            get_total_time, axis=1
+        last_round = self.fights["last_round"]
+        last_round_time = self.fights["last_round_time_seconds"]
+        formats = self.fights["Format"]
+        first_round = formats.map(time_in_first_round)
+        exception_first_round = formats.map(
+            {
+                fight_format: times[0]
+                for fight_format, times in exception_format_time.items()
+            }
+        )
+        exception_overtime = formats.map(
+            {
+                fight_format: times[1]
+                for fight_format, times in exception_format_time.items()
+            }
+        )
+
+        total_time = pd.Series(np.nan, index=self.fights.index)
+        regular = first_round.notna()
+        total_time[regular] = (last_round - 1) * first_round + last_round_time
+        in_overtime = exception_first_round.notna() & (last_round - 1 >= 2)
+        total_time[in_overtime] = (
+            exception_first_round
+            + (last_round - 2) * exception_overtime
+            + last_round_time
         )
+        in_first_round = exception_first_round.notna() & (last_round - 1 < 2)
+        total_time[in_first_round] = (
+            last_round - 1
+        ) * exception_first_round + last_round_time
+
+        # Unknown formats and missing times leave gaps, otherwise the times are whole
+        if total_time.notna().all() and pd.api.types.is_integer_dtype(last_round_time):
+            total_time = total_time.astype(int)
+        self.fights["total_time_fought(seconds)"] = total_time
         self.fights.drop(
-            ["Format", "Fight_type", "last_round_time"], axis=1, inplace=True
+            ["Format", "Fight_type", "last_round_time_seconds"], axis=1, inplace=True
+        )
+
+    def _compact_fights(self):
+        # Names are compared across columns, which categoricals can only do when they
+        # share their categories
+        names = ["R_fighter", "B_fighter", "Winner"]
+        name_type = pd.CategoricalDtype(
+            sorted(set(pd.unique(self.fights[names].values.ravel())) | {"Draw"})
+        )
+        for column in names:
+            self.fights[column] = self.fights[column].astype(name_type)
+        for column in ["Referee", "location", "weight_class", "win_by"]:
+            self.fights[column] = self.fights[column].astype("category")
+        # The same type on every run, a type picked by the values would change as they
+        # grow, and with it the digests that tell unchanged partitions and fights apart
+        for column in self.fights.select_dtypes("integer"):
+            self.fights[column] = self.fights[column].astype("int32")
+
+        stances = self.fighter_details["Stance"].dropna().unique()
+        self.fighter_details["Stance"] = self.fighter_details["Stance"].astype(
+            pd.CategoricalDtype(sorted({*stances, "Orthodox"}))
         )
 
     def _store_compiled_fighter_data_in_another_DF(self):
-        store = self.fights.copy()
-        store.drop(
+        # Only the columns kept are copied
+        return self.fights.drop(
             [
                 "R_KD",
                 "B_KD",
@@ -292,14 +366,14 @@ class Preprocessor:
                 "B_CTRL_time(seconds)",
                 "win_by",
                 "last_round",
-                "R_SIG_STR._att",
-                "R_SIG_STR._landed",
-                "B_SIG_STR._att",
-                "B_SIG_STR._landed",
-                "R_TOTAL_STR._att",
-                "R_TOTAL_STR._landed",
-                "B_TOTAL_STR._att",
-                "B_TOTAL_STR._landed",
+                "R_SIG_STR_att",
+                "R_SIG_STR_landed",
+                "B_SIG_STR_att",
+                "B_SIG_STR_landed",
+                "R_TOTAL_STR_att",
+                "R_TOTAL_STR_landed",
+                "B_TOTAL_STR_att",
+                "B_TOTAL_STR_landed",
                 "R_TD_att",
                 "R_TD_landed",
                 "B_TD_att",
@@ -331,27 +405,27 @@ class Preprocessor:
                 "total_time_fought(seconds)",
             ],
             axis=1,
-            inplace=True,
         )
-        return store
 
     def _create_winner_feature(self):
-        def get_renamed_winner(row):
-            if row["R_fighter"] == row["Winner"]:
-                return "Red"
-
-            elif row["B_fighter"] == row["Winner"]:
-                return "Blue"
-
-            elif row["Winner"] == "Draw":
-                return "Draw"
-
-        self.store["Winner"] = self.store[["R_fighter", "B_fighter", "Winner"]].apply(
-            get_renamed_winner, axis=1
+        winner = self.store["Winner"]
+        self.store["Winner"] = np.select(
+            [
+                self.store["R_fighter"] == winner,
+                self.store["B_fighter"] == winner,
+                winner == "Draw",
+            ],
+            ["Red", "Blue", "Draw"],
+            default=None,
         )
 
     def _create_fighter_attributes(self):
-        frame = FighterDetailProcessor(self.fights, self.fighter_details).frame
+        frame = FighterDetailProcessor(
+            self.fights,
+            self.fighter_details,
+            feature_store=self.feature_store,
+            processes=self.feature_processes,
+        ).frame
         self.store = self.store.join(frame, how="outer")
 
     def _create_fighter_age(self):
@@ -359,25 +433,27 @@ class Preprocessor:
         self.store["B_DOB"] = pd.to_datetime(self.store["B_DOB"])
         self.store["date"] = pd.to_datetime(self.store["date"])
 
-        def get_age(row):
-            B_age = (row["date"] - row["B_DOB"]).days
-            R_age = (row["date"] - row["R_DOB"]).days
-
-            if np.isnan(B_age) != True:
-                B_age = math.floor(B_age / 365.25)
-
-            if np.isnan(R_age) != True:
-                R_age = math.floor(R_age / 365.25)
-
-            return pd.Series([B_age, R_age], index=["B_age", "R_age"])
-
-        self.store[["B_age", "R_age"]] = self.store[["date", "R_DOB", "B_DOB"]].apply(
-            get_age, axis=1
+        ages = pd.DataFrame(
+            {
+                f"{corner}_age": np.floor(
+                    (self.store["date"] - self.store[f"{corner}_DOB"]).dt.days / 365.25
+                )
+                for corner in ["B", "R"]
+            }
         )
+        # Ages are whole years, unless a date of birth is missing
+        if ages.notna().all().all():
+            ages = ages.astype(int)
+        self.store[["B_age", "R_age"]] = ages
         self.store.drop(["R_DOB", "B_DOB"], axis=1, inplace=True)
 
-    def _save(self, filepath):
-        self.store.to_csv(filepath, index=False)
+    def _save(self, dataset_path, csv_path):
+        # Partitioned by the year of the fight, only changed years are written
+        PartitionedDataset(dataset_path).save(
+            self.store, self.years.loc[self.store.index]
+        )
+        if self.export_csv:
+            self.store.to_csv(csv_path, index=False)
 
     def _fill_nas(self):
         self.store["R_Reach_cms"].fillna(self.store["R_Height_cms"], inplace=True)
@@ -388,24 +464,31 @@ class Preprocessor:
         self.store["B_Stance"].fillna("Orthodox", inplace=True)
 
     def _drop_non_essential_cols(self):
-        self.store.drop(self.store.index[self.store["Winner"] == "Draw"], inplace=True)
+        dummy_columns = ["weight_class", "B_Stance", "R_Stance"]
+        dropped_columns = [
+            *dummy_columns,
+            "Referee",
+            "location",
+            "date",
+            "R_fighter",
+            "B_fighter",
+            "R_fighter_id",
+            "B_fighter_id",
+        ]
+        rows = (self.store["Winner"] != "Draw").to_numpy()
+        dummies = self.store.loc[rows, dummy_columns]
+        # Categoricals would get a column for every category, not only those left
+        for column in dummies.select_dtypes("category"):
+            dummies[column] = dummies[column].cat.remove_unused_categories()
+
+        # The rows and columns kept are copied once
         self.store = pd.concat(
             [
-                self.store,
-                pd.get_dummies(self.store[["weight_class", "B_Stance", "R_Stance"]]),
+                self.store.loc[
+                    rows, [c for c in self.store.columns if c not in dropped_columns]
+                ],
+                pd.get_dummies(dummies),
             ],
             axis=1,
-        )
-        self.store.drop(
-            columns=[
-                "weight_class",
-                "B_Stance",
-                "R_Stance",
-                "Referee",
-                "location",
-                "date",
-                "R_fighter",
-                "B_fighter",
-            ],
-            inplace=True,
+            copy=False,
         )
@@ -1,174 +1,283 @@
+import concurrent.futures
+import multiprocessing
 import re
+from typing import Dict, List
 
 import numpy as np
 import pandas as pd
-from tqdm import tqdm
+
+RESULT_STATS = [
+    "current_win_streak",
+    "current_lose_streak",
+    "longest_win_streak",
+    "wins",
+    "losses",
+    "draw",
+]
+
+WIN_BY_COLUMNS = [
+    "win_by_Decision - Majority",
+    "win_by_Decision - Split",
+    "win_by_Decision - Unanimous",
+    "win_by_KO/TKO",
+    "win_by_Submission",
+    "win_by_TKO - Doctor's Stoppage",
+]
+
+NUMERICAL_COLUMNS = [
+    "hero_KD",
+    "opp_KD",
+    "hero_SIG_STR_pct",
+    "opp_SIG_STR_pct",
+    "hero_TD_pct",
+    "opp_TD_pct",
+    "hero_SUB_ATT",
+    "opp_SUB_ATT",
+    "hero_REV",
+    "opp_REV",
+    "hero_SIG_STR_att",
+    "hero_SIG_STR_landed",
+    "opp_SIG_STR_att",
+    "opp_SIG_STR_landed",
+    "hero_TOTAL_STR_att",
+    "hero_TOTAL_STR_landed",
+    "opp_TOTAL_STR_att",
+    "opp_TOTAL_STR_landed",
+    "hero_TD_att",
+    "hero_TD_landed",
+    "opp_TD_att",
+    "opp_TD_landed",
+    "hero_HEAD_att",
+    "hero_HEAD_landed",
+    "opp_HEAD_att",
+    "opp_HEAD_landed",
+    "hero_BODY_att",
+    "hero_BODY_landed",
+    "opp_BODY_att",
+    "opp_BODY_landed",
+    "hero_LEG_att",
+    "hero_LEG_landed",
+    "opp_LEG_att",
+    "opp_LEG_landed",
+    "hero_DISTANCE_att",
+    "hero_DISTANCE_landed",
+    "opp_DISTANCE_att",
+    "opp_DISTANCE_landed",
+    "hero_CLINCH_att",
+    "hero_CLINCH_landed",
+    "opp_CLINCH_att",
+    "opp_CLINCH_landed",
+    "hero_GROUND_att",
+    "hero_GROUND_landed",
+    "opp_GROUND_att",
+    "opp_GROUND_landed",
+    "hero_CTRL_time(seconds)",
+    "opp_CTRL_time(seconds)",
+    "total_time_fought(seconds)",
+]
+
+# ewm(span=3, adjust=False), the weight of the latest fight in the averages
+ALPHA = 2 / (3 + 1)
+
+# The columns of the fighter-fight table the features are computed from
+INPUT_COLUMNS = [
+    "hero_fighter_id",
+    *NUMERICAL_COLUMNS,
+    "last_round",
+    "title_bout",
+    "won",
+    *WIN_BY_COLUMNS,
+]
+
+
+def _before_each_fight(totals, fighters, fill_value=0):
+    # Moves every fighter's running totals one fight on, so that the features of a
+    # fight only know of the fights before it
+    return totals.groupby(fighters).shift(fill_value=fill_value)
+
+
+def _ewm_means(values: np.ndarray, fighters: pd.Series) -> np.ndarray:
+    """
+    The ewm(span=3, adjust=False) averages of every fighter's rows of `values` up to
+    each row, the same as pandas gives them for each fighter. GroupBy.ewm needs pandas
+    1.2, the steps are taken for the k-th fight of every fighter at once instead.
+    """
+    averages = values.copy()
+    weights = np.ones_like(values)
+    positions = fighters.groupby(fighters).cumcount().to_numpy()
+    previous = (
+        pd.Series(np.arange(len(fighters)), index=fighters.index)
+        .groupby(fighters)
+        .shift(fill_value=-1)
+        .to_numpy()
+    )
+    rows_by_position = np.argsort(positions, kind="mergesort")
+    bounds = np.searchsorted(
+        positions[rows_by_position], np.arange(positions.max(initial=0) + 2)
+    )
+    for start, end in zip(bounds[1:-1], bounds[2:]):
+        rows = rows_by_position[start:end]
+        average = averages[previous[rows]]
+        weight = weights[previous[rows]]
+        value = values[rows]
+        seen = ~np.isnan(average)
+        observed = ~np.isnan(value)
+        weight[seen] *= 1 - ALPHA
+        moved = seen & observed & (average != value)
+        average[moved] = (weight[moved] * average[moved] + ALPHA * value[moved]) / (
+            weight[moved] + ALPHA
+        )
+        weight[seen & observed] = 1.0
+        average[~seen & observed] = value[~seen & observed]
+        averages[rows] = average
+        weights[rows] = weight
+    return averages
+
+
+def _fighter_features(columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    The features of every row of a fighter-fight table from the fighter's fights
+    before it. Takes and returns plain columns, so that it can run in another process.
+    """
+    fighter_fights = pd.DataFrame(columns)
+    fighters = fighter_fights["hero_fighter_id"]
+    fights_before = fighters.groupby(fighters).cumcount()
+
+    averages = pd.DataFrame(
+        _ewm_means(fighter_fights[NUMERICAL_COLUMNS].to_numpy(dtype=float), fighters),
+        columns=NUMERICAL_COLUMNS,
+        index=fighter_fights.index,
+    )
+    frame = _before_each_fight(averages, fighters, fill_value=np.NaN)
+
+    # Summed in 64 bits, the rounds can come in a small integer type
+    last_round = fighter_fights["last_round"].fillna(0)
+    last_round = last_round.astype(np.result_type(last_round.dtype, np.int64))
+    frame["total_rounds_fought"] = _before_each_fight(
+        last_round.groupby(fighters).cumsum(), fighters
+    )
+    frame["total_title_bouts"] = _before_each_fight(
+        (fighter_fights["title_bout"] == True).astype(int).groupby(fighters).cumsum(),
+        fighters,
+    )
+    frame["hero_fighter_id"] = fighters
+
+    won = fighter_fights["won"]
+    lost = ~won
+
+    # Streaks are counted from the fighter's first fight on, as they always were
+    first_win_run = (
+        (lost.astype(int).groupby(fighters).cumsum() == 0)
+        .astype(int)
+        .groupby(fighters)
+        .transform("sum")
+    )
+    first_lose_run = (
+        (won.astype(int).groupby(fighters).cumsum() == 0)
+        .astype(int)
+        .groupby(fighters)
+        .transform("sum")
+    )
+    run = (won != won.groupby(fighters).shift()).cumsum()
+    win_run = won.groupby(run).cumcount().add(1).where(won, 0)
+
+    results = [
+        np.minimum(fights_before, first_win_run),
+        np.minimum(fights_before, first_lose_run),
+        _before_each_fight(win_run.groupby(fighters).cummax(), fighters),
+        _before_each_fight(won.astype(int).groupby(fighters).cumsum(), fighters),
+        _before_each_fight(lost.astype(int).groupby(fighters).cumsum(), fighters),
+        0,
+    ]
+    for result_stat, result in zip(RESULT_STATS, results):
+        frame[result_stat] = result
+
+    win_by_results = _before_each_fight(
+        fighter_fights[WIN_BY_COLUMNS]
+        .astype(int)
+        .mul(won.astype(int), axis="index")
+        .groupby(fighters)
+        .cumsum(),
+        fighters,
+    )
+    for win_by_column in WIN_BY_COLUMNS:
+        frame[win_by_column] = win_by_results[win_by_column]
+
+    return {column: frame[column].to_numpy() for column in frame.columns}
+
+
+def _fighter_chunks(fighters: np.ndarray, chunk_count: int) -> List[slice]:
+    # A fighter's rows are next to each other, chunks of about the same number of
+    # rows are cut where a fighter's rows end
+    bounds = np.append(
+        np.flatnonzero(np.r_[True, fighters[1:] != fighters[:-1]]), len(fighters)
+    )
+    targets = np.arange(1, chunk_count) * len(fighters) / chunk_count
+    cuts = np.unique([0, *bounds[np.searchsorted(bounds, targets)], len(fighters)])
+    return [slice(start, end) for start, end in zip(cuts[:-1], cuts[1:])]
+
+
+def _fighter_features_in_processes(
+    columns: Dict[str, np.ndarray], processes: int
+) -> Dict[str, np.ndarray]:
+    """
+    _fighter_features in a pool of processes, each taking a chunk of fighters. Every
+    fighter's features only depend on their own rows, and the chunks are put back
+    together in order, so any number of processes gives the same features.
+    """
+    chunks = _fighter_chunks(columns["hero_fighter_id"], processes)
+    # Like the parse pool, children are started from a clean process
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else None
+    )
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=processes, mp_context=context
+    ) as pool:
+        results = list(
+            pool.map(
+                _fighter_features,
+                [
+                    {column: values[chunk] for column, values in columns.items()}
+                    for chunk in chunks
+                ],
+            )
+        )
+    return {
+        column: np.concatenate([result[column] for result in results])
+        for column in results[0]
+    }
 
 
 class FighterDetailProcessor:
-    def __init__(self, fights, fighter_details):
+    def __init__(self, fights, fighter_details, feature_store=None, processes=1):
         self.fights = fights
         self.fighter_details = fighter_details
+        # Processes the fighter features are computed in
+        self.processes = processes
         self._one_hot_encode_win()
-        self.temp_red_frame, self.temp_blue_frame = self._calculate_fighter_data()
-        self._convert_height_reach_to_cms()
-        self._convert_weight_to_pounds()
+        # A feature store only computes the features of fights it has not seen yet
+        if feature_store is None:
+            self.temp_red_frame, self.temp_blue_frame = self._calculate_fighter_data()
+        else:
+            self.temp_red_frame, self.temp_blue_frame = feature_store.fighter_data(
+                self.fights, self._calculate_fighter_data
+            )
+        self._order_fighter_attributes()
         self.frame = self._merge_frames()
         self._rename_columns()
 
     def _one_hot_encode_win(self):
 
+        # Flags, the features count them
         self.fights = pd.concat(
-            [self.fights, pd.get_dummies(self.fights["win_by"], prefix="win_by")],
+            [
+                self.fights.drop(columns="win_by"),
+                pd.get_dummies(self.fights["win_by"], prefix="win_by", dtype=bool),
+            ],
             axis=1,
+            copy=False,
         )
-        self.fights.drop(["win_by"], axis=1, inplace=True)
-
-    def _get_fighters(self):
-
-        red_fighters = self.fights["R_fighter"].value_counts().index
-        blue_fighters = self.fights["B_fighter"].value_counts().index
-
-        return list(set(red_fighters) | set(blue_fighters))
-
-    def _calculate_fighter_data(self):
-
-        temp_blue_frame = pd.DataFrame()
-        temp_red_frame = pd.DataFrame()
-
-        fighters = self._get_fighters()
-        self.red = self.fights.groupby("R_fighter")
-        self.blue = self.fights.groupby("B_fighter")
-
-        result_stats = [
-            "current_win_streak",
-            "current_lose_streak",
-            "longest_win_streak",
-            "wins",
-            "losses",
-            "draw",
-        ]
-
-        win_by_columns = [
-            "win_by_Decision - Majority",
-            "win_by_Decision - Split",
-            "win_by_Decision - Unanimous",
-            "win_by_KO/TKO",
-            "win_by_Submission",
-            "win_by_TKO - Doctor's Stoppage",
-        ]
-
-        Numerical_columns = [
-            "hero_KD",
-            "opp_KD",
-            "hero_SIG_STR_pct",
-            "opp_SIG_STR_pct",
-            "hero_TD_pct",
-            "opp_TD_pct",
-            "hero_SUB_ATT",
-            "opp_SUB_ATT",
-            "hero_REV",
-            "opp_REV",
-            "hero_SIG_STR._att",
-            "hero_SIG_STR._landed",
-            "opp_SIG_STR._att",
-            "opp_SIG_STR._landed",
-            "hero_TOTAL_STR._att",
-            "hero_TOTAL_STR._landed",
-            "opp_TOTAL_STR._att",
-            "opp_TOTAL_STR._landed",
-            "hero_TD_att",
-            "hero_TD_landed",
-            "opp_TD_att",
-            "opp_TD_landed",
-            "hero_HEAD_att",
-            "hero_HEAD_landed",
-            "opp_HEAD_att",
-            "opp_HEAD_landed",
-            "hero_BODY_att",
-            "hero_BODY_landed",
-            "opp_BODY_att",
-            "opp_BODY_landed",
-            "hero_LEG_att",
-            "hero_LEG_landed",
-            "opp_LEG_att",
-            "opp_LEG_landed",
-            "hero_DISTANCE_att",
-            "hero_DISTANCE_landed",
-            "opp_DISTANCE_att",
-            "opp_DISTANCE_landed",
-            "hero_CLINCH_att",
-            "hero_CLINCH_landed",
-            "opp_CLINCH_att",
-            "opp_CLINCH_landed",
-            "hero_GROUND_att",
-            "hero_GROUND_landed",
-            "opp_GROUND_att",
-            "opp_GROUND_landed",
-            "hero_CTRL_time(seconds)",
-            "opp_CTRL_time(seconds)",
-            "total_time_fought(seconds)",
-        ]
-
-        print("Creating Fighter Level Features")
-        for fighter_name in tqdm(fighters):
-            fighter_red = self._get_fighter_red(fighter_name)
-            fighter_blue = self._get_fighter_blue(fighter_name)
-            fighter_index = None
-
-            if fighter_red is None:
-                fighter = fighter_blue
-                fighter_index = "blue"
-            elif fighter_blue is None:
-                fighter = fighter_red
-                fighter_index = "red"
-            else:
-                fighter = pd.concat([fighter_red, fighter_blue]).sort_index()
-
-            fighter["Winner"] = fighter["Winner"].apply(
-                lambda X: "hero" if X == fighter_name else "opp"
-            )
-
-            for i, index in enumerate(fighter.index):
-
-                fighter_slice = fighter[(i + 1) :].sort_index(ascending=False)
-                s = (
-                    fighter_slice[Numerical_columns]
-                    .ewm(span=3, adjust=False)
-                    .mean()
-                    .tail(1)
-                )
-                if len(s) != 0:
-                    pass
-                else:
-                    s.loc[len(s)] = [np.NaN for _ in s.columns]
-                s["total_rounds_fought"] = fighter_slice["last_round"].sum()
-                s["total_title_bouts"] = fighter_slice[
-                    fighter_slice["title_bout"] == True
-                ]["title_bout"].count()
-                s["hero_fighter"] = fighter_name
-                results = self._get_result_stats(list(fighter_slice["Winner"]))
-                for result_stat, result in zip(result_stats, results):
-                    s[result_stat] = result
-                win_by_results = fighter_slice[fighter_slice["Winner"] == "hero"][
-                    win_by_columns
-                ].sum()
-                for win_by_column, win_by_result in zip(win_by_columns, win_by_results):
-                    s[win_by_column] = win_by_result
-
-                s.index = [index]
-
-                if fighter_index is None:
-                    if index in fighter_blue.index:
-                        temp_blue_frame = temp_blue_frame.append(s)
-                    elif index in fighter_red.index:
-                        temp_red_frame = temp_red_frame.append(s)
-                elif fighter_index == "blue":
-                    temp_blue_frame = temp_blue_frame.append(s)
-                elif fighter_index == "red":
-                    temp_red_frame = temp_red_frame.append(s)
-
-        return temp_red_frame, temp_blue_frame
 
     @staticmethod
     def lreplace(pattern, sub, string):
@@ -177,107 +286,69 @@ class FighterDetailProcessor:
         """
         return re.sub("^%s" % pattern, sub, string)
 
-    def _get_fighter_red(self, fighter_name):
-
-        try:
-            fighter_red = self.red.get_group(fighter_name)
-        except:
-            return None
-
-        rename_columns = {}
-        for column in fighter_red.columns:
-
-            if re.search("^R_", column) is not None:
-                rename_columns[column] = self.lreplace("R_", "hero_", column)
-
-            elif re.search("^B_", column) is not None:
-                rename_columns[column] = self.lreplace("B_", "opp_", column)
-
-        fighter_red = fighter_red.rename(rename_columns, axis="columns")
-        return fighter_red
-
-    def _get_fighter_blue(self, fighter_name):
-
-        try:
-            fighter_blue = self.blue.get_group(fighter_name)
-        except:
-            return None
-
-        rename_columns = {}
-        for column in fighter_blue.columns:
-
-            if re.search("^B_", column) is not None:
-                rename_columns[column] = self.lreplace("B_", "hero_", column)
-
-            elif re.search("^R_", column) is not None:
-                rename_columns[column] = self.lreplace("R_", "opp_", column)
-
-        fighter_blue = fighter_blue.rename(rename_columns, axis="columns")
-        return fighter_blue
-
-    @staticmethod
-    def _get_result_stats(result_list):
-        result_list.reverse()  # To get it in ascending order
-        current_win_streak = 0
-        current_lose_streak = 0
-        longest_win_streak = 0
-        wins = 0
-        losses = 0
-        draw = 0
-        for result in result_list:
-
-            if result == "hero":
-                wins += 1
-                current_win_streak += 1
-                current_lose_streak = 0
-                if longest_win_streak < current_win_streak:
-                    longest_win_streak += 1
-
-            elif result == "opp":
-                losses += 1
-                current_win_streak = 0
-                current_lose_streak += 1
-
-            elif result == "draw":
-                draw += 1
-                current_lose_streak = 0
-                current_win_streak = 0
-
-        return (
-            current_win_streak,
-            current_lose_streak,
-            longest_win_streak,
-            wins,
-            losses,
-            draw,
+    def _get_fighter_fights(self):
+        """
+        One row for every fighter in every fight, with the fighter's own columns as
+        hero_ and the opponent's as opp_. Rows are grouped by fighter, oldest fight
+        first, and keep the index of the fight in `fight`.
+        """
+        # Only the columns the features are computed from are copied
+        columns = [
+            column
+            for column in self.fights.columns
+            if column.startswith(("R_", "B_")) or column in [*INPUT_COLUMNS, "Winner"]
+        ]
+        corners = []
+        for corner, hero, opp in (("red", "R_", "B_"), ("blue", "B_", "R_")):
+            corner_fights = self.fights[columns].rename(
+                lambda column: self.lreplace(
+                    opp, "opp_", self.lreplace(hero, "hero_", column)
+                ),
+                axis="columns",
+            )
+            corner_fights["corner"] = corner
+            corner_fights["fight"] = self.fights.index
+            corners.append(corner_fights)
+
+        # Fights are newest first, a fighter's fights are put in the order they happened
+        fighter_fights = pd.concat(corners, ignore_index=True)
+        fighter_fights.sort_values(
+            ["hero_fighter_id", "fight"],
+            ascending=[True, False],
+            kind="mergesort",
+            inplace=True,
         )
+        fighter_fights.reset_index(drop=True, inplace=True)
+        # The winner is recorded by name, the fighter's own name is on every row
+        fighter_fights["won"] = (
+            fighter_fights["Winner"] == fighter_fights["hero_fighter"]
+        )
+        return fighter_fights
 
-    def _convert_height_reach_to_cms(self):
-        def convert_to_cms(X):
-
-            if X is np.NaN:
-                return X
-
-            elif len(X.split("'")) == 2:
-                feet = float(X.split("'")[0])
-                inches = int(X.split("'")[1].replace(" ", "").replace('"', ""))
-                return (feet * 30.48) + (inches * 2.54)
-
-            else:
-                return float(X.replace('"', "")) * 2.54
+    def _calculate_fighter_data(self):
 
-        self.fighter_details["Height_cms"] = self.fighter_details["Height"].apply(
-            convert_to_cms
-        )
-        self.fighter_details["Reach_cms"] = self.fighter_details["Reach"].apply(
-            convert_to_cms
-        )
+        print("Creating Fighter Level Features")
+        fighter_fights = self._get_fighter_fights()
+        columns = {
+            column: fighter_fights[column].to_numpy() for column in INPUT_COLUMNS
+        }
+        if self.processes <= 1:
+            features = _fighter_features(columns)
+        else:
+            features = _fighter_features_in_processes(columns, self.processes)
+
+        frame = pd.DataFrame(features, index=fighter_fights["fight"].rename(None))
+        corner = fighter_fights["corner"].values
+        temp_red_frame = frame[corner == "red"].sort_index()
+        temp_blue_frame = frame[corner == "blue"].sort_index()
+        return temp_red_frame, temp_blue_frame
 
-    def _convert_weight_to_pounds(self):
-        self.fighter_details["Weight_lbs"] = self.fighter_details["Weight"].apply(
-            lambda X: float(X.replace(" lbs.", "")) if X is not np.NaN else X
-        )
-        self.fighter_details.drop(["Height", "Weight", "Reach"], axis=1, inplace=True)
+    def _order_fighter_attributes(self):
+        # Height, reach and weight come converted from the scraper, they are moved to
+        # where data.csv has always had them
+        self.fighter_details = self.fighter_details[
+            ["Stance", "DOB", "Height_cms", "Reach_cms", "Weight_lbs"]
+        ]
 
     def _merge_frames(self):
 
@@ -287,22 +358,22 @@ class FighterDetailProcessor:
 
         self.temp_blue_frame = self.temp_blue_frame.merge(
             self.fighter_details,
-            left_on="hero_fighter",
-            right_on="fighter_name",
+            left_on="hero_fighter_id",
+            right_on="fighter_id",
             how="left",
         )
         self.temp_blue_frame.set_index("index", inplace=True)
 
         self.temp_red_frame = self.temp_red_frame.merge(
             self.fighter_details,
-            left_on="hero_fighter",
-            right_on="fighter_name",
+            left_on="hero_fighter_id",
+            right_on="fighter_id",
             how="left",
         )
         self.temp_red_frame.set_index("index", inplace=True)
 
-        self.temp_blue_frame.drop("fighter_name", axis=1, inplace=True)
-        self.temp_red_frame.drop("fighter_name", axis=1, inplace=True)
+        self.temp_blue_frame.drop("fighter_id", axis=1, inplace=True)
+        self.temp_red_frame.drop("fighter_id", axis=1, inplace=True)
 
         blue_frame = self.temp_blue_frame.add_prefix("B_")
         red_frame = self.temp_red_frame.add_prefix("R_")
@@ -324,4 +395,4 @@ class FighterDetailProcessor:
                 )
 
         self.frame.rename(rename_cols, axis="columns", inplace=True)
-        self.frame.drop(["R_avg_fighter", "B_avg_fighter"], axis=1, inplace=True)
+        self.frame.drop(["R_avg_fighter_id", "B_avg_fighter_id"], axis=1, inplace=True)
@@ -0,0 +1,324 @@
+import datetime
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import pandas as pd
+
+from src.createdata.fighter_dimension import ufcstats_id
+from src.createdata.run_journal import RunJournal
+
+# Marks ufcstats shows in place of a value, "---" is the percentage of "0 of 0"
+MISSING_VALUES = {"", "--", "---"}
+
+CORNERS = ("R", "B")
+
+
+def clean_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def to_text(text: str) -> Optional[str]:
+    return None if text in MISSING_VALUES else text
+
+
+def to_int(text: str) -> int:
+    return int(text)
+
+
+def to_float(text: str) -> Optional[float]:
+    return None if text in MISSING_VALUES else float(text)
+
+
+def to_landed(text: str) -> int:
+    # "45 of 98"
+    return int(text.split("of")[0])
+
+
+def to_attempted(text: str) -> int:
+    return int(text.split("of")[1])
+
+
+def to_ufcstats_id(text: str) -> Optional[str]:
+    # The fighter's page, "http://ufcstats.com/fighter-details/1338e2c7480bdf9e"
+    return None if text in MISSING_VALUES else ufcstats_id(text)
+
+
+def to_fraction(text: str) -> Optional[float]:
+    # "56%"
+    return None if text in MISSING_VALUES else float(text.replace("%", "")) / 100
+
+
+def to_seconds(text: str) -> Optional[int]:
+    # "3:21"
+    if text in MISSING_VALUES:
+        return None
+    minutes, seconds = text.split(":")
+    return int(minutes) * 60 + int(seconds)
+
+
+def to_cms(text: str) -> Optional[float]:
+    # Heights are `5' 11"`, reaches `72"`
+    if text in MISSING_VALUES:
+        return None
+    if len(text.split("'")) == 2:
+        feet = float(text.split("'")[0])
+        inches = int(text.split("'")[1].replace(" ", "").replace('"', ""))
+        return (feet * 30.48) + (inches * 2.54)
+    return float(text.replace('"', "")) * 2.54
+
+
+def to_pounds(text: str) -> Optional[float]:
+    # "155 lbs."
+    return None if text in MISSING_VALUES else float(text.replace(" lbs.", ""))
+
+
+def _to_iso_date(text: str, date_format: str) -> Optional[str]:
+    if text in MISSING_VALUES:
+        return None
+    return datetime.datetime.strptime(text, date_format).date().isoformat()
+
+
+def to_event_date(text: str) -> Optional[str]:
+    # "November 16, 2019"
+    return _to_iso_date(text, "%B %d, %Y")
+
+
+def to_birth_date(text: str) -> Optional[str]:
+    # "Jul 19, 1987"
+    return _to_iso_date(text, "%b %d, %Y")
+
+
+# Every field is (name, type, the text it is read from, converter). The texts are named
+# after the columns of the semicolon separated files written before fights were typed
+# records, which held that text unconverted.
+SchemaField = Tuple[str, type, str, Callable[[str], object]]
+
+
+def _corner_fields(name: str, text: str, type_, convert) -> List[SchemaField]:
+    return [
+        (f"{corner}_{name}", type_, f"{corner}_{text}", convert) for corner in CORNERS
+    ]
+
+
+def _landed_of_fields(name: str, text: str) -> List[SchemaField]:
+    return [
+        (f"{corner}_{name}_{part}", int, f"{corner}_{text}", convert)
+        for corner in CORNERS
+        for part, convert in (("landed", to_landed), ("att", to_attempted))
+    ]
+
+
+FIGHT_SCHEMA: List[SchemaField] = [
+    *_corner_fields("fighter", "fighter", str, to_text),
+    *_corner_fields("ufcstats_id", "fighter_link", Optional[str], to_ufcstats_id),
+    *_corner_fields("KD", "KD", int, to_int),
+    *_landed_of_fields("SIG_STR", "SIG_STR."),
+    *_corner_fields("SIG_STR_pct", "SIG_STR_pct", Optional[float], to_fraction),
+    *_landed_of_fields("TOTAL_STR", "TOTAL_STR."),
+    *_landed_of_fields("TD", "TD"),
+    *_corner_fields("TD_pct", "TD_pct", Optional[float], to_fraction),
+    *_corner_fields("SUB_ATT", "SUB_ATT", int, to_int),
+    *_corner_fields("REV", "REV", int, to_int),
+    *_corner_fields("CTRL_seconds", "CTRL", Optional[int], to_seconds),
+    *_landed_of_fields("HEAD", "HEAD"),
+    *_landed_of_fields("BODY", "BODY"),
+    *_landed_of_fields("LEG", "LEG"),
+    *_landed_of_fields("DISTANCE", "DISTANCE"),
+    *_landed_of_fields("CLINCH", "CLINCH"),
+    *_landed_of_fields("GROUND", "GROUND"),
+    ("win_by", str, "win_by", to_text),
+    ("last_round", int, "last_round", to_int),
+    ("last_round_time_seconds", int, "last_round_time", to_seconds),
+    ("Format", str, "Format", to_text),
+    ("Referee", Optional[str], "Referee", to_text),
+    ("date", str, "date", to_event_date),
+    ("location", Optional[str], "location", to_text),
+    ("Fight_type", str, "Fight_type", to_text),
+    ("Winner", Optional[str], "Winner", to_text),
+]
+
+FIGHTER_SCHEMA: List[SchemaField] = [
+    ("Height_cms", Optional[float], "Height", to_cms),
+    ("Weight_lbs", Optional[float], "Weight", to_pounds),
+    ("Reach_cms", Optional[float], "Reach", to_cms),
+    ("Stance", Optional[str], "Stance", to_text),
+    ("DOB", Optional[str], "DOB", to_birth_date),
+    ("SLpM", Optional[float], "SLpM", to_float),
+    ("Str_Acc", Optional[float], "Str_Acc", to_fraction),
+    ("SApM", Optional[float], "SApM", to_float),
+    ("Str_Def", Optional[float], "Str_Def", to_fraction),
+    ("TD_Avg", Optional[float], "TD_Avg", to_float),
+    ("TD_Acc", Optional[float], "TD_Acc", to_fraction),
+    ("TD_Def", Optional[float], "TD_Def", to_fraction),
+    ("Sub_Avg", Optional[float], "Sub_Avg", to_float),
+]
+
+# One row of raw_total_fight_data.csv. Fighters come with the id of their ufcstats page,
+# counts are ints, times are in seconds, percentages are fractions and the event date
+# is an ISO date.
+FightRecord = NamedTuple(
+    "FightRecord", [(name, type_) for name, type_, _, _ in FIGHT_SCHEMA]
+)
+# One row of raw_fighter_details.csv, without the fighter_name index. Height and reach
+# are in centimetres, weight in pounds.
+FighterRecord = NamedTuple(
+    "FighterRecord", [(name, type_) for name, type_, _, _ in FIGHTER_SCHEMA]
+)
+
+FIGHT_HEADER = ";".join(FightRecord._fields) + "\n"
+
+
+def fight_record_from_texts(texts: Dict[str, str]) -> FightRecord:
+    return FightRecord(*(convert(texts[text]) for _, _, text, convert in FIGHT_SCHEMA))
+
+
+def fighter_record_from_texts(texts: Dict[str, str]) -> FighterRecord:
+    return FighterRecord(
+        *(convert(texts[text]) for _, _, text, convert in FIGHTER_SCHEMA)
+    )
+
+
+def fight_record_to_row(record: FightRecord) -> str:
+    return ";".join("" if value is None else str(value) for value in record)
+
+
+# Files written before the scrapers produced typed records, or before fights recorded
+# the ids of their fighters, are converted the first time a run finds them.
+FIGHTER_LINK_TEXTS = [f"{corner}_fighter_link" for corner in CORNERS]
+FIGHTER_ID_FIELDS = [f"{corner}_ufcstats_id" for corner in CORNERS]
+LEGACY_FIGHT_COLUMNS = [
+    text
+    for text in dict.fromkeys(text for _, _, text, _ in FIGHT_SCHEMA)
+    if text not in FIGHTER_LINK_TEXTS
+]
+LEGACY_FIGHT_HEADER = ";".join(LEGACY_FIGHT_COLUMNS) + "\n"
+UNIDENTIFIED_FIGHT_COLUMNS = [
+    name for name in FightRecord._fields if name not in FIGHTER_ID_FIELDS
+]
+UNIDENTIFIED_FIGHT_HEADER = ";".join(UNIDENTIFIED_FIGHT_COLUMNS) + "\n"
+
+
+def upgrade_fight_row(
+    row: Optional[str], fighter_ids: Optional[Dict[str, Optional[str]]] = None
+) -> Optional[str]:
+    """
+    Converts a legacy row of semicolon separated page texts, or a typed row without
+    the ids of its fighters, to the current columns. Those rows only name their
+    fighters, the ids are looked up by name in `fighter_ids` and left empty for names
+    it does not know. Other rows, and None, are returned as they are.
+    """
+    if row is None:
+        return None
+    values = row.split(";")
+    if len(values) == len(LEGACY_FIGHT_COLUMNS):
+        texts = dict(zip(LEGACY_FIGHT_COLUMNS, values))
+        texts.update({text: "" for text in FIGHTER_LINK_TEXTS})
+        record = fight_record_from_texts(texts)
+    elif len(values) == len(UNIDENTIFIED_FIGHT_COLUMNS):
+        record = FightRecord(
+            **dict(zip(UNIDENTIFIED_FIGHT_COLUMNS, values)),
+            **{field: None for field in FIGHTER_ID_FIELDS},
+        )
+    else:
+        return row
+    fighter_ids = fighter_ids or {}
+    return fight_record_to_row(
+        record._replace(
+            R_ufcstats_id=fighter_ids.get(record.R_fighter),
+            B_ufcstats_id=fighter_ids.get(record.B_fighter),
+        )
+    )
+
+
+def upgrade_legacy_fight_file(
+    filepath: Path,
+    journal: Optional[RunJournal] = None,
+    fighter_ids: Optional[Dict[str, Optional[str]]] = None,
+) -> bool:
+    """
+    Rewrites a legacy raw fight csv in the current columns, see `upgrade_fight_row`.
+    When `journal` has a committed size for the file, rows past it are dropped like a
+    resumed RowWriter would, and the size of the rewritten file is committed in their
+    place.
+    """
+    if not filepath.exists():
+        return False
+    with open(filepath.as_posix(), "r") as f:
+        if f.readline() not in (LEGACY_FIGHT_HEADER, UNIDENTIFIED_FIGHT_HEADER):
+            return False
+
+    offset = None
+    if journal is not None:
+        entry = journal.last("offset", path=filepath.name)
+        offset = None if entry is None else entry["offset"]
+
+    print(f"Converting {filepath} to the current columns")
+    fd, tmp_path = tempfile.mkstemp(dir=filepath.parent.as_posix(), suffix=".tmp")
+    with open(filepath.as_posix(), "rb") as source, os.fdopen(fd, "wb") as target:
+        position = len(source.readline())
+        target.write(FIGHT_HEADER.encode("ascii"))
+        for line in source:
+            position += len(line)
+            if offset is not None and position > offset:
+                break
+            row = upgrade_fight_row(line.decode("ascii").rstrip("\n"), fighter_ids)
+            target.write((row + "\n").encode("ascii", errors="ignore"))
+        target.flush()
+        os.fsync(target.fileno())
+        size = target.tell()
+
+    os.replace(tmp_path, filepath.as_posix())
+    if offset is not None:
+        journal.record(
+            [{"kind": "offset", "path": filepath.name, "offset": size}], sync=True
+        )
+    return True
+
+
+def upgrade_fighter_data(data: Optional[List]) -> Optional[List]:
+    # Legacy fighter data is the list of page texts, starting with the height text
+    if not data or not isinstance(data[0], str):
+        return data
+    if len(data) != len(FIGHTER_SCHEMA):
+        return None
+    legacy_columns = [text for _, _, text, _ in FIGHTER_SCHEMA]
+    return list(fighter_record_from_texts(dict(zip(legacy_columns, data))))
+
+
+def upgrade_legacy_fighter_file(
+    filepath: Path, fighter_ids: Dict[str, Optional[str]]
+) -> List[str]:
+    """
+    Rewrites a raw fighter details csv keyed by fighter name, holding either the page
+    texts or typed values, in the current columns keyed by ufcstats id. The ids are
+    looked up by name in `fighter_ids`, fighters it has no single id for are left out
+    and their names returned, so that they can be scraped again.
+    """
+    if not filepath.exists():
+        return []
+    fighter_details = pd.read_csv(filepath, dtype=str, keep_default_na=False)
+    if "ufcstats_id" in fighter_details.columns:
+        return []
+
+    print(f"Converting {filepath} to the current columns")
+    if "Height" in fighter_details.columns:
+        fighter_details = pd.DataFrame(
+            {
+                "fighter_name": fighter_details["fighter_name"],
+                **{
+                    name: fighter_details[text].map(convert)
+                    for name, _, text, convert in FIGHTER_SCHEMA
+                },
+            }
+        )
+    fighter_details.insert(
+        0, "ufcstats_id", fighter_details["fighter_name"].map(fighter_ids)
+    )
+    unknown = fighter_details["ufcstats_id"].isna()
+
+    tmp_path = filepath.with_suffix(".tmp")
+    fighter_details[~unknown].to_csv(tmp_path, index=False)
+    os.replace(tmp_path, filepath)
+    return fighter_details.loc[unknown, "fighter_name"].tolist()
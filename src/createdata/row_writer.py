@@ -0,0 +1,202 @@
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from src.createdata.run_journal import RunJournal
+
+
+class RowWriter:
+    """
+    Appends rows to a delimited text file as soon as they are scraped.
+    Rows are flushed to the OS after every `write_rows` call and fsynced every
+    `sync_every_rows` rows or `sync_every_seconds` seconds, whichever comes first, so a
+    crash late in a long scrape loses at most the last few rows instead of everything.
+
+    With a `journal`, the entries passed along with the rows are recorded after each
+    fsync together with the committed size of the file. `resume=True` cuts the file
+    back to that size, dropping rows that were written but never committed, and
+    appends to it.
+    """
+
+    def __init__(
+        self,
+        filepath: Path,
+        header: str,
+        sync_every_rows: int = 500,
+        sync_every_seconds: float = 30.0,
+        journal: Optional[RunJournal] = None,
+        resume: bool = False,
+    ):
+        self.filepath = filepath
+        self.header = header
+        self.sync_every_rows = sync_every_rows
+        self.sync_every_seconds = sync_every_seconds
+        self.journal = journal
+        self.resume = resume
+        self.rows_written = 0
+        # The last row in the file, None while it holds no rows
+        self.last_row: Optional[str] = None
+        self._rows_since_sync = 0
+        self._last_sync = time.monotonic()
+        self._pending_entries: List[Dict] = []
+        self._file = None
+
+    def committed_offset(self) -> Optional[int]:
+        if self.journal is None:
+            return None
+        entry = self.journal.last("offset", path=self.filepath.name)
+        return None if entry is None else entry["offset"]
+
+    def __enter__(self) -> "RowWriter":
+        offset = self.committed_offset() if self.resume else None
+        if offset is not None and self.filepath.exists():
+            self._file = open(self.filepath.as_posix(), "r+b")
+            self._file.truncate(offset)
+            self.last_row = _read_last_row(self._file, offset, len(self.header))
+            self._file.seek(offset)
+        else:
+            self._file = open(self.filepath.as_posix(), "wb")
+            self._file.write(bytes(self.header, encoding="ascii", errors="ignore"))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.sync()
+        self._file.close()
+        self._file = None
+
+    def write_rows(self, rows, entries: Iterable[Dict] = ()) -> None:
+        self._pending_entries.extend(entries)
+        for row in rows:
+            self._file.write(bytes(row + "\n", encoding="ascii", errors="ignore"))
+            self.rows_written += 1
+            self.last_row = row
+            self._rows_since_sync += 1
+        self._file.flush()
+
+        if (
+            self._rows_since_sync >= self.sync_every_rows
+            or time.monotonic() - self._last_sync >= self.sync_every_seconds
+        ):
+            self.sync()
+
+    def sync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._rows_since_sync = 0
+        self._last_sync = time.monotonic()
+
+        if self.journal is not None:
+            self.journal.record(
+                self._pending_entries
+                + [
+                    {
+                        "kind": "offset",
+                        "path": self.filepath.name,
+                        "offset": self._file.tell(),
+                    }
+                ],
+                sync=True,
+            )
+            self._pending_entries = []
+
+
+def _read_last_row(file, offset: int, header_size: int) -> Optional[str]:
+    if offset <= header_size:
+        return None
+    start = max(header_size, offset - 64 * 1024)
+    file.seek(start)
+    lines = file.read(offset - start).decode("ascii").rstrip("\n").split("\n")
+    return lines[-1]
+
+
+def read_first_row(filepath: Path) -> Optional[str]:
+    with open(filepath.as_posix(), "rb") as f:
+        f.readline()
+        row = f.readline().decode("ascii").rstrip("\n")
+    return row or None
+
+
+def read_last_row(filepath: Path) -> Optional[str]:
+    with open(filepath.as_posix(), "rb") as f:
+        header_size = len(f.readline())
+        return _read_last_row(f, f.seek(0, os.SEEK_END), header_size)
+
+
+def insert_rows(filepath: Path, insertions: List[Dict]) -> int:
+    """
+    Puts rows into the middle of `filepath`. Each insertion has a "row" and goes right
+    after its "after_row", or right before its "before_row" when that is set instead,
+    or at the end of the file if neither is found. Rows sharing an anchor keep the order
+    of `insertions`. Rows that are in the file already are skipped, so an interrupted
+    insert can simply be repeated. Returns the number of rows inserted.
+    """
+    with open(filepath.as_posix(), "r") as f:
+        f.readline()
+        existing_rows = {line.rstrip("\n") for line in f}
+
+    after: Dict[str, List[str]] = {}
+    before: Dict[str, List[str]] = {}
+    at_end: List[str] = []
+    inserted = 0
+    for insertion in insertions:
+        row = insertion["row"]
+        if row in existing_rows:
+            continue
+        if insertion.get("after_row") in existing_rows:
+            after.setdefault(insertion["after_row"], []).append(row)
+        elif insertion.get("before_row") in existing_rows:
+            before.setdefault(insertion["before_row"], []).append(row)
+        else:
+            at_end.append(row)
+        inserted += 1
+    if not inserted:
+        return 0
+
+    fd, tmp_path = tempfile.mkstemp(dir=filepath.parent.as_posix(), suffix=".tmp")
+    with open(filepath.as_posix(), "r") as source, os.fdopen(fd, "w") as target:
+        target.write(source.readline())
+        for line in source:
+            row = line.rstrip("\n")
+            for new_row in before.get(row, ()):
+                target.write(new_row + "\n")
+            target.write(line)
+            for new_row in after.get(row, ()):
+                target.write(new_row + "\n")
+        for new_row in at_end:
+            target.write(new_row + "\n")
+        target.flush()
+        os.fsync(target.fileno())
+
+    os.replace(tmp_path, filepath.as_posix())
+    return inserted
+
+
+def prepend_rows(new_filepath: Path, total_filepath: Path) -> None:
+    """
+    Puts the rows of `new_filepath` in front of the rows of `total_filepath`, streaming
+    both files through a temporary file rather than loading them into memory.
+    """
+    with open(new_filepath.as_posix(), "rb") as new_file, open(
+        total_filepath.as_posix(), "rb"
+    ) as total_file:
+        new_header = new_file.readline()
+        total_header = total_file.readline()
+        if new_header != total_header:
+            raise ValueError(
+                f"Cannot merge {new_filepath} into {total_filepath}, the headers differ"
+            )
+
+        fd, tmp_path = tempfile.mkstemp(
+            dir=total_filepath.parent.as_posix(), suffix=".tmp"
+        )
+        with os.fdopen(fd, "wb") as merged_file:
+            merged_file.write(total_header)
+            shutil.copyfileobj(new_file, merged_file)
+            shutil.copyfileobj(total_file, merged_file)
+            merged_file.flush()
+            os.fsync(merged_file.fileno())
+
+    os.replace(tmp_path, total_filepath.as_posix())
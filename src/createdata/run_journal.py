@@ -0,0 +1,92 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+
+class RunJournal:
+    """
+    Append-only record of scraping work whose data is safely on disk.
+    Every line is one JSON entry with at least a "kind" ("event", "fight", "fighter",
+    "offset", "merge", ...). Entries are only recorded after the data they describe has
+    been committed, so after a crash a restarted run can skip exactly the work listed
+    here. The journal is removed once the run has been committed as a whole.
+    """
+
+    def __init__(
+        self, filepath: Path, sync_every: int = 100, sync_every_seconds: float = 30.0
+    ):
+        self.filepath = filepath
+        self.sync_every = sync_every
+        self.sync_every_seconds = sync_every_seconds
+        self.entries: List[Dict] = self._load()
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _load(self) -> List[Dict]:
+        if not self.filepath.exists():
+            return []
+        entries = []
+        with open(self.filepath.as_posix(), "r") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # The last line can be cut short by a crash, it was never committed
+                    break
+        return entries
+
+    def exists(self) -> bool:
+        return bool(self.entries)
+
+    def completed(self, kind: str) -> Set[str]:
+        return {entry["url"] for entry in self.entries if entry["kind"] == kind}
+
+    def entries_of(self, kind: str) -> List[Dict]:
+        return [entry for entry in self.entries if entry["kind"] == kind]
+
+    def last(self, kind: str, **match) -> Optional[Dict]:
+        for entry in reversed(self.entries):
+            if entry["kind"] == kind and all(
+                entry.get(key) == value for key, value in match.items()
+            ):
+                return entry
+        return None
+
+    def record(self, entries: Iterable[Dict], sync: bool = False) -> None:
+        if self._file is None:
+            self.filepath.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.filepath.as_posix(), "a")
+        for entry in entries:
+            self._file.write(json.dumps(entry) + "\n")
+            self.entries.append(entry)
+            self._unsynced += 1
+        self._file.flush()
+
+        if (
+            sync
+            or self._unsynced >= self.sync_every
+            or time.monotonic() - self._last_sync >= self.sync_every_seconds
+        ):
+            self.sync()
+
+    def sync(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def clear(self) -> None:
+        self.close()
+        if self.filepath.exists():
+            os.remove(self.filepath.as_posix())
+        self.entries = []
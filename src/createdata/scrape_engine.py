@@ -0,0 +1,278 @@
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+import time
+from typing import Any, Callable, Iterable, List, NamedTuple, Optional, Tuple
+
+from bs4 import BeautifulSoup
+
+from src.createdata.metrics import get_metrics
+from src.createdata.utils import (
+    MAX_WORKERS,
+    fetch_page,
+    get_session,
+    notify_page_observer,
+    parse_page,
+)
+
+# Lower values are scheduled first. Fight and fighter pages go ahead of event pages of
+# the same rank so that rows are produced as soon as an event's fight links are known.
+PAGE_PRIORITY = 0
+EVENT_PRIORITY = 1
+
+# Parsing is CPU bound, with more than one core it runs in a pool of processes.
+PARSE_PROCESSES = os.cpu_count() or 1
+
+
+class ScrapeJob(NamedTuple):
+    url: str
+    # Turns the page soup into (result, follow up jobs). A result of None is dropped.
+    # With parse processes it runs in another process, so it has to be picklable: a
+    # module level function, a classmethod or a functools.partial of one.
+    parse: Callable[[BeautifulSoup], Tuple[Any, List["ScrapeJob"]]]
+    priority: int = PAGE_PRIORITY
+    # Called with the exception if fetching or parsing fails, in place of `parse`.
+    # Without it, a failing job stops the whole run.
+    on_error: Optional[Callable[[Exception], Tuple[Any, List["ScrapeJob"]]]] = None
+    # One of page_regions.PAGE_REGIONS, limits parsing to the parts `parse` reads.
+    page_type: Optional[str] = None
+    # Downloads the page again even if the response cache has a fresh copy.
+    refresh: bool = False
+    # Lower ranks are scheduled first, ahead of the priority. The scrapers rank pages
+    # newest first, so a run that is cut short has the most recent data.
+    rank: int = 0
+
+
+class ScrapeBudget:
+    """
+    Limits a run to `seconds` of wall time from its start, or to `max_requests` pages
+    fetched by the engine, cached pages included. Unlimited without either.
+    """
+
+    def __init__(
+        self, seconds: Optional[float] = None, max_requests: Optional[int] = None
+    ):
+        self.seconds = seconds
+        self.max_requests = max_requests
+        self.started = time.monotonic()
+        self.requests = 0
+
+    def limited(self) -> bool:
+        return self.seconds is not None or self.max_requests is not None
+
+    def spend(self) -> None:
+        self.requests += 1
+
+    def spent(self) -> bool:
+        return (
+            self.max_requests is not None and self.requests >= self.max_requests
+        ) or (
+            self.seconds is not None and time.monotonic() - self.started >= self.seconds
+        )
+
+
+def _fetch(job: ScrapeJob) -> Tuple[str, float]:
+    start = time.perf_counter()
+    text = fetch_page(job.url, refresh=job.refresh)
+    return text, time.perf_counter() - start
+
+
+def _parse(parse, page_type: Optional[str], text: str) -> Tuple[Any, List, float]:
+    start = time.perf_counter()
+    result, follow_ups = parse(parse_page(text, page_type))
+    return result, follow_ups, time.perf_counter() - start
+
+
+class ScrapeEngine:
+    """
+    Fetches and parses pages from one continuously fed queue.
+    Event, fight and fighter pages all share the same `max_concurrency` budget of
+    fetchers, and jobs discovered while parsing a page are queued straight away, so
+    there is no barrier between events and no worker sits idle while there is work left.
+
+    Fetching and parsing are separate stages. Fetchers hand the page text to a pool of
+    `parse_processes` parser processes through a queue of at most `max_parse_backlog`
+    pages, when the parsers fall behind the fetchers wait. With a single parse process
+    pages are parsed in the fetcher threads instead.
+
+    Every page counts towards the `budget`. Runs `within_budget` stop starting jobs
+    once it is spent, the jobs left are dropped without a result. With a limited
+    budget they also hold back jobs while jobs of a lower rank are queued or in flight,
+    so the budget is not spent on later pages before the follow ups of earlier ones.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = MAX_WORKERS,
+        parse_processes: int = PARSE_PROCESSES,
+        max_parse_backlog: Optional[int] = None,
+        budget: Optional[ScrapeBudget] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.parse_processes = parse_processes
+        self.max_parse_backlog = max_parse_backlog or 2 * max(
+            parse_processes, max_concurrency
+        )
+        self.budget = budget if budget is not None else ScrapeBudget()
+        self._parse_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        get_session(pool_maxsize=max_concurrency)
+
+    def _get_parse_pool(self) -> Optional[concurrent.futures.ProcessPoolExecutor]:
+        if self.parse_processes <= 1:
+            return None
+        if self._parse_pool is None:
+            # Forked children of a process running fetcher threads can inherit locks
+            # in a held state, a fork server starts them from a clean process instead.
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context(
+                "forkserver" if "forkserver" in methods else None
+            )
+            self._parse_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.parse_processes, mp_context=context
+            )
+        return self._parse_pool
+
+    def close(self) -> None:
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown()
+            self._parse_pool = None
+
+    def run(
+        self,
+        jobs: Iterable[ScrapeJob],
+        on_result: Callable[[Any], None],
+        within_budget: bool = False,
+    ) -> None:
+        asyncio.run(self._run(list(jobs), on_result, within_budget))
+
+    async def _run(
+        self,
+        jobs: List[ScrapeJob],
+        on_result: Callable[[Any], None],
+        within_budget: bool,
+    ) -> None:
+        fetch_queue = asyncio.PriorityQueue()
+        parse_queue = asyncio.Queue(maxsize=self.max_parse_backlog)
+        order = itertools.count()
+        errors = []
+        # Ranks of the jobs queued or in flight, and a signal whenever one is done
+        ranks = collections.Counter()
+        progress = asyncio.Event()
+        hold_back = within_budget and self.budget.limited()
+
+        def put(job: ScrapeJob) -> None:
+            ranks[job.rank] += 1
+            fetch_queue.put_nowait((job.rank, job.priority, next(order), job))
+
+        def done(job: ScrapeJob) -> None:
+            ranks[job.rank] -= 1
+            if not ranks[job.rank]:
+                del ranks[job.rank]
+            fetch_queue.task_done()
+            progress.set()
+
+        def finish(job: ScrapeJob, outcome: Tuple[Any, List[ScrapeJob]]) -> None:
+            result, follow_ups = outcome
+            for follow_up in follow_ups:
+                put(follow_up)
+            if result is not None:
+                on_result(result)
+
+        def fail(job: ScrapeJob, e: Exception, stage: str) -> None:
+            get_metrics().increment(
+                "ufc_page_errors_total", page_type=job.page_type, stage=stage
+            )
+            if job.on_error is None:
+                raise e
+            finish(job, job.on_error(e))
+
+        async def fetcher() -> None:
+            while True:
+                item = await fetch_queue.get()
+                job = item[-1]
+                if errors:
+                    # Stop scheduling new work, the remaining queue is drained
+                    # unprocessed.
+                    done(job)
+                    continue
+                if within_budget and self.budget.spent():
+                    get_metrics().increment(
+                        "ufc_pages_deferred_total", page_type=job.page_type
+                    )
+                    done(job)
+                    continue
+                if hold_back and job.rank > min(ranks):
+                    # Back in the queue until a job of a lower rank is done
+                    progress.clear()
+                    fetch_queue.put_nowait(item)
+                    fetch_queue.task_done()
+                    await progress.wait()
+                    continue
+                self.budget.spend()
+                try:
+                    text, fetch_seconds = await loop.run_in_executor(
+                        fetch_executor, _fetch, job
+                    )
+                except Exception as e:
+                    try:
+                        fail(job, e, "fetch")
+                    except Exception as error:
+                        errors.append(error)
+                    done(job)
+                    continue
+                # Blocks while the parsers are behind, which holds back the fetchers.
+                await parse_queue.put((job, text, fetch_seconds))
+
+        async def parser() -> None:
+            while True:
+                job, text, fetch_seconds = await parse_queue.get()
+                try:
+                    if not errors:
+                        try:
+                            parsed = await loop.run_in_executor(
+                                parse_executor, _parse, job.parse, job.page_type, text
+                            )
+                            result, follow_ups, parse_seconds = parsed
+                        except Exception as e:
+                            fail(job, e, "parse")
+                        else:
+                            notify_page_observer(
+                                job.url, job.page_type, fetch_seconds, parse_seconds
+                            )
+                            finish(job, (result, follow_ups))
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    parse_queue.task_done()
+                    done(job)
+
+        for job in jobs:
+            put(job)
+
+        loop = asyncio.get_running_loop()
+        parse_pool = self._get_parse_pool()
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_concurrency
+        ) as fetch_executor:
+            parse_executor = parse_pool if parse_pool is not None else fetch_executor
+            workers = [
+                asyncio.ensure_future(fetcher()) for _ in range(self.max_concurrency)
+            ] + [
+                asyncio.ensure_future(parser())
+                for _ in range(
+                    self.parse_processes
+                    if parse_pool is not None
+                    else self.max_concurrency
+                )
+            ]
+            # A job is done once it is parsed, so this also waits for the parsers.
+            await fetch_queue.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        if errors:
+            raise errors[0]
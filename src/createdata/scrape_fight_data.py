@@ -1,34 +1,145 @@
+import functools
 import os
-import concurrent.futures
-import threading
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
-import pandas as pd
 from bs4 import BeautifulSoup
 
+from src.createdata.columnar import PartitionedDataset
+from src.createdata.failed_urls import FailedUrlQueue
+from src.createdata.fighter_dimension import (
+    FighterDimension,
+    fighter_links_by_url,
+    known_fighter_ids,
+)
+from src.createdata.records import (
+    CORNERS,
+    FIGHT_HEADER,
+    FightRecord,
+    clean_text,
+    fight_record_from_texts,
+    fight_record_to_row,
+    upgrade_fight_row,
+    upgrade_legacy_fight_file,
+)
+from src.createdata.row_writer import (
+    RowWriter,
+    insert_rows,
+    prepend_rows,
+    read_first_row,
+    read_last_row,
+)
+from src.createdata.run_journal import RunJournal
+from src.createdata.scrape_engine import EVENT_PRIORITY, ScrapeEngine, ScrapeJob
 from src.createdata.scrape_fight_links import UFCLinks
-from src.createdata.utils import make_soup, print_progress
+from src.createdata.scrape_store import ScrapeStore, get_scrape_store
+from src.createdata.utils import print_progress
 
 from src.createdata.data_files_path import (  # isort:skip
+    FAILED_URLS,
+    FIGHT_RUN_JOURNAL,
+    FIGHTER_DIMENSION,
     NEW_EVENT_AND_FIGHTS,
+    RAW_FIGHTS_DATASET,
     TOTAL_EVENT_AND_FIGHTS,
 )
 
+
+class _PendingEventRows:
+    """
+    Takes the rows of pending events in place of a RowWriter, to be inserted next to the
+    rows every event was left with. Events are written in order, so the events after
+    the last one written are still pending.
+    """
+
+    def __init__(self, pending_events: List[Dict]):
+        self.pending_events = pending_events
+        self.insertions: List[Dict] = []
+        self.entries: List[Dict] = []
+        self.written = 0
+        # The last row written between each pair of anchors
+        self._last_rows: Dict[Tuple, str] = {}
+
+    @staticmethod
+    def _anchors(event: Dict) -> Tuple:
+        return event["after_row"], event["before_row"]
+
+    @property
+    def last_row(self) -> Optional[str]:
+        # The row that comes before the next event's rows
+        event = self.pending_events[self.written]
+        return self._last_rows.get(self._anchors(event), event["after_row"])
+
+    def write_rows(self, rows: List[str], entries: List[Dict] = ()) -> None:
+        event = self.pending_events[self.written]
+        for entry in entries:
+            if (
+                entry["kind"] in ("failed_fight", "failed_event")
+                and entry["after_row"] is None
+            ):
+                entry["before_row"] = event["before_row"]
+        self.entries.extend(entries)
+        # Rows sharing anchors keep their order, see insert_rows
+        self.insertions.extend(
+            {
+                "row": row,
+                "after_row": event["after_row"],
+                "before_row": event["before_row"],
+            }
+            for row in rows
+        )
+        if rows:
+            self._last_rows[self._anchors(event)] = rows[-1]
+        self.written += 1
+
+    def left_events(self) -> List[Dict]:
+        left_events = []
+        for event in self.pending_events[self.written :]:
+            last_row = self._last_rows.get(self._anchors(event))
+            if last_row is not None:
+                event = {**event, "after_row": last_row, "before_row": None}
+            left_events.append(event)
+        return left_events
+
+
 class FightDataScraper:
-    def __init__(self):
-        self.HEADER: str = "R_fighter;B_fighter;R_KD;B_KD;R_SIG_STR.;B_SIG_STR.\
-;R_SIG_STR_pct;B_SIG_STR_pct;R_TOTAL_STR.;B_TOTAL_STR.;R_TD;B_TD;R_TD_pct\
-;B_TD_pct;R_SUB_ATT;B_SUB_ATT;R_REV;B_REV;R_CTRL;B_CTRL;R_HEAD;B_HEAD;R_BODY\
-;B_BODY;R_LEG;B_LEG;R_DISTANCE;B_DISTANCE;R_CLINCH;B_CLINCH;R_GROUND;B_GROUND\
-;win_by;last_round;last_round_time;Format;Referee;date;location;Fight_type;Winner\n"
+    def __init__(
+        self,
+        engine: Optional[ScrapeEngine] = None,
+        full_discovery: bool = False,
+        store: Optional[ScrapeStore] = None,
+    ):
+        self.HEADER: str = FIGHT_HEADER
 
         self.NEW_EVENT_AND_FIGHTS_PATH = NEW_EVENT_AND_FIGHTS
         self.TOTAL_EVENT_AND_FIGHTS_PATH = TOTAL_EVENT_AND_FIGHTS
+        self.RAW_FIGHTS_DATASET_PATH = RAW_FIGHTS_DATASET
+        self.FIGHT_RUN_JOURNAL_PATH = FIGHT_RUN_JOURNAL
+        self.FAILED_URLS_PATH = FAILED_URLS
+        self.FIGHTER_DIMENSION_PATH = FIGHTER_DIMENSION
+        self.full_discovery = full_discovery
+        self.engine = engine if engine is not None else ScrapeEngine()
+        self.store = store if store is not None else get_scrape_store()
+        # Ids of the fighters in rows from older versions, looked up by name
+        self.legacy_fighter_ids: Dict[str, Optional[str]] = {}
 
     def create_fight_data_csv(self) -> None:
+        # Work left behind by a run that did not finish is picked up where it stopped.
+        journal = RunJournal(self.FIGHT_RUN_JOURNAL_PATH)
+        failed_urls = FailedUrlQueue(self.FAILED_URLS_PATH)
+        self._upgrade_legacy_files(journal, failed_urls)
+
+        # Fights that failed in earlier runs are retried first. Not while an
+        # unfinished run is still writing to the file, inserting rows would move its
+        # committed rows.
+        if not journal.exists() and self.TOTAL_EVENT_AND_FIGHTS_PATH.exists():
+            self._retry_failed_events(failed_urls)
+            self._retry_failed_fights(failed_urls)
+
         print("Scraping links!")
 
-        ufc_links = UFCLinks()
+        ufc_links = UFCLinks(
+            engine=self.engine, full_discovery=self.full_discovery, store=self.store
+        )
         new_events_and_fight_links, all_events_and_fight_links = (
             ufc_links.get_event_and_fight_links()
         )
@@ -36,152 +147,741 @@ class FightDataScraper:
         print("Now, scraping event and fight data!\n")
 
         if not new_events_and_fight_links:
-            if self.TOTAL_EVENT_AND_FIGHTS_PATH.exists():
-                print(f'No new fight data to scrape at the moment, loaded existing data from {self.TOTAL_EVENT_AND_FIGHTS_PATH}.')
+            if self.TOTAL_EVENT_AND_FIGHTS_PATH.exists() and not journal.exists():
+                print(
+                    "No new fight data to scrape at the moment, loaded existing data "
+                    f"from {self.TOTAL_EVENT_AND_FIGHTS_PATH}."
+                )
+                self._scrape_pending_events(failed_urls)
+                self._save_raw_fight_dataset()
+                self._update_fighter_dimension()
+                ufc_links.commit_event_links()
                 return
             else:
                 self._scrape_raw_fight_data(
                     all_events_and_fight_links,
                     filepath=self.TOTAL_EVENT_AND_FIGHTS_PATH,
+                    journal=journal,
+                )
+                self._leave_unscraped_events(
+                    all_events_and_fight_links,
+                    journal,
+                    after_row=read_last_row(self.TOTAL_EVENT_AND_FIGHTS_PATH),
+                    before_row=None,
                 )
         else:
-            self._scrape_raw_fight_data(
-                new_events_and_fight_links, filepath=self.NEW_EVENT_AND_FIGHTS_PATH
+            merge = journal.last("merge", url=self.NEW_EVENT_AND_FIGHTS_PATH.name)
+            if merge is None:
+                self._scrape_raw_fight_data(
+                    new_events_and_fight_links,
+                    filepath=self.NEW_EVENT_AND_FIGHTS_PATH,
+                    journal=journal,
+                )
+
+                # New events that were not scraped go between the new and the old rows
+                after_row = read_last_row(self.NEW_EVENT_AND_FIGHTS_PATH)
+                merge = {
+                    "kind": "merge",
+                    "url": self.NEW_EVENT_AND_FIGHTS_PATH.name,
+                    "after_row": after_row,
+                    "before_row": None
+                    if after_row is not None
+                    else read_first_row(self.TOTAL_EVENT_AND_FIGHTS_PATH),
+                }
+                # Newest fights go first, the existing rows are streamed in after them.
+                prepend_rows(
+                    self.NEW_EVENT_AND_FIGHTS_PATH, self.TOTAL_EVENT_AND_FIGHTS_PATH
+                )
+                journal.record([merge], sync=True)
+
+            if self.NEW_EVENT_AND_FIGHTS_PATH.exists():
+                os.remove(self.NEW_EVENT_AND_FIGHTS_PATH)
+                print("Removed new event and fight files")
+            self._leave_unscraped_events(
+                new_events_and_fight_links,
+                journal,
+                after_row=merge.get("after_row"),
+                before_row=merge.get("before_row"),
             )
 
-            new_event_and_fights_data = pd.read_csv(self.NEW_EVENT_AND_FIGHTS_PATH)
-            old_event_and_fights_data = pd.read_csv(self.TOTAL_EVENT_AND_FIGHTS_PATH)
+        self._save_scraped_fights(
+            journal.entries_of("fight"), journal.entries_of("event")
+        )
+        self._queue_failed_fights(journal.entries_of("failed_fight"), failed_urls)
+        self._queue_failed_events(journal.entries_of("failed_event"), failed_urls)
+
+        # The fight data is saved, only now can the events be marked as seen.
+        ufc_links.commit_event_links()
+        journal.clear()
+        self._scrape_pending_events(failed_urls)
+        self._save_raw_fight_dataset()
+        self._update_fighter_dimension()
+        print("Successfully scraped and saved ufc fight data!\n")
 
-            assert len(new_event_and_fights_data.columns) == len(
-                old_event_and_fights_data.columns
+    def _upgrade_legacy_files(
+        self, journal: RunJournal, failed_urls: FailedUrlQueue
+    ) -> None:
+        # Rows from before fights recorded their fighters' ids get them from the links
+        # of known fighters, every row is converted with the same ids.
+        self.legacy_fighter_ids = known_fighter_ids(
+            self.store.known_fighter_links(), self.store.discovered_fighter_links()
+        )
+        # Rows queued pages are anchored to are converted before the files they are in
+        for entry in failed_urls.entries("fight") + failed_urls.entries("event"):
+            failed_urls.update(
+                entry["url"],
+                after_row=upgrade_fight_row(
+                    entry["after_row"], self.legacy_fighter_ids
+                ),
+                before_row=upgrade_fight_row(
+                    entry["before_row"], self.legacy_fighter_ids
+                ),
+            )
+        failed_urls.save()
+        upgrade_legacy_fight_file(
+            self.TOTAL_EVENT_AND_FIGHTS_PATH, fighter_ids=self.legacy_fighter_ids
+        )
+        upgrade_legacy_fight_file(
+            self.NEW_EVENT_AND_FIGHTS_PATH, journal, self.legacy_fighter_ids
+        )
+
+    def _save_raw_fight_dataset(self) -> None:
+        # Only the years whose fights changed are written again
+        written = PartitionedDataset(self.RAW_FIGHTS_DATASET_PATH).save_csv(
+            self.TOTAL_EVENT_AND_FIGHTS_PATH, partition_column="date", sep=";"
+        )
+        if written:
+            print(
+                f'Saved the fights of {", ".join(written)} to '
+                f"{self.RAW_FIGHTS_DATASET_PATH}"
             )
 
-            new_event_and_fights_data = new_event_and_fights_data[
-                list(old_event_and_fights_data.columns)
+    def _update_fighter_dimension(self) -> None:
+        # Every fighter in the fight data gets an integer code, see FighterDimension
+        fighter_dimension = FighterDimension(self.FIGHTER_DIMENSION_PATH)
+        fights = PartitionedDataset(self.RAW_FIGHTS_DATASET_PATH).read(
+            columns=["R_fighter", "B_fighter", "R_ufcstats_id", "B_ufcstats_id"]
+        )
+        if (
+            fighter_dimension.add_fights(fights)
+            or not self.FIGHTER_DIMENSION_PATH.exists()
+        ):
+            fighter_dimension.save()
+
+    def _save_scraped_fights(
+        self, fight_entries: List[Dict], event_entries: List[Dict]
+    ) -> None:
+        fight_fighter_links = {
+            entry["url"]: fighter_links_by_url(entry.get("fighters", {}))
+            for entry in fight_entries
+        }
+        self._add_new_fighter_links(
+            {
+                link: name
+                for fighter_links in fight_fighter_links.values()
+                for link, name in fighter_links.items()
+            }
+        )
+        self.store.save_scraped_fights(
+            fight_fighter_links,
+            {entry["url"]: entry.get("date") for entry in event_entries},
+        )
+        # Events whose fights were only listed when they were scraped
+        listed_events = {
+            entry["url"]: entry["fights"]
+            for entry in event_entries
+            if "fights" in entry
+        }
+        if listed_events:
+            self.store.save_event_fight_links(listed_events)
+
+    def _leave_unscraped_events(
+        self,
+        event_and_fight_links: Dict[str, List[str]],
+        journal: RunJournal,
+        after_row: Optional[str],
+        before_row: Optional[str],
+    ) -> None:
+        """
+        Events that a run with a budget had no time for are left to the next run, with
+        the rows they go between. The events scraped are all newer than them.
+        """
+        # Events whose page failed are queued in the failed urls instead
+        completed_events = journal.completed("event") | journal.completed(
+            "failed_event"
+        )
+        left_events = [
+            {
+                "url": event,
+                "fights": fights,
+                "after_row": after_row,
+                "before_row": before_row,
+            }
+            for event, fights in event_and_fight_links.items()
+            if event not in completed_events
+        ]
+        if not left_events:
+            return
+
+        left_event_links = {entry["url"] for entry in left_events}
+        self.store.save_pending_events(
+            left_events
+            + [
+                entry
+                for entry in self.store.pending_events()
+                if entry["url"] not in left_event_links
             ]
+        )
+        print(
+            f"{len(left_events)} events are left for the next run, the scrape budget "
+            "ran out."
+        )
 
-            latest_total_fight_data = new_event_and_fights_data.append(
-                old_event_and_fights_data, ignore_index=True
+    def _scrape_pending_events(self, failed_urls: FailedUrlQueue) -> None:
+        pending_events = self.store.pending_events()
+        if not pending_events or self.engine.budget.spent():
+            return
+
+        print(f"Scraping {len(pending_events)} events left by earlier runs: ")
+        rows, inserted = self._scrape_events_in_place(pending_events, failed_urls)
+        self.store.save_pending_events(rows.left_events())
+        print(
+            f"Added {inserted} fights of events left by earlier runs to "
+            f"{self.TOTAL_EVENT_AND_FIGHTS_PATH}\n"
+        )
+
+    def _retry_failed_events(self, failed_urls: FailedUrlQueue) -> None:
+        failed_events = [dict(entry) for entry in failed_urls.entries("event")]
+        if not failed_events or self.engine.budget.spent():
+            return
+
+        print(f"Retrying {len(failed_events)} events that failed in earlier runs: ")
+        rows, inserted = self._scrape_events_in_place(failed_events, failed_urls)
+        failed_again = {
+            entry["url"] for entry in rows.entries if entry["kind"] == "failed_event"
+        }
+        for entry in failed_events[: rows.written]:
+            if entry["url"] not in failed_again:
+                failed_urls.discard(entry["url"])
+        # Events the budget had no time for stay queued, next to the rows added since
+        for entry in rows.left_events():
+            failed_urls.update(
+                entry["url"],
+                after_row=entry["after_row"],
+                before_row=entry["before_row"],
             )
-            latest_total_fight_data.to_csv(self.TOTAL_EVENT_AND_FIGHTS_PATH, index=None)
+        failed_urls.save()
+        print(
+            f"Added {inserted} fights of retried events to "
+            f"{self.TOTAL_EVENT_AND_FIGHTS_PATH}\n"
+        )
 
-            os.remove(self.NEW_EVENT_AND_FIGHTS_PATH)
-            print("Removed new event and fight files")
+    def _scrape_events_in_place(
+        self, events: List[Dict], failed_urls: FailedUrlQueue
+    ) -> Tuple[_PendingEventRows, int]:
+        """
+        Scrapes events whose rows go between the rows of the fight data, each with its
+        "url", "fights" and the "after_row" or "before_row" its rows go next to. Fights
+        and events that fail are queued for the next run.
+        """
+        rows = _PendingEventRows(events)
+        self._get_total_fight_stats(
+            {entry["url"]: entry["fights"] for entry in events}, self.engine, rows
+        )
+        inserted = insert_rows(self.TOTAL_EVENT_AND_FIGHTS_PATH, rows.insertions)
+        self._save_scraped_fights(
+            [entry for entry in rows.entries if entry["kind"] == "fight"],
+            [entry for entry in rows.entries if entry["kind"] == "event"],
+        )
+        self._queue_failed_fights(
+            [entry for entry in rows.entries if entry["kind"] == "failed_fight"],
+            failed_urls,
+        )
+        self._queue_failed_events(
+            [entry for entry in rows.entries if entry["kind"] == "failed_event"],
+            failed_urls,
+        )
+        return rows, inserted
+
+    def _add_new_fighter_links(self, fighter_links: Dict[str, str]) -> None:
+        """
+        Saves the fighters that took part in the fights scraped by this run, so that
+        fighter discovery can work from them instead of listing every fighter again.
+        Links left over from a run whose fighters have not been scraped yet are kept.
+        """
+        self.store.add_discovered_fighter_links(fighter_links)
+
+    def _queue_failed_fights(
+        self, failed_fights: List[Dict], failed_urls: FailedUrlQueue
+    ) -> None:
+        if not failed_fights:
+            return
+
+        # Fights that failed before any row was written belong at the top of the file
+        first_row = read_first_row(self.TOTAL_EVENT_AND_FIGHTS_PATH)
+        for entry in failed_fights:
+            failed_urls.add(
+                "fight",
+                entry["url"],
+                entry["error"],
+                event=entry["event"],
+                event_info=entry["event_info"],
+                after_row=upgrade_fight_row(
+                    entry["after_row"], self.legacy_fighter_ids
+                ),
+                # Fights of pending events know the row after them
+                before_row=entry.get("before_row", first_row)
+                if entry["after_row"] is None
+                else None,
+            )
+        failed_urls.save()
+        print(
+            f"{len(failed_fights)} fights could not be scraped, they are retried on "
+            "the next run."
+        )
 
-        print("Successfully scraped and saved ufc fight data!\n")
+    def _queue_failed_events(
+        self, failed_events: List[Dict], failed_urls: FailedUrlQueue
+    ) -> None:
+        if not failed_events:
+            return
+
+        # Events that failed before any row was written belong at the top of the file
+        first_row = read_first_row(self.TOTAL_EVENT_AND_FIGHTS_PATH)
+        for entry in failed_events:
+            failed_urls.add(
+                "event",
+                entry["url"],
+                entry["error"],
+                fights=entry["fights"],
+                after_row=upgrade_fight_row(
+                    entry["after_row"], self.legacy_fighter_ids
+                ),
+                before_row=entry.get("before_row", first_row)
+                if entry["after_row"] is None
+                else None,
+            )
+        failed_urls.save()
+        print(
+            f"{len(failed_events)} events could not be scraped, they are retried on "
+            "the next run."
+        )
+
+    def _retry_failed_fights(self, failed_urls: FailedUrlQueue) -> None:
+        failed_fights = failed_urls.entries("fight")
+        if not failed_fights:
+            return
+
+        results = {}
+
+        l = len(failed_fights)
+        print(f"Retrying {l} fights that failed in earlier runs: ")
+        print_progress(0, l, prefix="Progress:", suffix="Complete")
+
+        def on_result(result) -> None:
+            url, record, fighter_links, error = result
+            row = None if record is None else fight_record_to_row(record)
+            results[url] = (row, fighter_links, error)
+            print_progress(len(results), l, prefix="Progress:", suffix="Complete")
+
+        self.engine.run(
+            [
+                ScrapeJob(
+                    entry["url"],
+                    functools.partial(
+                        self._parse_retried_fight,
+                        url=entry["url"],
+                        event_info=entry["event_info"],
+                    ),
+                    on_error=functools.partial(
+                        self._retried_fight_failed, url=entry["url"]
+                    ),
+                    page_type="fight",
+                )
+                for entry in failed_fights
+            ],
+            on_result=on_result,
+        )
+
+        # Taken up front, the queue entries are updated as the loop goes
+        slots = {
+            entry["url"]: (entry["after_row"], entry["before_row"])
+            for entry in failed_fights
+        }
+
+        def anchors(entry):
+            return slots[entry["url"]]
+
+        def succeeded(entry) -> bool:
+            return results[entry["url"]][2] is None
+
+        insertions = []
+        fight_fighter_links = {}
+        for entry in failed_fights:
+            row, links, error = results[entry["url"]]
+            if error is None:
+                insertions.append({"row": row, **entry})
+                fight_fighter_links[entry["url"]] = links
+                failed_urls.discard(entry["url"])
+                continue
+
+            # Fights that share a slot keep their order, so a fight that fails again is
+            # anchored to the retried rows around it from now on.
+            same_slot = [
+                other for other in failed_fights if anchors(other) == anchors(entry)
+            ]
+            position = same_slot.index(entry)
+            preceding = [other for other in same_slot[:position] if succeeded(other)]
+            following = [
+                other for other in same_slot[position + 1 :] if succeeded(other)
+            ]
+            after_row, before_row = anchors(entry)
+            if preceding:
+                after_row = results[preceding[-1]["url"]][0]
+            elif following and after_row is None:
+                before_row = results[following[0]["url"]][0]
+            failed_urls.add(
+                "fight", entry["url"], error, after_row=after_row, before_row=before_row
+            )
+
+        inserted = insert_rows(self.TOTAL_EVENT_AND_FIGHTS_PATH, insertions)
+        self._add_new_fighter_links(
+            {
+                link: name
+                for links in fight_fighter_links.values()
+                for link, name in links.items()
+            }
+        )
+        self.store.save_scraped_fights(fight_fighter_links, {})
+        failed_urls.save()
+        print(
+            f"Added {inserted} retried fights to {self.TOTAL_EVENT_AND_FIGHTS_PATH}\n"
+        )
 
     def _scrape_raw_fight_data(
-        self, event_and_fight_links: Dict[str, List[str]], filepath
+        self, event_and_fight_links: Dict[str, List[str]], filepath, journal: RunJournal
     ):
-        if filepath.exists():
-            print(f'File {filepath} already exists, overwriting.')
-
-        total_stats = FightDataScraper._get_total_fight_stats(event_and_fight_links)
-        with open(filepath.as_posix(), "wb") as file:
-            file.write(bytes(self.HEADER, encoding="ascii", errors="ignore"))
-            file.write(bytes(total_stats, encoding="ascii", errors="ignore"))
-
-    def _get_fight_stats_task(self, fight, event_info):
-        #print(threading.get_native_id())
-        total_fight_stats = ""
-        try:
-            fight_soup = make_soup(fight)
-            fight_stats = FightDataScraper._get_fight_stats(fight_soup)
-            fight_details = FightDataScraper._get_fight_details(fight_soup)
-            result_data = FightDataScraper._get_fight_result_data(fight_soup)
-            total_fight_stats = (
-                    fight_stats
-                    + ";"
-                    + fight_details
-                    + ";"
-                    + event_info
-                    + ";"
-                    + result_data
+        writer = RowWriter(filepath, self.HEADER, journal=journal, resume=True)
+        if writer.committed_offset() is not None:
+            completed_events = journal.completed("event") | journal.completed(
+                "failed_event"
+            )
+            print(
+                f"Resuming {filepath}, {len(completed_events)} events were already "
+                "scraped."
+            )
+            event_and_fight_links = {
+                event: fights
+                for event, fights in event_and_fight_links.items()
+                if event not in completed_events
+            }
+        else:
+            if filepath.exists():
+                print(f"File {filepath} already exists, overwriting.")
+            # Marks the run as started, so an interrupted run is resumed, not skipped.
+            journal.record([{"kind": "run", "url": filepath.name}], sync=True)
+
+        with writer:
+            FightDataScraper._get_total_fight_stats(
+                event_and_fight_links, self.engine, writer
             )
-        except Exception as e:
-            pass
-            #print("Error getting fight stats, " + str(e))
 
-        return total_fight_stats
+    @classmethod
+    def _get_fight_stats_task(
+        cls, fight_soup: BeautifulSoup, event_info: str
+    ) -> FightRecord:
+        # Failures are left to the caller, a fight is queued for a retry, not dropped.
+        date, location = event_info.split(";")
+        return fight_record_from_texts(
+            {
+                **cls._get_fight_stats(fight_soup),
+                **cls._get_fight_details(fight_soup),
+                "date": date,
+                "location": location,
+                **cls._get_fight_result_data(fight_soup),
+            }
+        )
 
     @classmethod
-    def _get_total_fight_stats(cls, event_and_fight_links: Dict[str, List[str]]) -> str:
-        total_stats = ""
+    def _parse_retried_fight(
+        cls, fight_soup: BeautifulSoup, url: str, event_info: str
+    ) -> Tuple:
+        record = cls._get_fight_stats_task(fight_soup, event_info)
+        return (url, record, cls._get_fighter_links(fight_soup), None), []
 
-        l = len(event_and_fight_links)
-        print(f'Scraping data for {l} fights: ')
-        print_progress(0, l, prefix="Progress:", suffix="Complete")
+    @classmethod
+    def _retried_fight_failed(cls, e: Exception, url: str) -> Tuple:
+        return (url, None, {}, FailedUrlQueue.describe(e)), []
 
-        for index, (event, fights) in enumerate(event_and_fight_links.items()):
-            event_soup = make_soup(event)
-            event_info = FightDataScraper._get_event_info(event_soup)
-
-            # Get data for each fight in the event in parallel.
-            with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-                futures = []
-                for fight in fights:
-                    futures.append(executor.submit(FightDataScraper._get_fight_stats_task, self=cls, fight=fight, event_info=event_info))
-                for future in concurrent.futures.as_completed(futures):
-                    fighter_stats = future.result()
-                    if fighter_stats != "":
-                        if total_stats == "":
-                            total_stats = fighter_stats
-                        else:
-                            total_stats = total_stats + "\n" + fighter_stats
-                    print_progress(index + 1, l, prefix="Progress:", suffix="Complete")
-
-        return total_stats
+    # The parse functions below run in the engine's parse processes, so they are
+    # classmethods bound through functools.partial rather than closures.
+    # Results are tagged with the event and fight position so that rows can be put
+    # back in event order (newest first) whatever order the pages complete in.
+    @classmethod
+    def _parse_fight(
+        cls,
+        fight_soup: BeautifulSoup,
+        event_index: int,
+        fight_index: int,
+        event_info: str,
+    ) -> Tuple:
+        fight_stats = cls._get_fight_stats_task(fight_soup, event_info)
+        fighter_links = cls._get_fighter_links(fight_soup)
+        return (
+            (event_index, fight_index, event_info, fight_stats, fighter_links, None),
+            [],
+        )
 
     @classmethod
-    def _get_fight_stats(cls, fight_soup: BeautifulSoup) -> str:
-        tables = fight_soup.findAll("tbody")
-        total_fight_data = [tables[0], tables[2]]
-        fight_stats = []
-        for table in total_fight_data:
-            row = table.find("tr")
-            stats = ""
-            for data in row.findAll("td"):
-                if stats == "":
-                    stats = data.text
-                else:
-                    stats = stats + "," + data.text
-            fight_stats.append(
-                stats.replace("  ", "")
-                .replace("\n\n", "")
-                .replace("\n", ",")
-                .replace(", ", ",")
-                .replace(" ,", ",")
+    def _fight_failed(
+        cls, e: Exception, event_index: int, fight_index: int, event_info: str
+    ) -> Tuple:
+        error = FailedUrlQueue.describe(e)
+        return (event_index, fight_index, event_info, None, {}, error), []
+
+    @classmethod
+    def _parse_event(
+        cls, event_soup: BeautifulSoup, event_index: int, fights: Optional[List[str]]
+    ) -> Tuple:
+        event_info = cls._get_event_info(event_soup)
+        if fights is None:
+            # The event page could not be listed before, its fights are listed now
+            fights = UFCLinks._get_fight_links(event_soup)
+        fight_jobs = [
+            ScrapeJob(
+                fight,
+                functools.partial(
+                    cls._parse_fight,
+                    event_index=event_index,
+                    fight_index=fight_index,
+                    event_info=event_info,
+                ),
+                on_error=functools.partial(
+                    cls._fight_failed,
+                    event_index=event_index,
+                    fight_index=fight_index,
+                    event_info=event_info,
+                ),
+                page_type="fight",
+                rank=event_index,
             )
+            for fight_index, fight in enumerate(fights)
+        ]
+        return (event_index, None, fights, None), fight_jobs
 
-        fight_stats[1] = ";".join(fight_stats[1].split(",")[6:])
-        fight_stats[0] = ";".join(fight_stats[0].split(","))
-        fight_stats = ";".join(fight_stats)
-        return fight_stats
+    @classmethod
+    def _event_failed(cls, e: Exception, event_index: int) -> Tuple:
+        return (event_index, None, None, FailedUrlQueue.describe(e)), []
 
     @classmethod
-    def _get_fight_details(cls, fight_soup: BeautifulSoup) -> str:
-        columns = ""
-        for div in fight_soup.findAll("div", {"class": "b-fight-details__content"}):
-            for col in div.findAll("p", {"class": "b-fight-details__text"}):
-                if columns == "":
-                    columns = col.text
-                else:
-                    columns = columns + "," + (col.text)
-
-        columns = (
-            columns.replace("  ", "")
-            .replace("\n\n\n\n", ",")
-            .replace("\n", "")
-            .replace(", ", ",")
-            .replace(" ,", ",")
-            .replace("Method: ", "")
-            .replace("Round:", "")
-            .replace("Time:", "")
-            .replace("Time format:", "")
-            .replace("Referee:", "")
+    def _get_event_job(
+        cls, event_index: int, event: str, fights: Optional[List[str]]
+    ) -> ScrapeJob:
+        return ScrapeJob(
+            event,
+            functools.partial(cls._parse_event, event_index=event_index, fights=fights),
+            on_error=functools.partial(cls._event_failed, event_index=event_index),
+            priority=EVENT_PRIORITY,
+            page_type="event",
+            rank=event_index,
+        )
+
+    @classmethod
+    def _get_total_fight_stats(
+        cls,
+        event_and_fight_links: Dict[str, List[str]],
+        engine: ScrapeEngine,
+        writer: RowWriter,
+    ) -> None:
+        events = list(event_and_fight_links.items())
+        # Fights that are not known yet are listed from the event page
+        fight_counts = [None if fights is None else len(fights) for _, fights in events]
+        # Rows of events that finished ahead of an earlier event wait here, so that the
+        # file stays in event order. Only a handful of events are in flight at once.
+        pending: Dict[int, Dict[int, Tuple]] = {}
+        # Errors of the event pages that could not be scraped
+        failed_events: Dict[int, str] = {}
+        listed_events = set()
+        next_event = 0
+        done = 0
+
+        l = sum(count for count in fight_counts if count is not None)
+        print(f"Scraping data for {l} fights: ")
+        print_progress(0, l, prefix="Progress:", suffix="Complete")
+
+        def write_completed_events() -> None:
+            nonlocal next_event
+            while next_event < len(events):
+                event, fights = events[next_event]
+                if next_event in failed_events:
+                    # Queued for the next run with the row its fights go after
+                    writer.write_rows(
+                        [],
+                        entries=[
+                            {
+                                "kind": "failed_event",
+                                "url": event,
+                                "fights": fights,
+                                "error": failed_events.pop(next_event),
+                                "after_row": writer.last_row,
+                            }
+                        ],
+                    )
+                    next_event += 1
+                    continue
+                if len(pending.get(next_event, {})) != fight_counts[next_event]:
+                    return
+                event_stats = pending.pop(next_event, {})
+                rows = []
+                entries = []
+                # A failed fight is remembered with the row it comes after, which is
+                # where a later run puts it once the page can be scraped.
+                last_row = writer.last_row
+                date = None
+                for fight_index, fight in enumerate(fights):
+                    event_info, record, fighter_links, error = event_stats[fight_index]
+                    if error is None:
+                        row = fight_record_to_row(record)
+                        rows.append(row)
+                        last_row = row
+                        date = record.date
+                        entries.append(
+                            {"kind": "fight", "url": fight, "fighters": fighter_links}
+                        )
+                    else:
+                        entries.append(
+                            {
+                                "kind": "failed_fight",
+                                "url": fight,
+                                "event": event,
+                                "event_info": event_info,
+                                "error": error,
+                                "after_row": last_row,
+                            }
+                        )
+                event_entry = {"kind": "event", "url": event, "date": date}
+                if next_event in listed_events:
+                    event_entry["fights"] = fights
+                writer.write_rows(rows, entries=entries + [event_entry])
+                next_event += 1
+
+        def on_result(result) -> None:
+            nonlocal done, l
+            event_index, fight_index, *fight_result = result
+            if fight_index is None:
+                # The event page, with its fights or the error it failed with
+                fights, error = fight_result
+                if error is not None:
+                    failed_events[event_index] = error
+                elif fight_counts[event_index] is None:
+                    events[event_index] = (events[event_index][0], fights)
+                    fight_counts[event_index] = len(fights)
+                    listed_events.add(event_index)
+                    l += len(fights)
+                write_completed_events()
+                return
+            pending.setdefault(event_index, {})[fight_index] = fight_result
+            write_completed_events()
+            done += 1
+            print_progress(done, l, prefix="Progress:", suffix="Complete")
+
+        # Events without any fights are complete from the start.
+        write_completed_events()
+
+        # Event pages, and the fight pages they lead to, all go through one queue so
+        # that the engine's workers stay busy across event boundaries. Pages are ranked
+        # by event, newest first, so a budget runs out on the oldest events.
+        engine.run(
+            [
+                cls._get_event_job(event_index, event, fights)
+                for event_index, (event, fights) in enumerate(events)
+            ],
+            on_result=on_result,
+            within_budget=True,
         )
 
-        fight_details = ";".join(columns.split(",")[:5])
+    @classmethod
+    def _get_fighter_links(cls, fight_soup: BeautifulSoup) -> Dict[str, str]:
+        fighter_links = {}
+        for link in fight_soup.findAll(
+            "a", {"class": "b-link b-fight-details__person-link"}, href=True
+        ):
+            fighter_links[link["href"]] = link.text.strip()
+        return fighter_links
+
+    @classmethod
+    def _get_fight_stats(cls, fight_soup: BeautifulSoup) -> Dict[str, str]:
+        tables = fight_soup.findAll("tbody")
+        # Every cell holds the red corner's value above the blue corner's
+        totals, significant_strikes = (
+            [
+                [clean_text(value.text) for value in cell.findAll("p")]
+                for cell in table.find("tr").findAll("td")
+            ]
+            for table in (tables[0], tables[2])
+        )
+        columns = [
+            "fighter",
+            "KD",
+            "SIG_STR.",
+            "SIG_STR_pct",
+            "TOTAL_STR.",
+            "TD",
+            "TD_pct",
+            "SUB_ATT",
+            "REV",
+            "CTRL",
+            "HEAD",
+            "BODY",
+            "LEG",
+            "DISTANCE",
+            "CLINCH",
+            "GROUND",
+        ]
+        # The significant strikes table repeats the fighters and the strike totals
+        cells = totals + significant_strikes[3:]
+        # Each fighter's name links to their page, which has their ufcstats id
+        fighter_links = [
+            "" if value.find("a") is None else value.find("a").get("href", "")
+            for value in tables[0].find("tr").find("td").findAll("p")
+        ]
+        return {
+            **{
+                f"{corner}_{column}": cell[index]
+                for column, cell in zip(columns, cells)
+                for index, corner in enumerate(CORNERS)
+            },
+            **{
+                f"{corner}_fighter_link": link
+                for corner, link in zip(CORNERS, fighter_links)
+            },
+        }
+
+    @classmethod
+    def _get_fight_details(cls, fight_soup: BeautifulSoup) -> Dict[str, str]:
+        labels = {
+            "Method:": "win_by",
+            "Round:": "last_round",
+            "Time:": "last_round_time",
+            "Time format:": "Format",
+            "Referee:": "Referee",
+        }
+        fight_details = {}
+        content = fight_soup.find("div", {"class": "b-fight-details__content"})
+        for item in content.find("p", {"class": "b-fight-details__text"}).findAll(
+            "i",
+            {
+                "class": [
+                    "b-fight-details__text-item_first",
+                    "b-fight-details__text-item",
+                ]
+            },
+        ):
+            label = clean_text(item.find("i", {"class": "b-fight-details__label"}).text)
+            if label in labels:
+                fight_details[labels[label]] = clean_text(
+                    item.text.replace(label, "", 1)
+                )
 
         return fight_details
 
@@ -206,28 +906,25 @@ class FightDataScraper:
         return event_info
 
     @classmethod
-    def _get_fight_result_data(cls, fight_soup: BeautifulSoup) -> str:
+    def _get_fight_result_data(cls, fight_soup: BeautifulSoup) -> Dict[str, str]:
         winner = ""
         for div in fight_soup.findAll("div", {"class": "b-fight-details__person"}):
             if (
                 div.find(
                     "i",
                     {
-                        "class": "b-fight-details__person-status b-fight-details__person-status_style_green"
+                        "class": "b-fight-details__person-status "
+                        "b-fight-details__person-status_style_green"
                     },
                 )
                 is not None
             ):
-                winner = (
-                    div.find("h3", {"class": "b-fight-details__person-name"})
-                    .text.replace(" \n", "")
-                    .replace("\n", "")
+                winner = clean_text(
+                    div.find("h3", {"class": "b-fight-details__person-name"}).text
                 )
 
-        fight_type = (
-            fight_soup.find("i", {"class": "b-fight-details__fight-title"})
-            .text.replace("  ", "")
-            .replace("\n", "")
+        fight_type = clean_text(
+            fight_soup.find("i", {"class": "b-fight-details__fight-title"}).text
         )
 
-        return fight_type + ";" + winner
+        return {"Fight_type": fight_type, "Winner": winner}
@@ -1,88 +1,179 @@
-import pickle
-from typing import Dict, List, Tuple
+import functools
+from typing import Dict, List, Optional, Tuple
 
-from src.createdata.utils import make_soup, print_progress
+from bs4 import BeautifulSoup
 
-from src.createdata.data_files_path import (  # isort:skip
-    EVENT_AND_FIGHT_LINKS_PICKLE,
-    PAST_EVENT_LINKS_PICKLE,
-)
+from src.createdata.scrape_engine import ScrapeEngine, ScrapeJob
+from src.createdata.scrape_store import ScrapeStore, get_scrape_store
+from src.createdata.utils import make_soup, print_progress
 
 
 class UFCLinks:
     def __init__(
-        self, all_events_url="http://ufcstats.com/statistics/events/completed?page=all"
+        self,
+        all_events_url="http://ufcstats.com/statistics/events/completed?page=all",
+        engine: Optional[ScrapeEngine] = None,
+        full_discovery: bool = False,
+        events_page_url="http://ufcstats.com/statistics/events/completed?page={page}",
+        store: Optional[ScrapeStore] = None,
     ):
         self.all_events_url = all_events_url
-        self.PAST_EVENT_LINKS_PICKLE_PATH = PAST_EVENT_LINKS_PICKLE
-        self.EVENT_AND_FIGHT_LINKS_PICKLE_PATH = EVENT_AND_FIGHT_LINKS_PICKLE
+        self.events_page_url = events_page_url
+        self.full_discovery = full_discovery
+        self.engine = engine if engine is not None else ScrapeEngine()
+        self.store = store if store is not None else get_scrape_store()
         self.new_event_links, self.all_event_links = self._get_updated_event_links()
 
-    def _get_updated_event_links(self) -> Tuple[List[str], List[str]]:
-        all_event_links = []
-        soup = make_soup(self.all_events_url)
+    @staticmethod
+    def _get_event_links(listing_url: str) -> List[str]:
+        event_links = []
+        soup = make_soup(listing_url, page_type="event_listing")
 
         for link in soup.findAll("td", {"class": "b-statistics__table-col"}):
             for href in link.findAll("a"):
                 foo = href.get("href")
-                all_event_links.append(foo)
+                event_links.append(foo)
+
+        return event_links
+
+    def _get_new_event_links(self) -> List[str]:
+        # The paginated listing is newest first, so once a known event shows up every
+        # event after it is known as well and there is no need to look any further.
+        new_event_links = []
+        page = 1
+        while True:
+            event_links = self._get_event_links(self.events_page_url.format(page=page))
+            if not any(link not in new_event_links for link in event_links):
+                # Ran past the last page
+                return new_event_links
+            past_event_links = self.store.seen_events_among(event_links)
+            for link in event_links:
+                if link in past_event_links:
+                    return new_event_links
+                if link not in new_event_links:
+                    new_event_links.append(link)
+            page += 1
 
-        if not self.PAST_EVENT_LINKS_PICKLE_PATH.exists():
+    def _get_updated_event_links(self) -> Tuple[List[str], List[str]]:
+        if not self.store.has_seen_events():
             # if no past event links are present, then there are no new event links
-            new_event_links = []
+            return [], self._get_event_links(self.all_events_url)
+
+        if self.full_discovery:
+            all_event_links = self._get_event_links(self.all_events_url)
+            # Find links of the newer events, in the (newest first) order of the listing
+            past_event_links = self.store.seen_events_among(all_event_links)
+            new_event_links = [
+                link for link in all_event_links if link not in past_event_links
+            ]
         else:
-            # get past event links
-            with open(self.PAST_EVENT_LINKS_PICKLE_PATH.as_posix(), "rb") as pickle_in:
-                past_event_links = pickle.load(pickle_in)
-
-            # Find links of the newer events
-            new_event_links = list(set(all_event_links) - set(past_event_links))
-
-        # dump all_event_links as PAST_EVENT_LINKS
-        with open(self.PAST_EVENT_LINKS_PICKLE_PATH.as_posix(), "wb") as f:
-            pickle.dump(all_event_links, f)
+            new_event_links = self._get_new_event_links()
+            all_event_links = new_event_links + self.store.seen_event_links()
 
         return new_event_links, all_event_links
 
+    @staticmethod
+    def _get_fight_links(event_soup: BeautifulSoup) -> List[str]:
+        event_fights = []
+        for row in event_soup.findAll(
+            "tr",
+            {
+                "class": "b-fight-details__table-row "
+                "b-fight-details__table-row__hover js-fight-details-click"
+            },
+        ):
+            href = row.get("data-link")
+            event_fights.append(href)
+        return event_fights
+
+    @staticmethod
+    def _parse_event(event_soup: BeautifulSoup, link: str):
+        return (link, UFCLinks._get_fight_links(event_soup)), []
+
+    @staticmethod
+    def _event_failed(e: Exception, link: str):
+        # The fights of the event are unknown, they are listed from the event page
+        # when they are scraped
+        return (link, None), []
+
+    def commit_event_links(self) -> None:
+        """
+        Marks every listed event as seen. Only call this once the fight data of the new
+        events has been saved, otherwise a failed run would skip them next time.
+        """
+        self.store.commit_event_links(self.all_event_links)
+
     def get_event_and_fight_links(self) -> (Dict, Dict):
+        """
+        Returns the fight links of the new events and of all events, newest first.
+        Events whose page could not be fetched have None in place of their fights.
+        """
+
         def get_fight_links(event_links: List[str]) -> Dict[str, List[str]]:
             event_and_fight_links = {}
 
+            def on_result(link_and_fights) -> None:
+                link, event_fights = link_and_fights
+                event_and_fight_links[link] = event_fights
+                print_progress(
+                    len(event_and_fight_links), l, prefix="Progress:", suffix="Complete"
+                )
+
             l = len(event_links)
             print("Scraping event and fight links: ")
             print_progress(0, l, prefix="Progress:", suffix="Complete")
 
-            for index, link in enumerate(event_links):
-                event_fights = []
-                soup = make_soup(link)
-                for row in soup.findAll(
-                    "tr",
-                    {
-                        "class": "b-fight-details__table-row b-fight-details__table-row__hover js-fight-details-click"
-                    },
-                ):
-                    href = row.get("data-link")
-                    event_fights.append(href)
-                event_and_fight_links[link] = event_fights
-
-                print_progress(index + 1, l, prefix="Progress:", suffix="Complete")
-
-            return event_and_fight_links
-
-        new_events_and_fight_links = {}
-        if self.EVENT_AND_FIGHT_LINKS_PICKLE_PATH.exists():
-            if not self.new_event_links:
-                with open(
-                    self.EVENT_AND_FIGHT_LINKS_PICKLE_PATH.as_posix(), "rb"
-                ) as pickle_in:
-                    all_events_and_fight_links = pickle.load(pickle_in)
-
-                return new_events_and_fight_links, all_events_and_fight_links
-            else:
-                new_events_and_fight_links = get_fight_links(self.new_event_links)
-
-        all_events_and_fight_links = get_fight_links(self.all_event_links)
-        with open(self.EVENT_AND_FIGHT_LINKS_PICKLE_PATH.as_posix(), "wb") as f:
-            pickle.dump(all_events_and_fight_links, f)
+            self.engine.run(
+                [
+                    ScrapeJob(
+                        link,
+                        functools.partial(UFCLinks._parse_event, link=link),
+                        on_error=functools.partial(UFCLinks._event_failed, link=link),
+                        page_type="event",
+                    )
+                    for link in event_links
+                ],
+                on_result=on_result,
+            )
+            unlisted = [
+                link for link, fights in event_and_fight_links.items() if fights is None
+            ]
+            if unlisted:
+                print(
+                    f"The fights of {len(unlisted)} events could not be listed, they "
+                    "are listed again when the events are scraped."
+                )
+
+            # Keep the order of the event listing, newest events first.
+            return {link: event_and_fight_links[link] for link in event_links}
+
+        stored_events_and_fight_links = self.store.event_fight_links(
+            self.all_event_links
+        )
+
+        # Only events that are not in the store yet, or had no fights listed when they
+        # were last fetched, are requested. Everything else is already known.
+        event_links_to_fetch = [
+            link
+            for link in self.all_event_links
+            if link not in stored_events_and_fight_links
+        ]
+        if event_links_to_fetch:
+            fetched_events_and_fight_links = get_fight_links(event_links_to_fetch)
+            self.store.save_event_fight_links(
+                {
+                    link: fights
+                    for link, fights in fetched_events_and_fight_links.items()
+                    if fights is not None
+                }
+            )
+            stored_events_and_fight_links.update(fetched_events_and_fight_links)
+
+        all_events_and_fight_links = {
+            link: stored_events_and_fight_links[link] for link in self.all_event_links
+        }
+        new_events_and_fight_links = {
+            link: all_events_and_fight_links[link] for link in self.new_event_links
+        }
 
         return new_events_and_fight_links, all_events_and_fight_links
@@ -1,43 +1,62 @@
+import functools
+import os
 import pickle
-import concurrent.futures
-import threading
-from typing import Dict, List
+from typing import Dict, Iterable, List, Optional
 
-import numpy as np
 import pandas as pd
 
+from src.createdata.columnar import PartitionedDataset
+from src.createdata.failed_urls import FailedUrlQueue
+from src.createdata.fighter_dimension import known_fighter_ids, ufcstats_id
+from src.createdata.records import (
+    FighterRecord,
+    clean_text,
+    fighter_record_from_texts,
+    upgrade_fighter_data,
+    upgrade_legacy_fighter_file,
+)
+from src.createdata.run_journal import RunJournal
+from src.createdata.scrape_engine import ScrapeEngine, ScrapeJob
+from src.createdata.scrape_store import ScrapeStore, get_scrape_store
 from src.createdata.utils import make_soup, print_progress
 
 from src.createdata.data_files_path import (  # isort:skip
+    FAILED_URLS,
     FIGHTER_DETAILS,
-    PAST_FIGHTER_LINKS_PICKLE,
+    FIGHTER_DETAILS_DATASET,
+    FIGHTER_RUN_JOURNAL,
+    RAW_FIGHTS_DATASET,
     SCRAPED_FIGHTER_DATA_DICT_PICKLE,
 )
 
+
 class FighterDetailsScraper:
-    def __init__(self):
-        self.HEADER = [
-            "Height",
-            "Weight",
-            "Reach",
-            "Stance",
-            "DOB",
-            "SLpM",
-            "Str_Acc",
-            "SApM",
-            "Str_Def",
-            "TD_Avg",
-            "TD_Acc",
-            "TD_Def",
-            "Sub_Avg",
-        ]
+    def __init__(
+        self,
+        engine: Optional[ScrapeEngine] = None,
+        full_discovery: bool = False,
+        refresh_active: bool = True,
+        store: Optional[ScrapeStore] = None,
+    ):
+        self.HEADER = list(FighterRecord._fields)
         self.FIGHTER_DETAILS_PATH = FIGHTER_DETAILS
-        self.PAST_FIGHTER_LINKS_PICKLE_PATH = PAST_FIGHTER_LINKS_PICKLE
+        self.FIGHTER_DETAILS_DATASET_PATH = FIGHTER_DETAILS_DATASET
+        self.RAW_FIGHTS_DATASET_PATH = RAW_FIGHTS_DATASET
         self.SCRAPED_FIGHTER_DATA_DICT_PICKLE_PATH = SCRAPED_FIGHTER_DATA_DICT_PICKLE
+        self.FIGHTER_RUN_JOURNAL_PATH = FIGHTER_RUN_JOURNAL
+        self.FAILED_URLS_PATH = FAILED_URLS
+        self.full_discovery = full_discovery
+        self.refresh_active = refresh_active
         self.fighter_group_urls: List[str] = []
         self.new_fighters_exists = False
-        self.new_fighter_links: Dict[str, List[str]] = {}
-        self.all_fighter_links: Dict[str, List[str]] = {}
+        # Fighter links are {url: name}, names are not unique
+        self.new_fighter_links: Dict[str, str] = {}
+        self.all_fighter_links: Dict[str, str] = {}
+        self.active_fighter_links: Dict[str, str] = {}
+        # Fighters a run with a budget had no time for
+        self.left_fighter_links: Dict[str, str] = {}
+        self.engine = engine if engine is not None else ScrapeEngine()
+        self.store = store if store is not None else get_scrape_store()
 
     def _get_fighter_group_urls(self) -> List[str]:
         alphas = [chr(i) for i in range(ord("a"), ord("a") + 26)]
@@ -47,8 +66,8 @@ class FighterDetailsScraper:
         ]
         return fighter_group_urls
 
-    def _get_fighter_name_and_link(self,) -> Dict[str, List[str]]:
-        fighter_name_and_link = {}
+    def _get_fighter_link_and_name(self,) -> Dict[str, str]:
+        fighter_link_and_name = {}
         fighter_name = ""
 
         l = len(self.fighter_group_urls)
@@ -56,7 +75,7 @@ class FighterDetailsScraper:
         print_progress(0, l, prefix="Progress:", suffix="Complete")
 
         for index, fighter_group_url in enumerate(self.fighter_group_urls):
-            soup = make_soup(fighter_group_url)
+            soup = make_soup(fighter_group_url, page_type="fighter_listing")
             table = soup.find("tbody")
             names = table.findAll(
                 "a", {"class": "b-link b-link_style_black"}, href=True
@@ -68,98 +87,252 @@ class FighterDetailsScraper:
                     else:
                         fighter_name = fighter_name + " " + name.text
                 else:
-                    fighter_name_and_link[fighter_name] = name["href"]
+                    fighter_link_and_name[name["href"]] = fighter_name
                     fighter_name = ""
             print_progress(index + 1, l, prefix="Progress:", suffix="Complete")
 
-        return fighter_name_and_link
+        return fighter_link_and_name
+
+    def _get_active_fighter_links(self) -> Dict[str, str]:
+        """
+        Known fighters who fought in the fights scraped since the last run. Their career
+        stats changed with that bout, so their profiles are due for a refresh.
+        """
+        if not self.refresh_active:
+            return {}
+        return self.store.active_fighter_links()
 
     def _get_updated_fighter_links(self):
-        all_fighter_links = self._get_fighter_name_and_link()
+        if self.store.has_known_fighters() and not self.full_discovery:
+            # Every new fighter has fought in one of the new events, so the fighters
+            # linked from their fight pages are enough and the 26 listings are skipped.
+            new_fighter_links = self.store.new_fighter_links()
+            all_fighter_links = {
+                **self.store.known_fighter_links(),
+                **new_fighter_links,
+            }
+            return new_fighter_links, all_fighter_links
 
-        if not self.PAST_FIGHTER_LINKS_PICKLE_PATH.exists():
+        print("Getting fighter urls \n")
+        self.fighter_group_urls = self._get_fighter_group_urls()
+        all_fighter_links = self._get_fighter_link_and_name()
+
+        if not self.store.has_known_fighters():
             # if no past event links are present, then there are no new event links
             new_fighter_links = {}
         else:
-            # get past event links
-            with open(
-                self.PAST_FIGHTER_LINKS_PICKLE_PATH.as_posix(), "rb"
-            ) as pickle_in:
-                past_event_links = pickle.load(pickle_in)
+            past_fighter_links = self.store.known_fighter_links()
 
             # Find links of the newer fighters
-            new_fighters = list(
-                set(all_fighter_links.keys()) - set(past_event_links.keys())
-            )
             new_fighter_links = {
-                name: link
-                for name, link in all_fighter_links.items()
-                if name in new_fighters
+                link: name
+                for link, name in all_fighter_links.items()
+                if link not in past_fighter_links
             }
 
-        # dump all_event_links as PAST_EVENT_LINKS
-        with open(self.PAST_FIGHTER_LINKS_PICKLE_PATH.as_posix(), "wb") as f:
-            pickle.dump(all_fighter_links, f)
-
         return new_fighter_links, all_fighter_links
 
-    def _get_fighter_data_task(self, fighter_name, fighter_url):
-        another_soup = make_soup(fighter_url)
-        divs = another_soup.findAll(
-            "li",
-            {"class": "b-list__box-list-item b-list__box-list-item_type_block"},
+    def _commit_fighter_links(self) -> None:
+        # Only once the fighter data is saved are these fighters marked as seen, the
+        # fighters found on fight pages are part of the committed links from then on.
+        self.store.commit_fighter_links(
+            {
+                link: name
+                for link, name in self.all_fighter_links.items()
+                if link not in self.left_fighter_links
+            }
         )
-        data = []
-        for i, div in enumerate(divs):
-            if i == 9:
-                # An empty string is scraped here, let's not append that
-                continue
-            data.append(
-                div.text.replace("  ", "")
-                    .replace("\n", "")
-                    .replace("Height:", "")
-                    .replace("Weight:", "")
-                    .replace("Reach:", "")
-                    .replace("STANCE:", "")
-                    .replace("DOB:", "")
-                    .replace("SLpM:", "")
-                    .replace("Str. Acc.:", "")
-                    .replace("SApM:", "")
-                    .replace("Str. Def:", "")
-                    .replace("TD Avg.:", "")
-                    .replace("TD Acc.:", "")
-                    .replace("TD Def.:", "")
-                    .replace("Sub. Avg.:", "")
+        # Fighters that were left are scraped by the next run, like newly found ones
+        if self.left_fighter_links:
+            self.store.add_discovered_fighter_links(self.left_fighter_links)
+            print(
+                f"{len(self.left_fighter_links)} fighters are left for the next run, "
+                "the scrape budget ran out."
+            )
+
+    def _get_fighter_ranks(self) -> Dict[str, int]:
+        """
+        The row of every fighter's latest fight in the fight data, which is newest
+        first. Fighters are scraped in this order.
+        """
+        fights_dataset = PartitionedDataset(self.RAW_FIGHTS_DATASET_PATH)
+        if not fights_dataset.exists():
+            return {}
+        fights = fights_dataset.read(columns=["R_ufcstats_id", "B_ufcstats_id"])
+        fighter_ranks = {}
+        for rank, fighter_ids in enumerate(fights.itertuples(index=False)):
+            for fighter_id in fighter_ids:
+                fighter_ranks.setdefault(fighter_id, rank)
+        return fighter_ranks
+
+    @classmethod
+    def _get_fighter_data_task(cls, fighter_soup, fighter_name, fighter_url):
+        # Runs in the engine's parse processes, it must not need the scraper instance
+        labels = {
+            "Height:": "Height",
+            "Weight:": "Weight",
+            "Reach:": "Reach",
+            "STANCE:": "Stance",
+            "DOB:": "DOB",
+            "SLpM:": "SLpM",
+            "Str. Acc.:": "Str_Acc",
+            "SApM:": "SApM",
+            "Str. Def:": "Str_Def",
+            "TD Avg.:": "TD_Avg",
+            "TD Acc.:": "TD_Acc",
+            "TD Def.:": "TD_Def",
+            "Sub. Avg.:": "Sub_Avg",
+        }
+        texts = {}
+        for item in fighter_soup.findAll(
+            "li", {"class": "b-list__box-list-item b-list__box-list-item_type_block"}
+        ):
+            title = item.find("i")
+            label = "" if title is None else clean_text(title.text)
+            if label in labels:
+                texts[labels[label]] = clean_text(item.text.replace(label, "", 1))
+
+        # Pages missing some of the details are left out, as they always have been
+        data = None
+        if len(texts) == len(labels):
+            data = list(fighter_record_from_texts(texts))
+        return (fighter_name, fighter_url, data, None), []
+
+    @classmethod
+    def _fighter_failed(cls, e: Exception, fighter_name, fighter_url):
+        return (fighter_name, fighter_url, None, FailedUrlQueue.describe(e)), []
+
+    def _queue_failed_fighters(
+        self, journal: RunJournal, failed_urls: FailedUrlQueue
+    ) -> None:
+        for fighter_url in journal.completed("fighter"):
+            failed_urls.discard(fighter_url)
+
+        # Only the last failure of a fighter counts, a resumed run may have retried it
+        failed_fighters = {
+            entry["url"]: entry
+            for entry in journal.entries_of("failed_fighter")
+            if entry["url"] not in journal.completed("fighter")
+        }
+        for entry in failed_fighters.values():
+            failed_urls.add("fighter", entry["url"], entry["error"], name=entry["name"])
+        failed_urls.save()
+        if failed_fighters:
+            print(
+                f"{len(failed_fighters)} fighters could not be scraped, they are "
+                "retried on the next run."
             )
-        return fighter_name, data
 
     def _get_fighter_name_and_details(
-            self, fighter_name_and_link: Dict[str, List[str]]
+        self,
+        fighter_link_and_name: Dict[str, str],
+        journal: RunJournal,
+        refresh_urls: Iterable[str] = (),
     ) -> None:
+        # {url: (name, data)}
         fighter_name_and_details = {}
-
-        l = len(fighter_name_and_link)
-        print(f'Scraping data for {l} fighters: ')
-
-        # Get fighter data in parallel.
-        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-            futures = []
-            for index, (fighter_name, fighter_url) in enumerate(fighter_name_and_link.items()):
-                futures.append(executor.submit(FighterDetailsScraper._get_fighter_data_task, self=self,
-                                               fighter_name=fighter_name, fighter_url=fighter_url))
-            idx_progress = 0
-            print_progress(0, l, prefix="Progress:", suffix="Complete")
-            for future in concurrent.futures.as_completed(futures):
-                fighter_name_and_details[future.result()[0]] = future.result()[1]
-                print_progress(idx_progress + 1, l, prefix="Progress:", suffix="Complete")
-                idx_progress += 1
+        refresh_urls = set(refresh_urls)
+        link_order = {url: order for order, url in enumerate(fighter_link_and_name)}
+
+        # Fighters scraped by a run that did not finish are taken from its journal.
+        for entry in journal.entries_of("fighter"):
+            fighter_name_and_details[entry["url"]] = (
+                entry["name"],
+                upgrade_fighter_data(entry["data"]),
+            )
+        completed_fighters = journal.completed("fighter")
+        fighter_link_and_name = {
+            fighter_url: fighter_name
+            for fighter_url, fighter_name in fighter_link_and_name.items()
+            if fighter_url not in completed_fighters
+        }
+        if completed_fighters:
+            print(f"Resuming, {len(completed_fighters)} fighters were already scraped.")
+
+        l = len(fighter_link_and_name)
+        print(f"Scraping data for {l} fighters: ")
+        done = 0
+        scraped_urls = set()
+
+        def on_result(fighter_name_and_data) -> None:
+            nonlocal done
+            fighter_name, fighter_url, data, error = fighter_name_and_data
+            scraped_urls.add(fighter_url)
+            if error is None:
+                fighter_name_and_details[fighter_url] = (fighter_name, data)
+                journal.record(
+                    [
+                        {
+                            "kind": "fighter",
+                            "url": fighter_url,
+                            "name": fighter_name,
+                            "data": data,
+                        }
+                    ]
+                )
+            else:
+                journal.record(
+                    [
+                        {
+                            "kind": "failed_fighter",
+                            "url": fighter_url,
+                            "name": fighter_name,
+                            "error": error,
+                        }
+                    ]
+                )
+            done += 1
+            print_progress(done, l, prefix="Progress:", suffix="Complete")
+
+        # Get fighter data in parallel, fighters who fought most recently first.
+        fighter_ranks = self._get_fighter_ranks()
+        unranked = max(fighter_ranks.values(), default=0) + 1
+        print_progress(0, l, prefix="Progress:", suffix="Complete")
+        self.engine.run(
+            [
+                ScrapeJob(
+                    fighter_url,
+                    functools.partial(
+                        self._get_fighter_data_task,
+                        fighter_name=fighter_name,
+                        fighter_url=fighter_url,
+                    ),
+                    on_error=functools.partial(
+                        self._fighter_failed,
+                        fighter_name=fighter_name,
+                        fighter_url=fighter_url,
+                    ),
+                    page_type="fighter",
+                    refresh=fighter_url in refresh_urls,
+                    rank=fighter_ranks.get(ufcstats_id(fighter_url), unranked),
+                )
+                for fighter_url, fighter_name in fighter_link_and_name.items()
+            ],
+            on_result=on_result,
+            within_budget=True,
+        )
+        journal.sync()
+        self.left_fighter_links = {
+            fighter_url: fighter_name
+            for fighter_url, fighter_name in fighter_link_and_name.items()
+            if fighter_url not in scraped_urls
+        }
 
         fighters_with_no_data = []
-        for name, details in fighter_name_and_details.items():
-            if len(details) != len(self.HEADER):
-                fighters_with_no_data.append(name)
-
-        [fighter_name_and_details.pop(name) for name in fighters_with_no_data]
+        for url, (name, details) in fighter_name_and_details.items():
+            if details is None:
+                fighters_with_no_data.append(url)
+
+        [fighter_name_and_details.pop(url) for url in fighters_with_no_data]
+
+        # Saved in the order the fighters were listed rather than the order the pages
+        # came in, so the same pages always give the same file
+        fighter_name_and_details = dict(
+            sorted(
+                fighter_name_and_details.items(),
+                key=lambda item: link_order.get(item[0], len(link_order)),
+            )
+        )
 
         if not fighter_name_and_details:
             print("No new fighter data to scrape at the moment!")
@@ -176,45 +349,164 @@ class FighterDetailsScraper:
         with open(self.SCRAPED_FIGHTER_DATA_DICT_PICKLE_PATH.as_posix(), "rb") as f:
             fighter_name_and_details = pickle.load(f)
 
-        df = (
-            pd.DataFrame(fighter_name_and_details)
-            .T.replace("--", value=np.NaN)
-            .replace("", value=np.NaN)
+        # Fighters are keyed by the id of their ufcstats page, names are not unique
+        return pd.DataFrame(
+            [[name, *data] for name, data in fighter_name_and_details.values()],
+            index=pd.Index(
+                [ufcstats_id(url) for url in fighter_name_and_details],
+                name="ufcstats_id",
+            ),
+            columns=["fighter_name", *self.HEADER],
+        )
+
+    def _upgrade_legacy_files(self, failed_urls: FailedUrlQueue) -> None:
+        fighter_links = {
+            **self.store.known_fighter_links(),
+            **self.store.discovered_fighter_links(),
+        }
+        left_out = upgrade_legacy_fighter_file(
+            self.FIGHTER_DETAILS_PATH, known_fighter_ids(fighter_links)
         )
-        df.columns = self.HEADER
+        if not left_out:
+            return
+
+        # Fighters whose name the old file could not tell apart are scraped again
+        for link, name in fighter_links.items():
+            if name in left_out:
+                failed_urls.add(
+                    "fighter", link, "Converted without a ufcstats id", name=name
+                )
+        failed_urls.save()
 
-        return df
+    def _save_fighter_details_dataset(self) -> None:
+        if not self.FIGHTER_DETAILS_PATH.exists():
+            return
+        # Fighters have no event year, their details are saved as a single file
+        if PartitionedDataset(self.FIGHTER_DETAILS_DATASET_PATH).save_csv(
+            self.FIGHTER_DETAILS_PATH, index_col="ufcstats_id"
+        ):
+            print(f"Saved the fighter details to {self.FIGHTER_DETAILS_DATASET_PATH}")
 
     def create_fighter_data_csv(self) -> None:
+        self._update_fighter_details_csv()
+        self._save_fighter_details_dataset()
+
+    def _update_fighter_details_csv(self) -> None:
 
-        print("Getting fighter urls \n")
-        self.fighter_group_urls = self._get_fighter_group_urls()
         print("Getting fighter names and details \n")
+        failed_urls = FailedUrlQueue(self.FAILED_URLS_PATH)
+        self._upgrade_legacy_files(failed_urls)
         self.new_fighter_links, self.all_fighter_links = (
             self._get_updated_fighter_links()
         )
 
-        if not self.new_fighter_links:
-            if self.FIGHTER_DETAILS_PATH.exists():
-                print(f'No new fighter data to scrape at the moment, loaded existing data from {self.FIGHTER_DETAILS_PATH}.')
+        # Fighters that failed in earlier runs go ahead of the new ones.
+        if self.FIGHTER_DETAILS_PATH.exists():
+            self.new_fighter_links = {
+                **{
+                    entry["url"]: entry["name"]
+                    for entry in failed_urls.entries("fighter")
+                },
+                **self.new_fighter_links,
+            }
+
+        # Known fighters who fought since the last run get their career stats refreshed.
+        if self.FIGHTER_DETAILS_PATH.exists():
+            self.active_fighter_links = {
+                link: name
+                for link, name in self._get_active_fighter_links().items()
+                if link not in self.new_fighter_links
+            }
+        fighter_links_to_scrape = {
+            **self.new_fighter_links,
+            **self.active_fighter_links,
+        }
+
+        # Work left behind by a run that did not finish is picked up where it stopped.
+        journal = RunJournal(self.FIGHTER_RUN_JOURNAL_PATH)
+
+        if not fighter_links_to_scrape:
+            if self.FIGHTER_DETAILS_PATH.exists() and not journal.exists():
+                print(
+                    "No new fighter data to scrape at the moment, loaded existing data "
+                    f"from {self.FIGHTER_DETAILS_PATH}."
+                )
+                self._commit_fighter_links()
                 return
             else:
-                self._get_fighter_name_and_details(self.all_fighter_links)
+                self._get_fighter_name_and_details(self.all_fighter_links, journal)
+                if not self.new_fighters_exists:
+                    self._commit_fighter_links()
+                    self._queue_failed_fighters(journal, failed_urls)
+                    journal.clear()
+                    return
                 fighter_details_df = self._fighter_details_to_df()
+        elif self.FIGHTER_DETAILS_PATH.name in journal.completed("merge"):
+            # The merged file was saved, the run stopped before committing the links.
+            self.left_fighter_links = journal.last(
+                "merge", url=self.FIGHTER_DETAILS_PATH.name
+            ).get("left", {})
+            self._commit_fighter_links()
+            self._queue_failed_fighters(journal, failed_urls)
+            journal.clear()
+            return
         else:
-            self._get_fighter_name_and_details(self.new_fighter_links)
+            if self.active_fighter_links:
+                print(
+                    f"Refreshing {len(self.active_fighter_links)} fighters who fought "
+                    "since the last run."
+                )
+            self._get_fighter_name_and_details(
+                fighter_links_to_scrape,
+                journal,
+                refresh_urls=self.active_fighter_links.keys(),
+            )
             if self.new_fighters_exists:
                 new_fighter_details_df = self._fighter_details_to_df()
             else:
+                self._commit_fighter_links()
+                self._queue_failed_fighters(journal, failed_urls)
+                journal.clear()
                 return
 
-            old_fighter_details_df = pd.read_csv(
-                self.FIGHTER_DETAILS_PATH, index_col="fighter_name"
+            # Earlier runs with a budget may have had no time for any fighter
+            old_fighter_details_df = pd.DataFrame(
+                index=pd.Index([], name="ufcstats_id"),
+                columns=new_fighter_details_df.columns,
             )
+            if self.FIGHTER_DETAILS_PATH.exists():
+                old_fighter_details_df = pd.read_csv(
+                    self.FIGHTER_DETAILS_PATH, index_col="ufcstats_id"
+                )
+
+            # Refreshed fighters are updated where they are, new fighters go on top.
+            refreshed = new_fighter_details_df.index.isin(old_fighter_details_df.index)
+            for fighter_id, details in new_fighter_details_df[refreshed].iterrows():
+                old_fighter_details_df.loc[fighter_id, details.index] = details.values
 
-            fighter_details_df = new_fighter_details_df.append(
+            fighter_details_df = new_fighter_details_df[~refreshed].append(
                 old_fighter_details_df, ignore_index=False
             )
 
-        fighter_details_df.to_csv(self.FIGHTER_DETAILS_PATH, index_label="fighter_name")
-        print(f'Successfully scraped and saved ufc fighter data to {self.FIGHTER_DETAILS_PATH}\n')
+        # Written to a temporary file first so a crash never leaves a half written csv.
+        tmp_path = self.FIGHTER_DETAILS_PATH.with_suffix(".tmp")
+        fighter_details_df.to_csv(tmp_path, index_label="ufcstats_id")
+        os.replace(tmp_path, self.FIGHTER_DETAILS_PATH)
+        journal.record(
+            [
+                {
+                    "kind": "merge",
+                    "url": self.FIGHTER_DETAILS_PATH.name,
+                    "left": self.left_fighter_links,
+                }
+            ],
+            sync=True,
+        )
+
+        self._commit_fighter_links()
+        self._queue_failed_fighters(journal, failed_urls)
+        journal.clear()
+        print(
+            "Successfully scraped and saved ufc fighter data to "
+            f"{self.FIGHTER_DETAILS_PATH}\n"
+        )
@@ -0,0 +1,457 @@
+import os
+import pickle
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Union
+
+from src.createdata.fighter_dimension import fighter_links_by_url, ufcstats_id
+
+from src.createdata.data_files_path import (  # isort:skip
+    EVENT_AND_FIGHT_LINKS_PICKLE,
+    NEW_FIGHTER_LINKS_PICKLE,
+    PAST_EVENT_LINKS_PICKLE,
+    PAST_FIGHTER_LINKS_PICKLE,
+    PENDING_EVENTS_PICKLE,
+    SCRAPE_DB,
+)
+
+# SQLite allows 999 variables in a statement in older versions
+MAX_VARIABLES = 900
+
+
+def _load_pickle(filepath: Path, default):
+    if not filepath.exists():
+        return default
+    with open(filepath.as_posix(), "rb") as pickle_in:
+        return pickle.load(pickle_in)
+
+
+def _dump_pickle(filepath: Path, data) -> None:
+    tmp_path = filepath.with_suffix(".tmp")
+    with open(tmp_path.as_posix(), "wb") as f:
+        pickle.dump(data, f)
+    os.replace(tmp_path, filepath)
+
+
+def _chunks(items: List[str]) -> Iterator[List[str]]:
+    for start in range(0, len(items), MAX_VARIABLES):
+        yield items[start : start + MAX_VARIABLES]
+
+
+class FileScrapeStore:
+    """
+    What the scrapers know about events and fighters between runs, kept in the pickles
+    of the data folder. Every query loads the whole pickle it needs.
+
+    Events are "seen" once their fights are saved. Fighters are "discovered" when they
+    show up in newly scraped fights and "known" once their details are saved. Seen
+    events that a run with a budget had no time for are "pending", with the rows of the
+    fight data they go between.
+    """
+
+    def __init__(self):
+        self.PAST_EVENT_LINKS_PICKLE_PATH = PAST_EVENT_LINKS_PICKLE
+        self.EVENT_AND_FIGHT_LINKS_PICKLE_PATH = EVENT_AND_FIGHT_LINKS_PICKLE
+        self.PAST_FIGHTER_LINKS_PICKLE_PATH = PAST_FIGHTER_LINKS_PICKLE
+        self.NEW_FIGHTER_LINKS_PICKLE_PATH = NEW_FIGHTER_LINKS_PICKLE
+        self.PENDING_EVENTS_PICKLE_PATH = PENDING_EVENTS_PICKLE
+        # Written by the fights stage and read by the fighters stage
+        self.DISCOVERED_FIGHTERS_PATH = NEW_FIGHTER_LINKS_PICKLE
+
+    def has_seen_events(self) -> bool:
+        return self.PAST_EVENT_LINKS_PICKLE_PATH.exists()
+
+    def seen_event_links(self) -> List[str]:
+        return list(_load_pickle(self.PAST_EVENT_LINKS_PICKLE_PATH, []))
+
+    def seen_events_among(self, event_links: Iterable[str]) -> Set[str]:
+        return set(event_links) & set(self.seen_event_links())
+
+    def commit_event_links(self, event_links: List[str]) -> None:
+        # Newest first, like the listing
+        _dump_pickle(self.PAST_EVENT_LINKS_PICKLE_PATH, list(event_links))
+
+    def event_fight_links(self, event_links: Iterable[str]) -> Dict[str, List[str]]:
+        # Events whose fights were listed when they were fetched
+        stored = _load_pickle(self.EVENT_AND_FIGHT_LINKS_PICKLE_PATH, {})
+        return {link: stored[link] for link in event_links if stored.get(link)}
+
+    def save_event_fight_links(
+        self, event_and_fight_links: Dict[str, List[str]]
+    ) -> None:
+        stored = _load_pickle(self.EVENT_AND_FIGHT_LINKS_PICKLE_PATH, {})
+        stored.update(event_and_fight_links)
+        _dump_pickle(self.EVENT_AND_FIGHT_LINKS_PICKLE_PATH, stored)
+
+    def save_scraped_fights(
+        self, fighter_links: Dict[str, Dict[str, str]], event_dates: Dict[str, str]
+    ) -> None:
+        # The pickles keep neither, only the SQLite store can answer fights_of_fighter
+        pass
+
+    def pending_events(self) -> List[Dict]:
+        """
+        Events left for a later run, newest first, each with its "url", "fights" and
+        the "after_row" or "before_row" its rows go next to.
+        """
+        return _load_pickle(self.PENDING_EVENTS_PICKLE_PATH, [])
+
+    def save_pending_events(self, pending_events: List[Dict]) -> None:
+        if pending_events:
+            _dump_pickle(self.PENDING_EVENTS_PICKLE_PATH, pending_events)
+        elif self.PENDING_EVENTS_PICKLE_PATH.exists():
+            os.remove(self.PENDING_EVENTS_PICKLE_PATH.as_posix())
+
+    def has_known_fighters(self) -> bool:
+        return self.PAST_FIGHTER_LINKS_PICKLE_PATH.exists()
+
+    def known_fighter_links(self) -> Dict[str, str]:
+        return fighter_links_by_url(
+            _load_pickle(self.PAST_FIGHTER_LINKS_PICKLE_PATH, {})
+        )
+
+    def discovered_fighter_links(self) -> Dict[str, str]:
+        return fighter_links_by_url(
+            _load_pickle(self.NEW_FIGHTER_LINKS_PICKLE_PATH, {})
+        )
+
+    def new_fighter_links(self) -> Dict[str, str]:
+        known = self.known_fighter_links()
+        return {
+            link: name
+            for link, name in self.discovered_fighter_links().items()
+            if link not in known
+        }
+
+    def active_fighter_links(self) -> Dict[str, str]:
+        known = self.known_fighter_links()
+        return {
+            link: name
+            for link, name in self.discovered_fighter_links().items()
+            if link in known
+        }
+
+    def add_discovered_fighter_links(self, fighter_links: Dict[str, str]) -> None:
+        discovered = self.discovered_fighter_links()
+        discovered.update(fighter_links)
+        _dump_pickle(self.NEW_FIGHTER_LINKS_PICKLE_PATH, discovered)
+
+    def commit_fighter_links(self, fighter_links: Dict[str, str]) -> None:
+        """
+        Marks the fighters as known and forgets the discovered ones, their details are
+        saved.
+        """
+        _dump_pickle(
+            self.PAST_FIGHTER_LINKS_PICKLE_PATH,
+            {**self.known_fighter_links(), **fighter_links},
+        )
+        if self.NEW_FIGHTER_LINKS_PICKLE_PATH.exists():
+            os.remove(self.NEW_FIGHTER_LINKS_PICKLE_PATH.as_posix())
+
+    def close(self) -> None:
+        pass
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    url TEXT PRIMARY KEY,
+    date TEXT,
+    -- Newer events have higher positions, set when the event is seen
+    position INTEGER,
+    seen INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS events_date ON events (date);
+CREATE INDEX IF NOT EXISTS events_seen ON events (seen, position);
+
+CREATE TABLE IF NOT EXISTS fights (
+    url TEXT PRIMARY KEY,
+    event_url TEXT NOT NULL REFERENCES events (url),
+    position INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fights_event ON fights (event_url, position);
+
+CREATE TABLE IF NOT EXISTS fighters (
+    url TEXT PRIMARY KEY,
+    ufcstats_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    known INTEGER NOT NULL DEFAULT 0,
+    discovered INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS fighters_ufcstats_id ON fighters (ufcstats_id);
+CREATE INDEX IF NOT EXISTS fighters_discovered ON fighters (discovered, known);
+
+CREATE TABLE IF NOT EXISTS fight_fighters (
+    fight_url TEXT NOT NULL REFERENCES fights (url),
+    ufcstats_id TEXT NOT NULL,
+    PRIMARY KEY (fight_url, ufcstats_id)
+);
+CREATE INDEX IF NOT EXISTS fight_fighters_ufcstats_id ON fight_fighters (ufcstats_id);
+
+CREATE TABLE IF NOT EXISTS pending_events (
+    url TEXT PRIMARY KEY REFERENCES events (url),
+    -- Newest first
+    position INTEGER NOT NULL,
+    after_row TEXT,
+    before_row TEXT
+);
+"""
+
+
+class SQLiteScrapeStore:
+    """
+    The same as FileScrapeStore, kept in one SQLite database with indexes on event
+    date, fighter id and url, so that what is new since the last run is a query instead
+    of a set difference over everything ever scraped. It also records the fighters of
+    every scraped fight, see `fights_of_fighter`.
+
+    Every update is one transaction. The database is in WAL mode, threads share one
+    connection behind a lock and processes, like the shards, wait for each other's
+    writes. A new database starts from the pickles of the file store, if there are any.
+    """
+
+    def __init__(
+        self, filepath: Path = SCRAPE_DB, file_store: Optional[FileScrapeStore] = None
+    ):
+        self.filepath = filepath
+        self.DISCOVERED_FIGHTERS_PATH = filepath
+        self._lock = threading.Lock()
+        is_new = not filepath.exists()
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(
+            filepath.as_posix(), timeout=60, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._lock, self._connection:
+            self._connection.executescript(SCHEMA)
+        if is_new:
+            self._import(file_store if file_store is not None else FileScrapeStore())
+
+    def _import(self, file_store: FileScrapeStore) -> None:
+        event_and_fight_links = _load_pickle(
+            file_store.EVENT_AND_FIGHT_LINKS_PICKLE_PATH, {}
+        )
+        if event_and_fight_links:
+            self.save_event_fight_links(event_and_fight_links)
+        if file_store.has_seen_events():
+            self.commit_event_links(file_store.seen_event_links())
+        if file_store.has_known_fighters():
+            self.commit_fighter_links(file_store.known_fighter_links())
+        self.add_discovered_fighter_links(file_store.discovered_fighter_links())
+        self.save_pending_events(file_store.pending_events())
+
+    def _query(self, sql: str, parameters=()) -> List[tuple]:
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def _query_among(self, sql: str, urls: Iterable[str]) -> List[tuple]:
+        # `sql` has a {urls} placeholder for the list of urls
+        urls = list(urls)
+        rows = []
+        for chunk in _chunks(urls):
+            placeholders = ",".join("?" * len(chunk))
+            rows.extend(self._query(sql.format(urls=placeholders), chunk))
+        return rows
+
+    def has_seen_events(self) -> bool:
+        return bool(self._query("SELECT 1 FROM events WHERE seen = 1 LIMIT 1"))
+
+    def seen_event_links(self) -> List[str]:
+        rows = self._query(
+            "SELECT url FROM events WHERE seen = 1 ORDER BY position DESC"
+        )
+        return [url for url, in rows]
+
+    def seen_events_among(self, event_links: Iterable[str]) -> Set[str]:
+        rows = self._query_among(
+            "SELECT url FROM events WHERE seen = 1 AND url IN ({urls})", event_links
+        )
+        return {url for url, in rows}
+
+    def commit_event_links(self, event_links: List[str]) -> None:
+        with self._lock, self._connection as connection:
+            (position,) = connection.execute(
+                "SELECT COALESCE(MAX(position), 0) FROM events"
+            ).fetchone()
+            # The links are newest first, new events go above the seen ones and seen
+            # events keep their position
+            connection.executemany(
+                "INSERT INTO events (url, position, seen) VALUES (?, ?, 1) "
+                "ON CONFLICT (url) DO UPDATE "
+                "SET position = excluded.position, seen = 1 WHERE events.seen = 0",
+                [
+                    (link, position + offset)
+                    for offset, link in enumerate(reversed(event_links), 1)
+                ],
+            )
+
+    def event_fight_links(self, event_links: Iterable[str]) -> Dict[str, List[str]]:
+        event_links = list(event_links)
+        rows = self._query_among(
+            "SELECT event_url, url FROM fights WHERE event_url IN ({urls}) "
+            "ORDER BY event_url, position",
+            event_links,
+        )
+        fights: Dict[str, List[str]] = {}
+        for event_url, url in rows:
+            fights.setdefault(event_url, []).append(url)
+        return {link: fights[link] for link in event_links if link in fights}
+
+    def save_event_fight_links(
+        self, event_and_fight_links: Dict[str, List[str]]
+    ) -> None:
+        with self._lock, self._connection as connection:
+            connection.executemany(
+                "INSERT INTO events (url) VALUES (?) ON CONFLICT (url) DO NOTHING",
+                [(link,) for link in event_and_fight_links],
+            )
+            connection.executemany(
+                "INSERT INTO fights (url, event_url, position) VALUES (?, ?, ?) "
+                "ON CONFLICT (url) DO UPDATE SET "
+                "event_url = excluded.event_url, position = excluded.position",
+                [
+                    (fight, event, position)
+                    for event, fights in event_and_fight_links.items()
+                    for position, fight in enumerate(fights)
+                ],
+            )
+
+    def save_scraped_fights(
+        self, fighter_links: Dict[str, Dict[str, str]], event_dates: Dict[str, str]
+    ) -> None:
+        """
+        Records the fighters of every fight, {fight url: {fighter url: name}}, and the
+        date of every event.
+        """
+        with self._lock, self._connection as connection:
+            connection.executemany(
+                "INSERT INTO fight_fighters (fight_url, ufcstats_id) VALUES (?, ?) "
+                "ON CONFLICT DO NOTHING",
+                [
+                    (fight, ufcstats_id(link))
+                    for fight, links in fighter_links.items()
+                    for link in links
+                ],
+            )
+            connection.executemany(
+                "UPDATE events SET date = ? WHERE url = ?",
+                [(date, event) for event, date in event_dates.items() if date],
+            )
+
+    def pending_events(self) -> List[Dict]:
+        rows = self._query(
+            "SELECT url, after_row, before_row FROM pending_events ORDER BY position"
+        )
+        fights = self.event_fight_links(url for url, _, _ in rows)
+        return [
+            {
+                "url": url,
+                # None for events whose fights were never listed
+                "fights": fights.get(url),
+                "after_row": after_row,
+                "before_row": before_row,
+            }
+            for url, after_row, before_row in rows
+        ]
+
+    def save_pending_events(self, pending_events: List[Dict]) -> None:
+        with self._lock, self._connection as connection:
+            connection.execute("DELETE FROM pending_events")
+            connection.executemany(
+                "INSERT INTO pending_events (url, position, after_row, before_row) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (entry["url"], position, entry["after_row"], entry["before_row"])
+                    for position, entry in enumerate(pending_events)
+                ],
+            )
+
+    def has_known_fighters(self) -> bool:
+        return bool(self._query("SELECT 1 FROM fighters WHERE known = 1 LIMIT 1"))
+
+    def _fighter_links(self, where: str) -> Dict[str, str]:
+        return dict(
+            self._query(f"SELECT url, name FROM fighters WHERE {where} ORDER BY rowid")
+        )
+
+    def known_fighter_links(self) -> Dict[str, str]:
+        return self._fighter_links("known = 1")
+
+    def discovered_fighter_links(self) -> Dict[str, str]:
+        return self._fighter_links("discovered = 1")
+
+    def new_fighter_links(self) -> Dict[str, str]:
+        return self._fighter_links("discovered = 1 AND known = 0")
+
+    def active_fighter_links(self) -> Dict[str, str]:
+        return self._fighter_links("discovered = 1 AND known = 1")
+
+    @staticmethod
+    def _upsert_fighters(connection, fighter_links: Dict[str, str], flag: str) -> None:
+        connection.executemany(
+            f"INSERT INTO fighters (url, ufcstats_id, name, {flag}) "
+            "VALUES (?, ?, ?, 1) "
+            f"ON CONFLICT (url) DO UPDATE SET name = excluded.name, {flag} = 1",
+            [(link, ufcstats_id(link), name) for link, name in fighter_links.items()],
+        )
+
+    def add_discovered_fighter_links(self, fighter_links: Dict[str, str]) -> None:
+        with self._lock, self._connection as connection:
+            self._upsert_fighters(connection, fighter_links, "discovered")
+
+    def commit_fighter_links(self, fighter_links: Dict[str, str]) -> None:
+        with self._lock, self._connection as connection:
+            self._upsert_fighters(connection, fighter_links, "known")
+            connection.execute(
+                "UPDATE fighters SET discovered = 0 WHERE discovered = 1"
+            )
+
+    def fights_of_fighter(self, fighter_id: str) -> List[str]:
+        """
+        Urls of the scraped fights of the fighter with this ufcstats id, newest first.
+        """
+        rows = self._query(
+            "SELECT fights.url FROM fight_fighters "
+            "JOIN fights ON fights.url = fight_fighters.fight_url "
+            "JOIN events ON events.url = fights.event_url "
+            "WHERE fight_fighters.ufcstats_id = ? "
+            "ORDER BY events.date DESC, fights.position",
+            (fighter_id,),
+        )
+        return [url for url, in rows]
+
+    def events_since(self, date: str) -> List[str]:
+        """
+        Urls of the scraped events on or after the ISO date, newest first.
+        """
+        rows = self._query(
+            "SELECT url FROM events WHERE date >= ? ORDER BY date DESC", (date,)
+        )
+        return [url for url, in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+ScrapeStore = Union[FileScrapeStore, SQLiteScrapeStore]
+
+STORES = {"files": FileScrapeStore, "sqlite": SQLiteScrapeStore}
+
+_scrape_store: Optional[ScrapeStore] = None
+
+
+def get_scrape_store() -> ScrapeStore:
+    """
+    Returns the store the scrapers use, the file store unless set_scrape_store chose
+    another.
+    """
+    global _scrape_store
+    if _scrape_store is None:
+        _scrape_store = FileScrapeStore()
+    return _scrape_store
+
+
+def set_scrape_store(store: ScrapeStore) -> None:
+    global _scrape_store
+    _scrape_store = store
@@ -0,0 +1,331 @@
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import zlib
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+
+from src.createdata.failed_urls import FailedUrlQueue
+from src.createdata.fighter_dimension import ufcstats_id
+from src.createdata.records import FIGHT_HEADER, FighterRecord
+from src.createdata.run_journal import RunJournal
+from src.createdata.scrape_engine import ScrapeEngine
+from src.createdata.scrape_fight_data import FightDataScraper
+from src.createdata.scrape_fight_links import UFCLinks
+from src.createdata.scrape_fighter_details import FighterDetailsScraper
+from src.createdata.scrape_store import ScrapeStore, get_scrape_store
+
+from src.createdata.data_files_path import (  # isort:skip
+    FAILED_URLS,
+    FIGHT_RUN_JOURNAL,
+    FIGHTER_DETAILS,
+    FIGHTER_RUN_JOURNAL,
+    NEW_EVENT_AND_FIGHTS,
+    SHARD_DIR,
+    TOTAL_EVENT_AND_FIGHTS,
+)
+
+
+def shard_of(url: str, shard_count: int) -> int:
+    # Stable across processes and machines, unlike hash()
+    return zlib.crc32(url.encode("utf-8")) % shard_count
+
+
+class ShardedScrape:
+    """
+    Rebuilds the raw fight and fighter data from scratch in shards that run in separate
+    processes, on this machine or on others that share the data folder.
+
+    `plan` lists every event, its fights and every fighter once and saves them in the
+    shard folder. Each shard then scrapes the events and fighters whose url falls in it
+    into files of its own, and can be resumed like a normal run. `merge` puts the shards
+    together in the order of the plan, which gives the same raw_total_fight_data.csv and
+    raw_fighter_details.csv as a single run, and commits them like a single run would.
+    """
+
+    def __init__(
+        self,
+        engine: Optional[ScrapeEngine] = None,
+        shard_dir: Path = SHARD_DIR,
+        store: Optional[ScrapeStore] = None,
+    ):
+        self.engine = engine if engine is not None else ScrapeEngine()
+        self.store = store if store is not None else get_scrape_store()
+        self.SHARD_DIR_PATH = shard_dir
+        self.PLAN_PATH = shard_dir / "plan.pickle"
+
+    def _shard_path(self, stage: str, shard: int, suffix: str) -> Path:
+        return self.SHARD_DIR_PATH / f"{stage}-{shard}{suffix}"
+
+    def _load_plan(self) -> Dict:
+        if not self.PLAN_PATH.exists():
+            raise FileNotFoundError(
+                f"No shard plan in {self.SHARD_DIR_PATH}, plan the shards first"
+            )
+        with open(self.PLAN_PATH.as_posix(), "rb") as pickle_in:
+            return pickle.load(pickle_in)
+
+    def plan(self, shard_count: int) -> None:
+        print("Listing every event, fight and fighter \n")
+        _, all_events_and_fight_links = UFCLinks(
+            engine=self.engine, full_discovery=True, store=self.store
+        ).get_event_and_fight_links()
+        fighter_scraper = FighterDetailsScraper(engine=self.engine, store=self.store)
+        fighter_scraper.fighter_group_urls = fighter_scraper._get_fighter_group_urls()
+        all_fighter_links = fighter_scraper._get_fighter_link_and_name()
+
+        # Shards of an earlier plan do not belong to this one
+        if self.SHARD_DIR_PATH.exists():
+            shutil.rmtree(self.SHARD_DIR_PATH.as_posix())
+        self.SHARD_DIR_PATH.mkdir(parents=True)
+        with open(self.PLAN_PATH.as_posix(), "wb") as f:
+            pickle.dump(
+                {
+                    "shard_count": shard_count,
+                    "events": all_events_and_fight_links,
+                    "fighters": all_fighter_links,
+                },
+                f,
+            )
+        print(
+            f"Planned {len(all_events_and_fight_links)} events and "
+            f"{len(all_fighter_links)} fighters in {shard_count} shards.\n"
+        )
+
+    def scrape_fights(self, shard: int) -> None:
+        plan = self._load_plan()
+        summary_path = self._shard_path("fights", shard, ".json")
+        if summary_path.exists():
+            print(f"Fights of shard {shard} are already scraped.")
+            return
+
+        event_and_fight_links = {
+            event: fights
+            for event, fights in plan["events"].items()
+            if shard_of(event, plan["shard_count"]) == shard
+        }
+        journal = RunJournal(self._shard_path("fights", shard, ".journal.jsonl"))
+        FightDataScraper(engine=self.engine, store=self.store)._scrape_raw_fight_data(
+            event_and_fight_links,
+            filepath=self._shard_path("fights", shard, ".csv"),
+            journal=journal,
+        )
+        # The summary marks the shard as done, the journal is only needed until then
+        _write_json(
+            summary_path,
+            {
+                "failed_fights": journal.entries_of("failed_fight"),
+                "failed_events": journal.entries_of("failed_event"),
+                "fighters": {
+                    entry["url"]: entry["fighters"]
+                    for entry in journal.entries_of("fight")
+                },
+                "event_dates": {
+                    entry["url"]: entry.get("date")
+                    for entry in journal.entries_of("event")
+                },
+                # Events whose fights the plan could not list
+                "event_fights": {
+                    entry["url"]: entry["fights"]
+                    for entry in journal.entries_of("event")
+                    if "fights" in entry
+                },
+            },
+        )
+        journal.clear()
+        print(f"Successfully scraped the fights of shard {shard}!\n")
+
+    def scrape_fighters(self, shard: int) -> None:
+        plan = self._load_plan()
+        summary_path = self._shard_path("fighters", shard, ".json")
+        if summary_path.exists():
+            print(f"Fighters of shard {shard} are already scraped.")
+            return
+
+        fighter_links = {
+            link: name
+            for link, name in plan["fighters"].items()
+            if shard_of(link, plan["shard_count"]) == shard
+        }
+        journal = RunJournal(self._shard_path("fighters", shard, ".journal.jsonl"))
+        fighter_scraper = FighterDetailsScraper(engine=self.engine, store=self.store)
+        fighter_scraper.SCRAPED_FIGHTER_DATA_DICT_PICKLE_PATH = self._shard_path(
+            "fighters", shard, ".pickle"
+        )
+        fighter_scraper._get_fighter_name_and_details(fighter_links, journal)
+        fighter_name_and_details = {}
+        if fighter_scraper.new_fighters_exists:
+            with open(
+                fighter_scraper.SCRAPED_FIGHTER_DATA_DICT_PICKLE_PATH.as_posix(), "rb"
+            ) as pickle_in:
+                fighter_name_and_details = pickle.load(pickle_in)
+
+        failed_fighters = [
+            entry
+            for entry in journal.entries_of("failed_fighter")
+            if entry["url"] not in journal.completed("fighter")
+        ]
+        _write_json(
+            summary_path,
+            {"fighters": fighter_name_and_details, "failed_fighters": failed_fighters},
+        )
+        journal.clear()
+        print(f"Successfully scraped the fighters of shard {shard}!\n")
+
+    def merge(self) -> None:
+        plan = self._load_plan()
+        missing = [
+            f"{stage} {shard}"
+            for stage in ("fights", "fighters")
+            for shard in range(plan["shard_count"])
+            if not self._shard_path(stage, shard, ".json").exists()
+        ]
+        if missing:
+            raise ValueError(f'Cannot merge, shards {", ".join(missing)} are not done')
+
+        # Failures recorded against the files being replaced no longer apply
+        failed_urls = FailedUrlQueue(FAILED_URLS)
+        for kind in ("event", "fight", "fighter"):
+            for entry in failed_urls.entries(kind):
+                failed_urls.discard(entry["url"])
+
+        self._merge_fights(plan, failed_urls)
+        self._merge_fighters(plan, failed_urls)
+        FighterDetailsScraper(
+            engine=self.engine, store=self.store
+        )._save_fighter_details_dataset()
+
+        # Committed like a single run, the next run carries on incrementally from here
+        self.store.commit_event_links(list(plan["events"]))
+        self.store.save_pending_events([])
+        self.store.commit_fighter_links(plan["fighters"])
+        for filepath in (NEW_EVENT_AND_FIGHTS, FIGHT_RUN_JOURNAL, FIGHTER_RUN_JOURNAL):
+            if filepath.exists():
+                os.remove(filepath.as_posix())
+        shutil.rmtree(self.SHARD_DIR_PATH.as_posix())
+        print("Successfully merged the shards!\n")
+
+    def _read_shard_rows(self, shard: int) -> Iterator[str]:
+        filepath = self._shard_path("fights", shard, ".csv")
+        with open(filepath.as_posix(), "r") as f:
+            if f.readline() != FIGHT_HEADER:
+                raise ValueError(f"{filepath} does not hold the current fight columns")
+            for line in f:
+                yield line.rstrip("\n")
+
+    def _merge_fights(self, plan: Dict, failed_urls: FailedUrlQueue) -> None:
+        shard_count = plan["shard_count"]
+        failed_fights: Dict[str, Dict] = {}
+        failed_events: Dict[str, Dict] = {}
+        listed_events: Dict[str, List[str]] = {}
+        for shard in range(shard_count):
+            with open(self._shard_path("fights", shard, ".json").as_posix(), "r") as f:
+                summary = json.load(f)
+            for entry in summary["failed_fights"]:
+                failed_fights[entry["url"]] = entry
+            for entry in summary.get("failed_events", []):
+                failed_events[entry["url"]] = entry
+            listed_events.update(summary.get("event_fights", {}))
+            # Summaries of shards scraped before they listed the fighters have neither
+            self.store.save_scraped_fights(
+                summary.get("fighters", {}), summary.get("event_dates", {})
+            )
+        shard_rows = [self._read_shard_rows(shard) for shard in range(shard_count)]
+
+        # Every shard holds its events in plan order, with one row for each fight that
+        # did not fail, so the rows are dealt back out event by event.
+        queued_fights: List[Dict] = []
+        queued_events: List[Dict] = []
+        last_row = None
+        fd, tmp_path = tempfile.mkstemp(
+            dir=TOTAL_EVENT_AND_FIGHTS.parent.as_posix(), suffix=".tmp"
+        )
+        with os.fdopen(fd, "w") as target:
+            target.write(FIGHT_HEADER)
+            for event, fights in plan["events"].items():
+                shard = shard_of(event, shard_count)
+                rows = shard_rows[shard]
+                if event in failed_events:
+                    queued_events.append(
+                        {**failed_events[event], "after_row": last_row}
+                    )
+                    continue
+                for fight in listed_events.get(event, fights):
+                    if fight in failed_fights:
+                        # Anchored to the merged file, not to the shard's own
+                        queued_fights.append(
+                            {**failed_fights[fight], "after_row": last_row}
+                        )
+                        continue
+                    last_row = next(rows, None)
+                    if last_row is None:
+                        target.close()
+                        os.remove(tmp_path)
+                        raise ValueError(
+                            f"The fight shard {shard} ran out of rows at {event}, it "
+                            "holds fewer rows than its plan has fights"
+                        )
+                    target.write(last_row + "\n")
+            target.flush()
+            os.fsync(target.fileno())
+
+        if any(next(rows, None) is not None for rows in shard_rows):
+            os.remove(tmp_path)
+            raise ValueError(
+                "The fight shards hold more rows than their plan has fights"
+            )
+        os.replace(tmp_path, TOTAL_EVENT_AND_FIGHTS.as_posix())
+        print(f"Merged {shard_count} shards into {TOTAL_EVENT_AND_FIGHTS}")
+
+        fight_scraper = FightDataScraper(engine=self.engine, store=self.store)
+        fight_scraper._queue_failed_fights(queued_fights, failed_urls)
+        fight_scraper._queue_failed_events(queued_events, failed_urls)
+        if listed_events:
+            self.store.save_event_fight_links(listed_events)
+        fight_scraper._save_raw_fight_dataset()
+        fight_scraper._update_fighter_dimension()
+
+    def _merge_fighters(self, plan: Dict, failed_urls: FailedUrlQueue) -> None:
+        fighter_name_and_details = {}
+        failed_fighters = []
+        for shard in range(plan["shard_count"]):
+            with open(
+                self._shard_path("fighters", shard, ".json").as_posix(), "r"
+            ) as f:
+                summary = json.load(f)
+            fighter_name_and_details.update(summary["fighters"])
+            failed_fighters.extend(summary["failed_fighters"])
+
+        links = [link for link in plan["fighters"] if link in fighter_name_and_details]
+        fighter_details_df = pd.DataFrame(
+            [
+                [fighter_name_and_details[link][0], *fighter_name_and_details[link][1]]
+                for link in links
+            ],
+            index=pd.Index([ufcstats_id(link) for link in links], name="ufcstats_id"),
+            columns=["fighter_name", *FighterRecord._fields],
+        )
+        tmp_path = FIGHTER_DETAILS.with_suffix(".tmp")
+        fighter_details_df.to_csv(tmp_path, index_label="ufcstats_id")
+        os.replace(tmp_path, FIGHTER_DETAILS)
+        print(f'Merged {plan["shard_count"]} shards into {FIGHTER_DETAILS}')
+
+        for entry in failed_fighters:
+            failed_urls.add("fighter", entry["url"], entry["error"], name=entry["name"])
+        failed_urls.save()
+        if failed_fighters:
+            print(
+                f"{len(failed_fighters)} fighters could not be scraped, they are "
+                "retried on the next run."
+            )
+
+
+def _write_json(filepath: Path, data) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=filepath.parent.as_posix(), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, filepath.as_posix())
@@ -0,0 +1,183 @@
+import random
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+# Status codes worth asking again for, anything else is handed back to the caller as is.
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+THROTTLE_STATUS_CODES = {429, 503}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose refill rate follows the host's health.
+    The rate creeps up additively while responses come back fast and is cut in half when
+    the host throttles us or fails, so the scrapers settle just below the rate the host
+    tolerates. A Retry-After from the host pauses the bucket for that long.
+    """
+
+    def __init__(
+        self,
+        rate: float = 8.0,
+        min_rate: float = 0.5,
+        max_rate: float = 32.0,
+        burst: float = 4.0,
+        target_latency: float = 1.0,
+    ):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.target_latency = target_latency
+        self._tokens = burst
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._last_refill) * self.rate
+                )
+                self._last_refill = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def on_success(self, latency: float) -> None:
+        with self._lock:
+            if latency <= self.target_latency:
+                self.rate = min(self.max_rate, self.rate + 0.5)
+            else:
+                # Slow answers are the first sign of an overloaded host
+                self.rate = max(self.min_rate, self.rate * 0.9)
+
+    def on_failure(self, retry_after: Optional[float] = None) -> None:
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * 0.5)
+            if retry_after:
+                self._paused_until = max(
+                    self._paused_until, time.monotonic() + retry_after
+                )
+
+
+class CircuitBreaker:
+    """
+    Stops requests to a host that keeps failing.
+    After `failure_threshold` failures in a row the circuit opens and callers wait for
+    `reset_timeout` seconds, then a single probe request is let through. A failed probe
+    opens the circuit again for twice as long. Callers that would wait past
+    `give_up_after` seconds get a CircuitOpenError instead, so a dead host fails the
+    remaining pages rather than hanging the run.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 15.0,
+        max_reset_timeout: float = 120.0,
+        give_up_after: float = 300.0,
+    ):
+        self.failure_threshold = failure_threshold
+        self.initial_reset_timeout = reset_timeout
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.give_up_after = give_up_after
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._first_opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_request(self) -> None:
+        while True:
+            with self._lock:
+                if self._opened_at is None:
+                    return
+                now = time.monotonic()
+                if now - self._first_opened_at >= self.give_up_after:
+                    raise CircuitOpenError(
+                        f"host kept failing for {self.give_up_after:.0f} seconds"
+                    )
+                if not self._probing and now >= self._opened_at + self.reset_timeout:
+                    self._probing = True
+                    return
+                wait = max(self._opened_at + self.reset_timeout - now, 0.5)
+            time.sleep(wait)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._first_opened_at = None
+            self._probing = False
+            self.reset_timeout = self.initial_reset_timeout
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            now = time.monotonic()
+            if self._probing:
+                self._probing = False
+                self._opened_at = now
+                self.reset_timeout = min(self.max_reset_timeout, self.reset_timeout * 2)
+            elif self._opened_at is None and self._failures >= self.failure_threshold:
+                self._opened_at = now
+                self._first_opened_at = now
+                print(
+                    f"\n{self._failures} requests in a row failed, "
+                    f"pausing for {self.reset_timeout:.0f} seconds"
+                )
+
+
+class HostThrottle:
+    """
+    Rate limiter, circuit breaker and retry schedule shared by every request to a host.
+    """
+
+    def __init__(
+        self, max_retries: int = 4, backoff_base: float = 0.5, backoff_cap: float = 30.0
+    ):
+        self.limiter = AdaptiveRateLimiter()
+        self.breaker = CircuitBreaker()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+    def backoff(self, attempt: int) -> float:
+        # Full jitter, so that workers failing together do not retry together
+        return random.uniform(
+            0, min(self.backoff_cap, self.backoff_base * 2 ** attempt)
+        )
+
+
+_host_throttles: Dict[str, HostThrottle] = {}
+_host_throttles_lock = threading.Lock()
+
+
+def get_host_throttle(url: str) -> HostThrottle:
+    host = urlsplit(url).netloc
+    with _host_throttles_lock:
+        if host not in _host_throttles:
+            _host_throttles[host] = HostThrottle()
+        return _host_throttles[host]
+
+
+def get_retry_after(headers) -> Optional[float]:
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        # An http date, not worth parsing for the few seconds it usually asks for
+        return None
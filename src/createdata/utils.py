@@ -1,13 +1,186 @@
 import sys
+import threading
+import time
+from typing import Callable, Optional
 
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 
+from src.createdata.http_cache import CacheMissError, ResponseCache
+from src.createdata.metrics import get_metrics
+from src.createdata.page_regions import HTML_PARSER, get_page_region
+from src.createdata.throttle import (
+    RETRY_STATUS_CODES,
+    THROTTLE_STATUS_CODES,
+    get_host_throttle,
+    get_retry_after,
+)
 
-def make_soup(url: str) -> BeautifulSoup:
-    source_code = requests.get(url, allow_redirects=False)
-    plain_text = source_code.text.encode("ascii", "replace")
-    return BeautifulSoup(plain_text, "html.parser")
+# Number of threads the scrapers use per executor. The connection pool is sized to
+# match so that every worker can hold a keep-alive connection to ufcstats.com. How fast
+# requests are actually sent is up to the host's rate limiter, see throttle.py.
+MAX_WORKERS = 16
+# (connect, read) timeouts in seconds, a stalled connection is retried like any failure
+REQUEST_TIMEOUT = (10, 30)
+# The progress bar is redrawn at most this often, and once it is complete
+PROGRESS_INTERVAL = 0.5
+
+_session = None
+_session_pool_maxsize = 0
+_session_lock = threading.Lock()
+
+_response_cache: Optional[ResponseCache] = ResponseCache()
+
+# Called with (url, page_type, fetch seconds, parse seconds) for every page made into
+# soup
+_page_observer: Optional[Callable[[str, Optional[str], float, float], None]] = None
+
+_last_progress_write = 0.0
+
+
+def get_session(pool_maxsize: int = MAX_WORKERS) -> requests.Session:
+    """
+    Returns the process wide HTTP session, creating it on first use.
+    Connections are kept alive and pooled per host, so repeated requests to
+    ufcstats.com reuse sockets instead of opening a new one for every page.
+    The pool is grown if a caller needs more concurrent connections than it holds.
+    """
+    global _session, _session_pool_maxsize
+    if _session is None or _session_pool_maxsize < pool_maxsize:
+        with _session_lock:
+            if _session is None:
+                _session = requests.Session()
+                _session.headers.update(
+                    {"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+                )
+            if _session_pool_maxsize < pool_maxsize:
+                adapter = HTTPAdapter(
+                    pool_connections=4, pool_maxsize=pool_maxsize, pool_block=True
+                )
+                _session.mount("http://", adapter)
+                _session.mount("https://", adapter)
+                _session_pool_maxsize = pool_maxsize
+    return _session
+
+
+def set_response_cache(cache: Optional[ResponseCache]) -> None:
+    """
+    Replaces the cache consulted by fetch_page. Pass None to always go to the network.
+    """
+    global _response_cache
+    _response_cache = cache
+
+
+class FetchError(Exception):
+    pass
+
+
+def download_page(url: str) -> requests.Response:
+    """
+    Gets `url` through the host's rate limiter and circuit breaker. Connection errors,
+    timeouts and 429/5xx answers are retried with jittered exponential backoff, and
+    FetchError is raised once the retries are used up.
+    """
+    metrics = get_metrics()
+    throttle = get_host_throttle(url)
+    for attempt in range(throttle.max_retries + 1):
+        throttle.breaker.before_request()
+        throttle.limiter.acquire()
+        start = time.monotonic()
+        retry_after = None
+        try:
+            response = get_session().get(
+                url, allow_redirects=False, timeout=REQUEST_TIMEOUT
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            reason = f"{type(e).__name__}: {e}"
+            metrics.increment("ufc_http_requests_total", status=type(e).__name__)
+        else:
+            seconds = time.monotonic() - start
+            metrics.increment("ufc_http_requests_total", status=response.status_code)
+            metrics.increment("ufc_http_response_bytes_total", len(response.content))
+            metrics.observe("ufc_http_request_seconds", seconds)
+            if response.status_code not in RETRY_STATUS_CODES:
+                throttle.limiter.on_success(seconds)
+                throttle.breaker.record_success()
+                return response
+            reason = f"HTTP {response.status_code}"
+            if response.status_code in THROTTLE_STATUS_CODES:
+                retry_after = get_retry_after(response.headers)
+
+        throttle.limiter.on_failure(retry_after)
+        throttle.breaker.record_failure()
+        if attempt < throttle.max_retries:
+            metrics.increment("ufc_http_retries_total")
+            time.sleep(retry_after or throttle.backoff(attempt))
+
+    metrics.increment("ufc_http_failures_total")
+    raise FetchError(
+        f"{url} failed after {throttle.max_retries + 1} attempts, {reason}"
+    )
+
+
+def fetch_page(url: str, refresh: bool = False) -> str:
+    """
+    Returns the page at `url` from the response cache or the network. `refresh` skips
+    the cached copy and downloads the page again, unless the cache is offline.
+    """
+    cache = _response_cache
+    if cache is not None and (cache.offline or not refresh):
+        text = cache.get(url)
+        get_metrics().increment(
+            "ufc_cache_lookups_total", result="miss" if text is None else "hit"
+        )
+        if text is not None:
+            return text
+        if cache.offline:
+            raise CacheMissError(f"{url} is not in the response cache")
+
+    source_code = download_page(url)
+    if cache is not None and source_code.status_code == 200:
+        cache.put(url, source_code.text)
+    return source_code.text
+
+
+def set_page_observer(
+    observer: Optional[Callable[[str, Optional[str], float, float], None]]
+) -> None:
+    global _page_observer
+    _page_observer = observer
+
+
+def notify_page_observer(
+    url: str, page_type: Optional[str], fetch_seconds: float, parse_seconds: float
+) -> None:
+    metrics = get_metrics()
+    metrics.increment("ufc_pages_total", page_type=page_type)
+    metrics.observe("ufc_page_fetch_seconds", fetch_seconds, page_type=page_type)
+    metrics.observe("ufc_page_parse_seconds", parse_seconds, page_type=page_type)
+    if _page_observer is not None:
+        _page_observer(url, page_type, fetch_seconds, parse_seconds)
+
+
+def parse_page(text: str, page_type: Optional[str] = None) -> BeautifulSoup:
+    """
+    Parses a fetched page. When `page_type` names one of the PAGE_REGIONS, only the
+    parts of the page the scrapers read for that kind of page are parsed.
+    """
+    # Non ascii characters are replaced with "?" as they always have been, the text is
+    # handed over as str so that BeautifulSoup skips encoding detection.
+    plain_text = text.encode("ascii", "replace").decode("ascii")
+    return BeautifulSoup(plain_text, HTML_PARSER, parse_only=get_page_region(page_type))
+
+
+def make_soup(
+    url: str, page_type: Optional[str] = None, refresh: bool = False
+) -> BeautifulSoup:
+    start = time.perf_counter()
+    text = fetch_page(url, refresh=refresh)
+    fetched = time.perf_counter()
+    soup = parse_page(text, page_type)
+    notify_page_observer(url, page_type, fetched - start, time.perf_counter() - fetched)
+    return soup
 
 
 def print_progress(
@@ -28,6 +201,17 @@ def print_progress(
         decimals    - Optional  : positive number of decimals in percent complete (Int)
         bar_length  - Optional  : character length of bar (Int)
     """
+    # Writing the bar on every completed page would flush stdout hundreds of times a
+    # second
+    global _last_progress_write
+    if total == 0:
+        # Nothing to show until the work is known
+        return
+    now = time.monotonic()
+    if 0 < iteration < total and now - _last_progress_write < PROGRESS_INTERVAL:
+        return
+    _last_progress_write = now
+
     percents = f"{100 * (iteration / float(total)):.2f}"
     filled_length = int(round(bar_length * iteration / float(total)))
     bar = f'{"█" * filled_length}{"-" * (bar_length - filled_length)}'
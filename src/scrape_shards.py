@@ -0,0 +1,108 @@
+import argparse
+import subprocess
+import sys
+
+from src.createdata.http_cache import ResponseCache
+from src.createdata.scrape_engine import PARSE_PROCESSES, ScrapeEngine
+from src.createdata.scrape_store import STORES
+from src.createdata.shards import ShardedScrape
+from src.createdata.utils import MAX_WORKERS, set_response_cache
+
+STAGES = ["fights", "fighters"]
+
+
+def run_shard_processes(args) -> None:
+    # Every shard is a process of its own, with its own connection pool and rate limiter
+    commands = [
+        [
+            sys.executable,
+            "-m",
+            "src.scrape_shards",
+            "work",
+            "--shard",
+            str(shard),
+            "--workers",
+            str(args.workers),
+            "--parse-processes",
+            str(args.parse_processes),
+            "--store",
+            args.store,
+            *(["--no-cache"] if args.no_cache else []),
+        ]
+        for shard in range(args.shards)
+    ]
+    processes = [subprocess.Popen(command) for command in commands]
+    failed = [shard for shard, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        sys.exit(
+            f"Shards {failed} failed, run them again with `work --shard` and merge."
+        )
+
+
+# The parse processes import this module, only a direct run may scrape.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rebuild the raw ufcstats data in shards that run in parallel "
+        "processes, on one machine or several sharing the data folder."
+    )
+    parser.add_argument(
+        "command",
+        choices=["plan", "work", "merge", "run"],
+        help="plan the shards, work on one shard, merge the finished shards, or run "
+        "all of them on this machine.",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=4,
+        help="Number of shards to plan, with plan and run.",
+    )
+    parser.add_argument("--shard", type=int, help="Shard to work on, with work.")
+    parser.add_argument(
+        "--stages", nargs="+", choices=STAGES, default=STAGES, help="Stages to work on."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=MAX_WORKERS, help="Concurrency of every shard."
+    )
+    parser.add_argument(
+        "--parse-processes",
+        type=int,
+        default=PARSE_PROCESSES,
+        help="Parse processes of every shard, 1 parses in the fetching threads.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always download pages instead of consulting the response cache.",
+    )
+    parser.add_argument(
+        "--store",
+        choices=STORES,
+        default="files",
+        help="Where the scrapers keep the events and fighters they know of.",
+    )
+    args = parser.parse_args()
+    if args.command == "work" and args.shard is None:
+        parser.error("work needs --shard")
+
+    set_response_cache(None if args.no_cache else ResponseCache())
+    engine = ScrapeEngine(
+        max_concurrency=args.workers, parse_processes=args.parse_processes
+    )
+    store = STORES[args.store]()
+    sharded_scrape = ShardedScrape(engine=engine, store=store)
+    try:
+        if args.command in ("plan", "run"):
+            sharded_scrape.plan(args.shards)
+        if args.command == "work":
+            if "fights" in args.stages:
+                sharded_scrape.scrape_fights(args.shard)
+            if "fighters" in args.stages:
+                sharded_scrape.scrape_fighters(args.shard)
+        if args.command == "run":
+            run_shard_processes(args)
+        if args.command in ("merge", "run"):
+            sharded_scrape.merge()
+    finally:
+        engine.close()
+        store.close()
@@ -0,0 +1,223 @@
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.benchmark.fixture_server import FixtureServer
+from src.createdata import http_cache, throttle, utils
+from src.createdata.http_cache import ResponseCache
+from src.createdata.preprocess_fighter_data import NUMERICAL_COLUMNS
+from src.createdata.scrape_engine import ScrapeBudget, ScrapeEngine
+from src.createdata.scrape_fight_data import FightDataScraper
+from src.createdata.scrape_store import FileScrapeStore
+from src.createdata.throttle import CircuitBreaker, HostThrottle
+
+# A small ufcstats.com in its own markup: three events, nine fights, the fighters in
+# them and the listings, keyed by url in urls.json
+FIXTURES_DIR = Path(__file__).parent / "fixtures" / "ufcstats"
+
+
+@pytest.fixture(scope="session")
+def recorded_pages() -> Dict[str, str]:
+    with open((FIXTURES_DIR / "urls.json").as_posix(), "r") as f:
+        urls = json.load(f)
+    return {
+        url: (FIXTURES_DIR / name).read_text(encoding="utf-8")
+        for url, name in urls.items()
+    }
+
+
+@pytest.fixture(scope="session")
+def recorded_cache(recorded_pages, tmp_path_factory) -> Path:
+    """The recorded pages as a response cache directory, what FixtureServer serves."""
+    cache_dir = tmp_path_factory.mktemp("http_cache")
+    cache = ResponseCache(cache_dir)
+    for url, text in recorded_pages.items():
+        cache.put(url, text)
+    return cache_dir
+
+
+@pytest.fixture(scope="session")
+def fixture_server(recorded_cache):
+    with FixtureServer(recorded_cache) as server:
+        yield server
+
+
+class FakeClock:
+    """Stands in for the time module, sleeping only moves the clock forward."""
+
+    def __init__(self, now: float = 1_700_000_000.0):
+        self.now = now
+        self.sleeps: List[float] = []
+
+    def time(self) -> float:
+        return self.now
+
+    monotonic = perf_counter = time
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def fake_clock(monkeypatch) -> FakeClock:
+    """The clock of the throttle, the page downloads and the response cache."""
+    clock = FakeClock()
+    for module in (http_cache, throttle, utils):
+        monkeypatch.setattr(module, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def scrape_from(monkeypatch):
+    """
+    Sends the scrapers of this process to a FixtureServer, without the response cache.
+    Pages are tried once and the circuit never opens, so failures cost no time.
+    """
+    monkeypatch.setattr(utils, "_response_cache", None)
+    host_throttle = HostThrottle(max_retries=0)
+    host_throttle.breaker = CircuitBreaker(failure_threshold=1000)
+    monkeypatch.setattr(utils, "get_host_throttle", lambda url: host_throttle)
+    for name in ("NO_PROXY", "no_proxy"):
+        monkeypatch.delenv(name, raising=False)
+
+    def use(server: FixtureServer) -> None:
+        for name in ("HTTP_PROXY", "http_proxy"):
+            monkeypatch.setenv(name, server.url)
+
+    return use
+
+
+def file_store_in(data_dir: Path) -> FileScrapeStore:
+    store = FileScrapeStore()
+    for name, path in vars(store).items():
+        setattr(store, name, data_dir / path.name)
+    return store
+
+
+@pytest.fixture
+def file_store(tmp_path) -> FileScrapeStore:
+    """A FileScrapeStore keeping its pickles in a temporary folder."""
+    return file_store_in(tmp_path)
+
+
+@pytest.fixture
+def make_fight_scraper(scrape_from):
+    """
+    Builds a FightDataScraper that scrapes from `server` into the files of `data_dir`,
+    like a run of create_ufc_data with UFC_DATA_DIR pointed at it.
+    """
+
+    engines = []
+
+    def make(
+        server: FixtureServer, data_dir: Path, max_requests: Optional[int] = None
+    ) -> FightDataScraper:
+        scrape_from(server)
+        data_dir.mkdir(exist_ok=True)
+        engine = ScrapeEngine(
+            max_concurrency=4,
+            parse_processes=1,
+            budget=ScrapeBudget(max_requests=max_requests),
+        )
+        engines.append(engine)
+        scraper = FightDataScraper(engine=engine, store=file_store_in(data_dir))
+        for name, path in list(vars(scraper).items()):
+            if name.endswith("_PATH"):
+                setattr(scraper, name, data_dir / path.name)
+        return scraper
+
+    yield make
+    for engine in engines:
+        engine.close()
+
+
+WIN_METHODS = [
+    "Decision - Majority",
+    "Decision - Split",
+    "Decision - Unanimous",
+    "KO/TKO",
+    "Submission",
+    "TKO - Doctor's Stoppage",
+]
+
+
+@pytest.fixture(scope="session")
+def make_fights():
+    """
+    Builds the `count` oldest of 1500 synthetic fights as preprocessing hands them to
+    FighterDetailProcessor, newest first, with the details of their fighters. Later
+    fights bring in new fighters, and draws, title bouts, missing rounds and missing
+    fight times are among them.
+    """
+    rng = np.random.RandomState(7)
+    total = 1500
+    # Fighters come in over time and some win far more often than others
+    newest_fighter = np.minimum(20 + np.arange(total) // 8, 200)
+    skill = rng.uniform(0, 1, 201)
+    red = np.array([rng.randint(0, newest) for newest in newest_fighter])
+    blue = np.array([rng.randint(0, newest - 1) for newest in newest_fighter])
+    blue[blue >= red] += 1
+    red_won = rng.uniform(0, 1, total) < 0.5 + skill[red] - skill[blue]
+    draw = rng.uniform(0, 1, total) < 0.04
+    # Two fighters share a name, as on ufcstats
+    names = np.array([f"Fighter {fighter}" for fighter in range(201)], dtype=object)
+    names[17] = names[3]
+
+    history = pd.DataFrame(
+        {
+            "R_fighter": names[red],
+            "B_fighter": names[blue],
+            "R_fighter_id": red,
+            "B_fighter_id": blue,
+        }
+    )
+    for column in NUMERICAL_COLUMNS:
+        for corner, opp_corner in (("R_", "B_"), ("B_", "R_")):
+            name = column.replace("hero_", corner).replace("opp_", opp_corner)
+            if name in history or column == "total_time_fought(seconds)":
+                continue
+            if column.endswith("_pct"):
+                history[name] = rng.randint(0, 101, total) / 100
+            else:
+                history[name] = rng.randint(0, 60, total)
+    history["win_by"] = [
+        WIN_METHODS[i] if i < len(WIN_METHODS) else rng.choice(WIN_METHODS)
+        for i in range(total)
+    ]
+    last_round = rng.randint(1, 6, total).astype(float)
+    last_round[rng.uniform(0, 1, total) < 0.03] = np.nan
+    history["last_round"] = last_round
+    history["Winner"] = np.where(
+        draw, "Draw", np.where(red_won, history["R_fighter"], history["B_fighter"])
+    )
+    history["title_bout"] = rng.uniform(0, 1, total) < 0.1
+    history["date"] = (
+        pd.Timestamp("2001-01-01") + pd.to_timedelta(np.arange(total) * 5, unit="D")
+    ).strftime("%Y-%m-%d")
+    total_time = (last_round - 1) * 300 + rng.randint(1, 301, total)
+    # Fights of an unknown format have no total time
+    total_time[rng.uniform(0, 1, total) < 0.05] = np.nan
+    history["total_time_fought(seconds)"] = total_time
+
+    fighter_details = pd.DataFrame(
+        {
+            "Height_cms": rng.uniform(150, 200, 201).round(2),
+            "Weight_lbs": rng.choice([125.0, 155.0, 185.0, 205.0], 201),
+            "Reach_cms": rng.uniform(150, 210, 201).round(2),
+            "Stance": rng.choice(["Orthodox", "Southpaw", None], 201),
+            "DOB": pd.Timestamp("1980-01-01")
+            + pd.to_timedelta(rng.randint(0, 7000, 201), unit="D"),
+        },
+        index=pd.Index(np.arange(201), name="fighter_id"),
+    )
+
+    def make(count):
+        fights = history.iloc[:count].iloc[::-1].reset_index(drop=True)
+        return fights, fighter_details.copy()
+
+    return make
@@ -0,0 +1,111 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+import requests
+
+from src.benchmark.fixture_server import FixtureServer
+from src.benchmark.run_benchmark import compare_results
+
+EVENTS_URL = "http://ufcstats.com/statistics/events/completed?page=all"
+
+
+def get(server, url, **kwargs):
+    return requests.get(url, proxies={"http": server.url}, timeout=5, **kwargs)
+
+
+def test_fixture_server_answers_from_the_recorded_pages(fixture_server, recorded_pages):
+    response = get(fixture_server, EVENTS_URL, headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response.headers
+    assert response.content.decode("utf-8") == recorded_pages[EVENTS_URL]
+
+    response = get(fixture_server, EVENTS_URL, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.content.decode("utf-8") == recorded_pages[EVENTS_URL]
+
+    missing = get(fixture_server, "http://ufcstats.com/event-details/0000000000000000")
+    assert missing.status_code == 404
+
+
+def test_fixture_server_failures(recorded_cache):
+    with FixtureServer(recorded_cache, fail_pattern="/event-details/") as server:
+        assert get(server, EVENTS_URL).status_code == 200
+        failing = get(server, "http://ufcstats.com/event-details/22b0e91b59581ac8")
+        assert failing.status_code == 500
+    with FixtureServer(recorded_cache, error_rate=1.0) as server:
+        assert get(server, EVENTS_URL).status_code == 503
+        assert server.requests == 1
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    path = tmp_path / "baseline.json"
+    with open(path, "w") as f:
+        json.dump(
+            [
+                {"stage": "links", "pages_per_second": 100.0},
+                {"stage": "fights", "pages_per_second": 50.0},
+            ],
+            f,
+        )
+    return path
+
+
+def test_compare_results(baseline, capsys):
+    results = [
+        {"stage": "links", "pages_per_second": 91.0},
+        {"stage": "fights", "pages_per_second": 80.0},
+        # Stages the baseline does not have are not compared
+        {"stage": "fighters", "pages_per_second": 1.0},
+    ]
+    assert compare_results(results, baseline, tolerance=0.1)
+    assert capsys.readouterr().out == ""
+
+    results[1]["pages_per_second"] = 44.0
+    assert not compare_results(results, baseline, tolerance=0.1)
+    assert capsys.readouterr().out == (
+        "fights: 44.0 pages/s, the baseline has 50.0 pages/s\n"
+    )
+    assert compare_results(results, baseline, tolerance=0.2)
+
+
+def test_benchmark_saves_and_compares(recorded_cache, tmp_path):
+    def run_benchmark(*args):
+        env = dict(os.environ)
+        env.pop("NO_PROXY", None)
+        env.pop("no_proxy", None)
+        return subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "src.benchmark.run_benchmark",
+                "--fixtures",
+                str(recorded_cache),
+                "--stages",
+                "links",
+                "--parse-processes",
+                "1",
+                *args,
+            ],
+            env=env,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        )
+
+    results_path = tmp_path / "results.json"
+    assert run_benchmark("--save", str(results_path)).returncode == 0
+    with open(results_path, "r") as f:
+        (result,) = json.load(f)
+    # The event listing and the three events
+    assert result["stage"] == "links"
+    assert result["pages"] == 4
+
+    result["pages_per_second"] *= 1000
+    with open(results_path, "w") as f:
+        json.dump([result], f)
+    slower = run_benchmark("--compare", str(results_path))
+    assert slower.returncode == 1
+    assert "links: " in slower.stdout
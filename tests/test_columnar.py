@@ -0,0 +1,57 @@
+import pandas as pd
+
+from src.createdata.columnar import PartitionedDataset
+
+HEADER = "R_fighter;B_fighter;CTRL_seconds;date\n"
+
+
+def write_rows(csv_path, rows):
+    csv_path.write_text(HEADER + "".join(";".join(row) + "\n" for row in rows))
+
+
+def part_files(dataset_path):
+    # Files are replaced when they are written, which gives them a new inode
+    return {
+        path.parent.name: path.stat().st_ino
+        for path in dataset_path.glob("*/part.parquet")
+    }
+
+
+def test_csv_files_are_saved_by_the_years_that_changed(tmp_path):
+    csv_path = tmp_path / "raw_total_fight_data.csv"
+    dataset = PartitionedDataset(tmp_path / "raw_total_fight_data")
+    rows = [
+        ["Ana", "Bea", "75", "2024-04-13"],
+        ["Cat", "Dee", "", "2024-02-10"],
+        ["Ana", "Cat", "130", "2023-11-18"],
+        ["Bea", "Dee", "12", "2023-06-03"],
+    ]
+    write_rows(csv_path, rows)
+    assert sorted(dataset.save_csv(csv_path, "date", sep=";")) == ["2023", "2024"]
+    assert dataset.save_csv(csv_path, "date", sep=";") == []
+
+    # New fights on top only write their year
+    files = part_files(dataset.path)
+    rows.insert(0, ["Dee", "Ana", "41", "2024-06-29"])
+    write_rows(csv_path, rows)
+    assert dataset.save_csv(csv_path, "date", sep=";") == ["2024"]
+    assert part_files(dataset.path)["year=2023"] == files["year=2023"]
+    # Years are parsed on their own, reading them gives the dtypes of the whole file
+    pd.testing.assert_frame_equal(dataset.read(), pd.read_csv(csv_path, sep=";"))
+
+    # A fight scraped into its place further down, and a year that is gone
+    rows.insert(4, ["Cat", "Bea", "300", "2023-09-02"])
+    write_rows(csv_path, rows)
+    assert dataset.save_csv(csv_path, "date", sep=";") == ["2023"]
+    write_rows(csv_path, rows[:3])
+    assert dataset.save_csv(csv_path, "date", sep=";") == []
+    assert dataset.partitions() == ["2024"]
+    pd.testing.assert_frame_equal(dataset.read(), pd.read_csv(csv_path, sep=";"))
+
+    # Without any rows the columns are kept
+    write_rows(csv_path, [])
+    dataset.save_csv(csv_path, "date", sep=";")
+    assert dataset.read().columns.tolist() == HEADER.strip().split(";")
+    write_rows(csv_path, rows)
+    assert sorted(dataset.save_csv(csv_path, "date", sep=";")) == ["2023", "2024"]
+    assert dataset.partitions() == ["2024", "2023"]
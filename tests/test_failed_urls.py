@@ -0,0 +1,227 @@
+import json
+
+import pytest
+
+from src.benchmark.fixture_server import FixtureServer
+from src.createdata.failed_urls import MAX_RUNS, FailedUrlQueue
+from src.createdata.row_writer import RowWriter, insert_rows, read_last_row
+from src.createdata.run_journal import RunJournal
+
+EVENTS = ["b345174a81c34a70", "22b0e91b59581ac8", "add4f0b2201d3441"]
+# The fights of the first two events, in the order of their event pages
+FIRST_EVENT_FIGHTS = ["a01862d0e88b2a74", "1c86df0dcfc3a95d", "0734242a9d117e2c"]
+SECOND_EVENT_FIGHTS = ["38ac1c386e870a83", "6bddbd0c3d653420", "aae37b3d31571314"]
+
+
+@pytest.fixture
+def clean_fight_data(make_fight_scraper, fixture_server, tmp_path):
+    scraper = make_fight_scraper(fixture_server, tmp_path / "clean")
+    scraper.create_fight_data_csv()
+    return scraper.TOTAL_EVENT_AND_FIGHTS_PATH.read_text()
+
+
+def scrape(make_fight_scraper, recorded_cache, data_dir, fail_pattern=None):
+    with FixtureServer(recorded_cache, fail_pattern=fail_pattern) as server:
+        scraper = make_fight_scraper(server, data_dir)
+        scraper.create_fight_data_csv()
+    return scraper
+
+
+@pytest.mark.parametrize("event", EVENTS)
+def test_failed_event_is_retried_into_place(
+    make_fight_scraper, recorded_cache, clean_fight_data, tmp_path, event
+):
+    data_dir = tmp_path / "failing"
+    scraper = scrape(make_fight_scraper, recorded_cache, data_dir, fail_pattern=event)
+    [entry] = FailedUrlQueue(scraper.FAILED_URLS_PATH).entries("event")
+    assert entry["url"].endswith(event)
+    assert entry["runs"] == 1
+    assert len(scraper.TOTAL_EVENT_AND_FIGHTS_PATH.read_text().splitlines()) == 7
+
+    scraper = scrape(make_fight_scraper, recorded_cache, data_dir)
+    assert scraper.TOTAL_EVENT_AND_FIGHTS_PATH.read_text() == clean_fight_data
+    assert not scraper.FAILED_URLS_PATH.exists()
+    # The fights listed when the event was retried are known like any others
+    fight_links = scraper.store.event_fight_links([entry["url"]])
+    assert len(fight_links[entry["url"]]) == 3
+
+
+@pytest.mark.parametrize(
+    "failing, failing_again",
+    [
+        # Fights sharing the slot after the first event's rows
+        (SECOND_EVENT_FIGHTS[:2], SECOND_EVENT_FIGHTS[1]),
+        (SECOND_EVENT_FIGHTS[:2], SECOND_EVENT_FIGHTS[0]),
+        # Fights sharing the slot at the top of the file
+        (FIRST_EVENT_FIGHTS[:2], FIRST_EVENT_FIGHTS[1]),
+        (FIRST_EVENT_FIGHTS[:2], FIRST_EVENT_FIGHTS[0]),
+    ],
+)
+def test_failed_fights_are_retried_into_place(
+    make_fight_scraper,
+    recorded_cache,
+    clean_fight_data,
+    tmp_path,
+    failing,
+    failing_again,
+):
+    data_dir = tmp_path / "failing"
+    scraper = scrape(
+        make_fight_scraper, recorded_cache, data_dir, fail_pattern="|".join(failing)
+    )
+    queued = FailedUrlQueue(scraper.FAILED_URLS_PATH).entries("fight")
+    assert len(queued) == 2
+    # Both fights go between the same rows
+    assert len({(entry["after_row"], entry["before_row"]) for entry in queued}) == 1
+
+    # A fight that fails again is anchored to the row of the fight retried next to it
+    scraper = scrape(
+        make_fight_scraper, recorded_cache, data_dir, fail_pattern=failing_again
+    )
+    [entry] = FailedUrlQueue(scraper.FAILED_URLS_PATH).entries("fight")
+    assert entry["runs"] == 2
+    rows = scraper.TOTAL_EVENT_AND_FIGHTS_PATH.read_text().splitlines()
+    assert len(rows) == 9
+    assert entry["after_row"] in rows or entry["before_row"] in rows
+
+    scraper = scrape(make_fight_scraper, recorded_cache, data_dir)
+    assert scraper.TOTAL_EVENT_AND_FIGHTS_PATH.read_text() == clean_fight_data
+    assert not scraper.FAILED_URLS_PATH.exists()
+
+
+def test_fight_that_keeps_failing_is_given_up_on(
+    make_fight_scraper, recorded_cache, tmp_path, capsys
+):
+    data_dir = tmp_path / "failing"
+    for runs in range(1, MAX_RUNS):
+        scraper = scrape(
+            make_fight_scraper, recorded_cache, data_dir, SECOND_EVENT_FIGHTS[0]
+        )
+        [entry] = FailedUrlQueue(scraper.FAILED_URLS_PATH).entries("fight")
+        assert entry["runs"] == runs
+
+    scrape(make_fight_scraper, recorded_cache, data_dir, SECOND_EVENT_FIGHTS[0])
+    assert (
+        f"Giving up on {entry['url']} after {MAX_RUNS} runs" in capsys.readouterr().out
+    )
+    assert not scraper.FAILED_URLS_PATH.exists()
+
+
+def test_failed_url_queue(tmp_path):
+    filepath = tmp_path / "failed_urls.json"
+    failed_urls = FailedUrlQueue(filepath)
+    failed_urls.add(
+        "fight", "fight-1", "HTTPError: 500", after_row="a", before_row=None
+    )
+    failed_urls.add("event", "event-1", "HTTPError: 500", fights=None)
+    failed_urls.save()
+
+    failed_urls = FailedUrlQueue(filepath)
+    failed_urls.add("fight", "fight-1", "Timeout", after_row="b", before_row=None)
+    failed_urls.update("event-1", after_row="c")
+    [fight] = failed_urls.entries("fight")
+    assert fight == {
+        "kind": "fight",
+        "url": "fight-1",
+        "error": "Timeout",
+        "runs": 2,
+        "after_row": "b",
+        "before_row": None,
+    }
+    assert failed_urls.entries("event")[0]["after_row"] == "c"
+
+    # The last run it is allowed drops it from the queue
+    failed_urls.add("fight", "fight-1", "Timeout")
+    assert failed_urls.entries("fight") == []
+    failed_urls.discard("event-1")
+    failed_urls.discard("never-queued")
+    failed_urls.save()
+    assert not filepath.exists()
+
+
+HEADER = "a;b\n"
+
+
+def write_file(filepath, rows):
+    filepath.write_text(HEADER + "".join(row + "\n" for row in rows))
+
+
+def test_insert_rows(tmp_path):
+    filepath = tmp_path / "rows.csv"
+    write_file(filepath, ["1", "2", "3"])
+    inserted = insert_rows(
+        filepath,
+        [
+            {"row": "2a", "after_row": "2", "before_row": None},
+            {"row": "2b", "after_row": "2", "before_row": None},
+            {"row": "0", "after_row": None, "before_row": "1"},
+            {"row": "4", "after_row": "gone", "before_row": None},
+            {"row": "3", "after_row": "1", "before_row": None},
+        ],
+    )
+    assert inserted == 4
+    assert filepath.read_text() == HEADER + "0\n1\n2\n2a\n2b\n3\n4\n"
+
+    # Repeating an insert that already happened changes nothing
+    assert insert_rows(filepath, [{"row": "2a", "after_row": "1"}]) == 0
+    assert filepath.read_text() == HEADER + "0\n1\n2\n2a\n2b\n3\n4\n"
+
+
+def test_row_writer_resumes_from_the_committed_rows(tmp_path):
+    filepath = tmp_path / "rows.csv"
+    journal = RunJournal(tmp_path / "journal.jsonl")
+    writer = RowWriter(
+        filepath, HEADER, sync_every_rows=2, sync_every_seconds=3600, journal=journal
+    )
+    with writer:
+        writer.write_rows(["1"], entries=[{"kind": "fight", "url": "fight-1"}])
+        assert journal.entries == []
+        writer.write_rows(["2"], entries=[{"kind": "fight", "url": "fight-2"}])
+        # Rows and entries are committed together
+        assert journal.completed("fight") == {"fight-1", "fight-2"}
+        assert journal.last("offset")["offset"] == len(HEADER + "1\n2\n")
+        writer.write_rows(["3"])
+    assert journal.last("offset")["offset"] == len(HEADER + "1\n2\n3\n")
+    journal.close()
+
+    # A crash after rows were written but before they were synced leaves extra rows
+    with open(filepath.as_posix(), "a") as f:
+        f.write("4\n5")
+    journal = RunJournal(tmp_path / "journal.jsonl")
+    writer = RowWriter(filepath, HEADER, journal=journal, resume=True)
+    with writer:
+        assert writer.last_row == "3"
+        writer.write_rows(["4"])
+    assert filepath.read_text() == HEADER + "1\n2\n3\n4\n"
+    assert read_last_row(filepath) == "4"
+
+    # Without the journal the file is started over
+    with RowWriter(filepath, HEADER, resume=True) as writer:
+        assert writer.last_row is None
+    assert filepath.read_text() == HEADER
+
+
+def test_run_journal_drops_a_torn_last_line(tmp_path):
+    filepath = tmp_path / "journal.jsonl"
+    journal = RunJournal(filepath)
+    assert not journal.exists()
+    journal.record(
+        [
+            {"kind": "event", "url": "event-1"},
+            {"kind": "merge", "url": "new.csv", "after_row": "1"},
+        ],
+        sync=True,
+    )
+    journal.close()
+    with open(filepath.as_posix(), "a") as f:
+        f.write(json.dumps({"kind": "event", "url": "event-2"})[:12])
+
+    journal = RunJournal(filepath)
+    assert journal.exists()
+    assert journal.completed("event") == {"event-1"}
+    assert journal.last("merge", url="new.csv")["after_row"] == "1"
+    assert journal.last("merge", url="other.csv") is None
+    journal.record([{"kind": "event", "url": "event-3"}])
+    journal.clear()
+    assert not filepath.exists()
+    assert not RunJournal(filepath).exists()
@@ -0,0 +1,74 @@
+import pandas as pd
+
+from src.createdata.columnar import PartitionedDataset
+from src.createdata.fighter_dimension import FighterDimension
+
+
+def fights_of(*fighters):
+    """Fights, newest first, between (ufcstats id, name) pairs."""
+    red, blue = fighters[::2], fighters[1::2]
+    return pd.DataFrame(
+        {
+            "R_fighter": [name for _, name in red],
+            "B_fighter": [name for _, name in blue],
+            "R_ufcstats_id": [fighter_id for fighter_id, _ in red],
+            "B_ufcstats_id": [fighter_id for fighter_id, _ in blue],
+        }
+    )
+
+
+def test_fighters_keep_their_codes_and_take_their_newest_name(tmp_path):
+    filepath = tmp_path / "fighter_dimension.csv"
+    dimension = FighterDimension(filepath)
+    fights = fights_of(
+        ("a1", "Ana Sousa"),
+        ("b2", "Mei Lin"),
+        ("c3", "Jon Park"),
+        ("a1", "Ana Souza"),
+        (None, "Old Timer"),
+        ("b2", "Mei Lin"),
+    )
+    assert dimension.add_fights(fights) == 4
+    dimension.save()
+    assert FighterDimension(filepath).to_frame().values.tolist() == [
+        [0, "a1", "Ana Sousa"],
+        [1, "c3", "Jon Park"],
+        [2, None, "Old Timer"],
+        [3, "b2", "Mei Lin"],
+    ]
+
+    # Nothing changed, nothing to save
+    dimension = FighterDimension(filepath)
+    assert dimension.add_fights(fights) == 0
+
+    # A new fight under a new name renames the fighter, and is worth saving
+    renamed = pd.concat(
+        [fights_of(("c3", "Jonathan Park"), ("d4", "Ben Cole")), fights]
+    )
+    assert dimension.add_fights(renamed.reset_index(drop=True)) == 2
+    assert dimension.names[1] == "Jonathan Park"
+    codes = dimension.codes_of(
+        pd.Series(["c3", None, "d4"]), pd.Series(["Jonathan Park", "Old Timer", "Ben"])
+    )
+    assert codes.tolist() == [1, 2, 4]
+
+
+def test_renamed_fighter_is_saved(make_fight_scraper, fixture_server, tmp_path):
+    scraper = make_fight_scraper(fixture_server, tmp_path / "data")
+    dataset = PartitionedDataset(scraper.RAW_FIGHTS_DATASET_PATH)
+    dataset.save(fights_of(("a1", "Ana Souza"), ("b2", "Mei Lin")))
+    scraper._update_fighter_dimension()
+
+    dataset.save(
+        fights_of(
+            ("a1", "Ana Sousa"),
+            ("b2", "Mei Lin"),
+            ("a1", "Ana Souza"),
+            ("b2", "Mei Lin"),
+        )
+    )
+    scraper._update_fighter_dimension()
+    assert FighterDimension(scraper.FIGHTER_DIMENSION_PATH).names == {
+        0: "Ana Sousa",
+        1: "Mei Lin",
+    }
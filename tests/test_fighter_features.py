@@ -0,0 +1,102 @@
+import pandas as pd
+import pytest
+
+from src.createdata.fighter_features import STATE_PARTITION_SIZE, FighterFeatureStore
+from src.createdata.preprocess_fighter_data import FighterDetailProcessor
+
+
+def fighter_frame(fights, fighter_details, feature_store=None):
+    return FighterDetailProcessor(
+        fights.copy(), fighter_details.copy(), feature_store=feature_store
+    ).frame
+
+
+def stored_files(dataset_path):
+    # Files are replaced when they are written, which gives them a new inode
+    return {
+        path.parent.name: path.stat().st_ino
+        for path in dataset_path.glob("*/part.parquet")
+    }
+
+
+@pytest.fixture
+def store_paths(tmp_path):
+    return {
+        "features_path": tmp_path / "fighter_features",
+        "state_path": tmp_path / "fighter_state",
+    }
+
+
+def test_incremental_features_match_a_full_computation(
+    make_fights, store_paths, capsys
+):
+    store = FighterFeatureStore(**store_paths)
+    computed = None
+    for count in [1000, 1200, 1201, 1500]:
+        fights, fighter_details = make_fights(count)
+        state_files = stored_files(store_paths["state_path"])
+        frame = fighter_frame(fights, fighter_details, store)
+        pd.testing.assert_frame_equal(frame, fighter_frame(fights, fighter_details))
+
+        if computed is None:
+            message = f"Computing the fighter features of all {count} fights"
+        else:
+            message = f"Computed the fighter features of {count - computed} new fights"
+        assert message in capsys.readouterr().out
+        if count == 1201:
+            # Only the state of the two fighters of the new fight was written again
+            written = {
+                name
+                for name, inode in stored_files(store_paths["state_path"]).items()
+                if state_files.get(name) != inode
+            }
+            fighters = fights.loc[0, ["R_fighter_id", "B_fighter_id"]]
+            assert written == {
+                f"fighters={fighter // STATE_PARTITION_SIZE}" for fighter in fighters
+            }
+        computed = count
+
+    # The newer fights brought in fighters the first state had no row for
+    first_fights, _ = make_fights(1000)
+    assert fights["R_fighter_id"].max() > first_fights["R_fighter_id"].max()
+
+    rebuilt = fighter_frame(
+        fights, fighter_details, FighterFeatureStore(rebuild=True, **store_paths)
+    )
+    pd.testing.assert_frame_equal(rebuilt, frame)
+    output = capsys.readouterr().out
+    assert "The stored fighter features are identical to the full computation" in output
+
+
+def scraped_into_its_place(fights):
+    # The earlier run was without a fight that failed further down
+    return fights.drop(600)
+
+
+def changed_in_the_newest_year(fights):
+    # The earlier run had another winner for a fight of the newest year it saw
+    fights = fights.copy()
+    assert fights.loc[201, "Winner"] != fights.loc[201, "R_fighter"]
+    fights.loc[201, "Winner"] = fights.loc[201, "R_fighter"]
+    return fights
+
+
+@pytest.mark.parametrize(
+    "earlier", [scraped_into_its_place, changed_in_the_newest_year]
+)
+def test_changed_older_fights_are_computed_again(
+    make_fights, store_paths, capsys, earlier
+):
+    fights, fighter_details = make_fights(1200)
+    fighter_frame(
+        earlier(fights).iloc[200:].reset_index(drop=True),
+        fighter_details,
+        FighterFeatureStore(**store_paths),
+    )
+    capsys.readouterr()
+
+    frame = fighter_frame(fights, fighter_details, FighterFeatureStore(**store_paths))
+    pd.testing.assert_frame_equal(frame, fighter_frame(fights, fighter_details))
+    assert (
+        "Computing the fighter features of all 1200 fights" in capsys.readouterr().out
+    )
@@ -0,0 +1,62 @@
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from src.createdata.scrape_fight_data import FightDataScraper
+from src.createdata.scrape_fight_links import UFCLinks
+from src.createdata.scrape_fighter_details import FighterDetailsScraper
+from src.createdata.utils import parse_page
+
+# What the extractors made of the recorded pages when they were checked by hand.
+# UPDATE_GOLDEN=1 writes them again after a deliberate change to the extractors.
+GOLDEN_DIR = Path(__file__).parent / "fixtures" / "golden"
+EVENT_INFO = "April 13, 2024;Miami"
+
+
+def event_outputs(url, text):
+    soup = parse_page(text, "event")
+    (_, fights), _ = UFCLinks._parse_event(soup, url)
+    return {"event_info": FightDataScraper._get_event_info(soup), "fights": fights}
+
+
+def fight_outputs(url, text):
+    soup = parse_page(text, "fight")
+    return {
+        "fight_stats": FightDataScraper._get_fight_stats(soup),
+        "fight_details": FightDataScraper._get_fight_details(soup),
+        "fight_result_data": FightDataScraper._get_fight_result_data(soup),
+        "fighter_links": FightDataScraper._get_fighter_links(soup),
+        "record": FightDataScraper._get_fight_stats_task(soup, EVENT_INFO)._asdict(),
+    }
+
+
+def fighter_outputs(url, text):
+    soup = parse_page(text, "fighter")
+    (_, _, data, _), _ = FighterDetailsScraper._get_fighter_data_task(soup, "", url)
+    return {"fighter_data": data}
+
+
+@pytest.mark.parametrize(
+    "kind, outputs_of",
+    [("event", event_outputs), ("fight", fight_outputs), ("fighter", fighter_outputs)],
+)
+def test_extractors_match_the_golden_outputs(recorded_pages, kind, outputs_of):
+    outputs = {
+        url: outputs_of(url, text)
+        for url, text in sorted(recorded_pages.items())
+        if f"/{kind}-details/" in url
+    }
+    # Through JSON, like the golden file, so tuples compare equal to lists
+    outputs = json.loads(json.dumps(outputs))
+    golden_path = GOLDEN_DIR / f"{kind}_pages.json"
+    if os.environ.get("UPDATE_GOLDEN"):
+        GOLDEN_DIR.mkdir(exist_ok=True)
+        golden_path.write_text(json.dumps(outputs, indent=1, ensure_ascii=False) + "\n")
+
+    with open(golden_path.as_posix(), "r", encoding="utf-8") as f:
+        golden = json.load(f)
+    assert sorted(outputs) == sorted(golden)
+    for url in golden:
+        assert outputs[url] == golden[url], url
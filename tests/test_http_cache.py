@@ -0,0 +1,107 @@
+import pytest
+
+from src.createdata import utils
+from src.createdata.http_cache import DAY, HOUR, CacheMissError, ResponseCache
+from src.createdata.utils import fetch_page
+
+EVENTS_URL = "http://ufcstats.com/statistics/events/completed?page=all"
+EVENT_URL = "http://ufcstats.com/event-details/22b0e91b59581ac8"
+FIGHT_URL = "http://ufcstats.com/fight-details/38ac1c386e870a83"
+FIGHTER_URL = "http://ufcstats.com/fighter-details/01248e04cb8a3bcb"
+
+
+def stored_files(cache_dir, kind):
+    return sorted((cache_dir / kind).rglob("*.*"))
+
+
+@pytest.mark.parametrize(
+    "url, ttl",
+    [
+        (EVENTS_URL, 12 * HOUR),
+        ("http://ufcstats.com/statistics/fighters?char=a&page=all", DAY),
+        (EVENT_URL, DAY),
+        (FIGHTER_URL, 7 * DAY),
+        ("http://ufcstats.com/some-other-page", DAY),
+    ],
+)
+def test_pages_expire_after_their_ttl(tmp_path, fake_clock, url, ttl):
+    cache = ResponseCache(tmp_path)
+    cache.put(url, "page")
+    fake_clock.sleep(ttl)
+    assert cache.get(url) == "page"
+    fake_clock.sleep(1)
+    assert cache.get(url) is None
+    # Offline, whatever is cached is used
+    assert ResponseCache(tmp_path, offline=True).get(url) == "page"
+
+
+def test_finished_fights_never_expire(recorded_pages, tmp_path, fake_clock):
+    cache = ResponseCache(tmp_path)
+    cache.put(FIGHT_URL, recorded_pages[FIGHT_URL])
+    # A fight that has not taken place has no stats table yet
+    upcoming_url = "http://ufcstats.com/fight-details/0000000000000000"
+    cache.put(upcoming_url, "<html><body>Upcoming</body></html>")
+    fake_clock.sleep(1000 * DAY)
+    assert cache.get(FIGHT_URL) == recorded_pages[FIGHT_URL]
+    assert cache.get(upcoming_url) is None
+
+
+def test_bodies_are_stored_once_by_content(recorded_pages, tmp_path, fake_clock):
+    cache = ResponseCache(tmp_path)
+    cache.put(EVENT_URL, recorded_pages[EVENT_URL])
+    cache.put(EVENT_URL + "?again", recorded_pages[EVENT_URL])
+    assert len(stored_files(tmp_path, "urls")) == 2
+    assert len(stored_files(tmp_path, "objects")) == 1
+
+    # A changed page gets a new body, the old one is left for the urls that use it
+    cache.put(EVENT_URL, "changed")
+    assert len(stored_files(tmp_path, "objects")) == 2
+    assert cache.get(EVENT_URL) == "changed"
+    assert cache.get(EVENT_URL + "?again") == recorded_pages[EVENT_URL]
+    # An entry whose body went missing is a miss
+    for object_path in stored_files(tmp_path, "objects"):
+        object_path.unlink()
+    assert cache.get(EVENT_URL) is None
+
+
+def test_recorded_cache_serves_every_page(recorded_pages, recorded_cache, fake_clock):
+    cache = ResponseCache(recorded_cache, offline=True)
+    fake_clock.sleep(1000 * DAY)
+    for url, text in recorded_pages.items():
+        assert cache.get(url) == text
+
+
+def test_fetch_page_uses_the_cache(
+    recorded_pages, fixture_server, scrape_from, monkeypatch, tmp_path, fake_clock
+):
+    scrape_from(fixture_server)
+    cache = ResponseCache(tmp_path)
+    monkeypatch.setattr(utils, "_response_cache", cache)
+    cache.put(EVENT_URL, "cached")
+    requests = fixture_server.requests
+    assert fetch_page(EVENT_URL) == "cached"
+    assert fixture_server.requests == requests
+
+    # Expired and refreshed pages are downloaded and cached again
+    fake_clock.sleep(DAY + 1)
+    assert fetch_page(EVENT_URL) == recorded_pages[EVENT_URL]
+    assert fixture_server.requests == requests + 1
+    assert cache.get(EVENT_URL) == recorded_pages[EVENT_URL]
+    cache.put(EVENT_URL, "cached")
+    assert fetch_page(EVENT_URL, refresh=True) == recorded_pages[EVENT_URL]
+    assert fixture_server.requests == requests + 2
+
+
+def test_offline_fetch_never_goes_to_the_network(
+    fixture_server, scrape_from, monkeypatch, tmp_path, fake_clock
+):
+    scrape_from(fixture_server)
+    cache = ResponseCache(tmp_path, offline=True)
+    monkeypatch.setattr(utils, "_response_cache", cache)
+    cache.put(EVENT_URL, "cached")
+    fake_clock.sleep(1000 * DAY)
+    requests = fixture_server.requests
+    assert fetch_page(EVENT_URL, refresh=True) == "cached"
+    with pytest.raises(CacheMissError, match=FIGHTER_URL):
+        fetch_page(FIGHTER_URL)
+    assert fixture_server.requests == requests
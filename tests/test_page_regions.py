@@ -0,0 +1,112 @@
+from types import SimpleNamespace
+
+import pytest
+from bs4 import BeautifulSoup
+
+from src.createdata import scrape_fight_links, scrape_fighter_details, utils
+from src.createdata.scrape_fight_data import FightDataScraper
+from src.createdata.scrape_fight_links import UFCLinks
+from src.createdata.scrape_fighter_details import FighterDetailsScraper
+
+EVENTS_URL = "http://ufcstats.com/statistics/events/completed?page=all"
+
+
+def parse_whole_page(text, page_type=None):
+    # How every page was parsed before the page regions
+    return BeautifulSoup(text.encode("ascii", "replace"), "html.parser")
+
+
+@pytest.fixture(params=["lxml", "html.parser"])
+def parse_region(request, monkeypatch):
+    monkeypatch.setattr(utils, "HTML_PARSER", request.param)
+    return utils.parse_page
+
+
+def pages_of(recorded_pages, kind):
+    pages = {url: text for url, text in recorded_pages.items() if kind in url}
+    assert pages
+    return pages
+
+
+def test_fight_pages(recorded_pages, parse_region):
+    extractors = [
+        FightDataScraper._get_fight_stats,
+        FightDataScraper._get_fight_details,
+        FightDataScraper._get_fight_result_data,
+        FightDataScraper._get_fighter_links,
+    ]
+    for text in pages_of(recorded_pages, "/fight-details/").values():
+        whole, region = parse_whole_page(text), parse_region(text, "fight")
+        for extractor in extractors:
+            assert extractor(region) == extractor(whole)
+        record = FightDataScraper._get_fight_stats_task(region, "April 13, 2024;Miami")
+        assert record == FightDataScraper._get_fight_stats_task(
+            whole, "April 13, 2024;Miami"
+        )
+
+
+def test_event_pages(recorded_pages, parse_region):
+    for url, text in pages_of(recorded_pages, "/event-details/").items():
+        whole, region = parse_whole_page(text), parse_region(text, "event")
+        assert FightDataScraper._get_event_info(region) == (
+            FightDataScraper._get_event_info(whole)
+        )
+        (link, fights), _ = UFCLinks._parse_event(region, url)
+        assert len(fights) == 3
+        assert UFCLinks._parse_event(whole, url) == ((link, fights), [])
+
+
+def test_fighter_pages(recorded_pages, parse_region):
+    for url, text in pages_of(recorded_pages, "/fighter-details/").items():
+        whole, region = parse_whole_page(text), parse_region(text, "fighter")
+        assert FighterDetailsScraper._get_fighter_data_task(region, "name", url) == (
+            FighterDetailsScraper._get_fighter_data_task(whole, "name", url)
+        )
+
+
+def test_listings(recorded_pages, parse_region, monkeypatch):
+    fighter_listing_urls = sorted(pages_of(recorded_pages, "/statistics/fighters?"))
+    scraper = SimpleNamespace(fighter_group_urls=fighter_listing_urls)
+
+    def scrape_listings(parse):
+        def make_soup(url, page_type=None, refresh=False):
+            return parse(recorded_pages[url], page_type)
+
+        monkeypatch.setattr(scrape_fight_links, "make_soup", make_soup)
+        monkeypatch.setattr(scrape_fighter_details, "make_soup", make_soup)
+        return (
+            UFCLinks._get_event_links(EVENTS_URL),
+            FighterDetailsScraper._get_fighter_link_and_name(scraper),
+        )
+
+    event_links, fighter_links = scrape_listings(parse_region)
+    assert len(event_links) == 3
+    assert len(fighter_links) == 16
+    assert (event_links, fighter_links) == scrape_listings(parse_whole_page)
+
+
+def test_recorded_edge_cases(recorded_pages, parse_region):
+    fighter_data = [
+        FighterDetailsScraper._get_fighter_data_task(
+            parse_region(text, "fighter"), "name", url
+        )[0][2]
+        for url, text in pages_of(recorded_pages, "/fighter-details/").items()
+    ]
+    # The profile without career statistics is left out
+    assert sum(data is None for data in fighter_data) == 1
+
+    fight_soups = [
+        parse_region(text, "fight")
+        for text in pages_of(recorded_pages, "/fight-details/").values()
+    ]
+    names = {
+        name
+        for soup in fight_soups
+        for name in FightDataScraper._get_fighter_links(soup).values()
+    }
+    assert "Ji?? Nov?k" in names
+    winners = [
+        FightDataScraper._get_fight_result_data(soup)["Winner"] for soup in fight_soups
+    ]
+    # Nobody wins a draw
+    assert winners.count("") == 1
@@ -0,0 +1,144 @@
+import threading
+
+import pytest
+
+from src.createdata.pipeline import Pipeline, Stage
+
+
+class Stages:
+    """Stub stages that copy their input files to their outputs, noting every run."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.runs = []
+        self._lock = threading.Lock()
+
+    def path(self, name):
+        return self.folder / name
+
+    def stage(self, name, inputs=(), outputs=(), fail=False, **kwargs):
+        inputs = tuple(self.path(filename) for filename in inputs)
+        outputs = tuple(self.path(filename) for filename in outputs)
+
+        def run():
+            with self._lock:
+                self.runs.append(name)
+            if fail:
+                raise RuntimeError(f"{name} failed")
+            text = "".join(path.read_text() for path in inputs if path.exists())
+            for path in outputs:
+                path.write_text(text or name)
+
+        return Stage(name, run, inputs=inputs, outputs=outputs, **kwargs)
+
+
+@pytest.fixture
+def stages(tmp_path):
+    stages = Stages(tmp_path)
+    stages.path("raw.csv").write_text("raw")
+    return stages
+
+
+def make_pipeline(stages, options=None, fail=()):
+    # Listed out of order, the order comes from the files they share
+    return Pipeline(
+        [
+            stages.stage(
+                "report",
+                inputs=("features.csv", "fighters.csv"),
+                outputs=("report.csv",),
+                options=options,
+                fail="report" in fail,
+            ),
+            stages.stage("scrape", outputs=("fighters.csv",), external=True),
+            stages.stage(
+                "features",
+                inputs=("clean.csv",),
+                outputs=("features.csv",),
+                fail="features" in fail,
+            ),
+            stages.stage("clean", inputs=("raw.csv",), outputs=("clean.csv",)),
+        ],
+        subgraphs={"process": ["clean", "features", "report"]},
+        state_path=stages.path("pipeline_state.json"),
+    )
+
+
+def test_stages_run_after_the_stages_they_read_from(stages):
+    make_pipeline(stages).run()
+    runs = stages.runs
+    assert sorted(runs) == ["clean", "features", "report", "scrape"]
+    assert runs.index("clean") < runs.index("features") < runs.index("report")
+    assert runs.index("scrape") < runs.index("report")
+    assert stages.path("report.csv").read_text() == "rawscrape"
+
+
+def test_unchanged_stages_are_skipped(stages):
+    make_pipeline(stages).run()
+    stages.runs.clear()
+    make_pipeline(stages).run()
+    # External stages always run, their outputs are the same so the rest is skipped
+    assert stages.runs == ["scrape"]
+
+    # A stage runs when its output is no longer what it wrote
+    stages.path("features.csv").write_text("edited")
+    stages.runs.clear()
+    make_pipeline(stages).run()
+    assert sorted(stages.runs) == ["features", "scrape"]
+
+    # New input runs the stage and the stages reading its output
+    stages.path("raw.csv").write_text("new raw")
+    stages.runs.clear()
+    make_pipeline(stages).run()
+    assert sorted(stages.runs) == ["clean", "features", "report", "scrape"]
+
+
+def test_changed_options_run_the_stage_again(stages):
+    make_pipeline(stages, options={"export_csv": True}).run()
+    stages.runs.clear()
+    make_pipeline(stages, options={"export_csv": True}).run()
+    assert stages.runs == ["scrape"]
+    stages.runs.clear()
+    make_pipeline(stages, options={"export_csv": False}).run()
+    assert sorted(stages.runs) == ["report", "scrape"]
+
+
+def test_force_runs_every_stage(stages):
+    make_pipeline(stages).run()
+    stages.runs.clear()
+    make_pipeline(stages).run(force=True)
+    assert sorted(stages.runs) == ["clean", "features", "report", "scrape"]
+
+
+def test_subgraphs_and_single_stages(stages):
+    pipeline = make_pipeline(stages)
+    assert pipeline.targets() == [
+        "all",
+        "process",
+        "report",
+        "scrape",
+        "features",
+        "clean",
+    ]
+
+    # Outputs of stages outside of the subgraph are taken as they are on disk
+    pipeline.run("process")
+    assert stages.runs == ["clean", "features", "report"]
+    assert stages.path("report.csv").read_text() == "raw"
+    stages.runs.clear()
+    pipeline.run("scrape")
+    assert stages.runs == ["scrape"]
+
+    with pytest.raises(ValueError, match="Unknown pipeline stages"):
+        pipeline.run("fighters")
+
+
+def test_failed_stage_stops_the_stages_after_it(stages):
+    with pytest.raises(RuntimeError, match="features failed"):
+        make_pipeline(stages, fail=("features",)).run()
+    assert "report" not in stages.runs
+
+    # The stages that finished are not run again
+    stages.runs.clear()
+    make_pipeline(stages).run()
+    assert sorted(stages.runs) == ["features", "report", "scrape"]
@@ -0,0 +1,370 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.createdata.fighter_features import FighterFeatureStore
+from src.createdata.metrics import get_metrics
+from src.createdata.preprocess import Preprocessor
+
+
+class RowWisePreprocessor(Preprocessor):
+    """The steps of Preprocessor as they were done row by row with apply."""
+
+    def _create_title_bout_feature(self):
+        self.fights["title_bout"] = self.fights["Fight_type"].apply(
+            lambda X: True if "Title Bout" in X else False
+        )
+
+    def _create_weight_classes(self):
+        def make_weight_class(X):
+            weight_classes = [
+                "Women's Strawweight",
+                "Women's Bantamweight",
+                "Women's Featherweight",
+                "Women's Flyweight",
+                "Lightweight",
+                "Welterweight",
+                "Middleweight",
+                "Light Heavyweight",
+                "Heavyweight",
+                "Featherweight",
+                "Bantamweight",
+                "Flyweight",
+                "Open Weight",
+            ]
+
+            for weight_class in weight_classes:
+                if weight_class in X:
+                    return weight_class
+
+            if X in ("Catch Weight Bout", "Catchweight Bout"):
+                return "Catch Weight"
+            else:
+                return "Open Weight"
+
+        self.fights["weight_class"] = self.fights["Fight_type"].apply(make_weight_class)
+
+        renamed_weight_classes = {
+            "Flyweight": "Flyweight",
+            "Bantamweight": "Bantamweight",
+            "Featherweight": "Featherweight",
+            "Lightweight": "Lightweight",
+            "Welterweight": "Welterweight",
+            "Middleweight": "Middleweight",
+            "Light Heavyweight": "LightHeavyweight",
+            "Heavyweight": "Heavyweight",
+            "Women's Strawweight": "WomenStrawweight",
+            "Women's Flyweight": "WomenFlyweight",
+            "Women's Bantamweight": "WomenBantamweight",
+            "Women's Featherweight": "WomenFeatherweight",
+            "Catch Weight": "CatchWeight",
+            "Open Weight": "OpenWeight",
+        }
+
+        self.fights["weight_class"] = self.fights["weight_class"].apply(
+            lambda weight: renamed_weight_classes[weight]
+        )
+
+    def _get_total_time_fought(self):
+        time_in_first_round = {
+            "3 Rnd (5-5-5)": 5 * 60,
+            "5 Rnd (5-5-5-5-5)": 5 * 60,
+            "1 Rnd + OT (12-3)": 12 * 60,
+            "No Time Limit": 1,
+            "3 Rnd + OT (5-5-5-5)": 5 * 60,
+            "1 Rnd (20)": 1 * 20,
+            "2 Rnd (5-5)": 5 * 60,
+            "1 Rnd (15)": 15 * 60,
+            "1 Rnd (10)": 10 * 60,
+            "1 Rnd (12)": 12 * 60,
+            "1 Rnd + OT (30-5)": 30 * 60,
+            "1 Rnd (18)": 18 * 60,
+            "1 Rnd + OT (15-3)": 15 * 60,
+            "1 Rnd (30)": 30 * 60,
+            "1 Rnd + OT (31-5)": 31 * 5,
+            "1 Rnd + OT (27-3)": 27 * 60,
+            "1 Rnd + OT (30-3)": 30 * 60,
+        }
+
+        exception_format_time = {
+            "1 Rnd + 2OT (15-3-3)": [15 * 60, 3 * 60],
+            "1 Rnd + 2OT (24-3-3)": [24 * 60, 3 * 60],
+        }
+
+        def get_total_time(row):
+            if row["Format"] in time_in_first_round.keys():
+                return (row["last_round"] - 1) * time_in_first_round[
+                    row["Format"]
+                ] + row["last_round_time_seconds"]
+
+            elif row["Format"] in exception_format_time.keys():
+
+                if (row["last_round"] - 1) >= 2:
+                    return (
+                        exception_format_time[row["Format"]][0]
+                        + (row["last_round"] - 2)
+                        * exception_format_time[row["Format"]][1]
+                        + row["last_round_time_seconds"]
+                    )
+                else:
+                    return (row["last_round"] - 1) * exception_format_time[
+                        row["Format"]
+                    ][0] + row["last_round_time_seconds"]
+
+        self.fights["total_time_fought(seconds)"] = self.fights.apply(
+            get_total_time, axis=1
+        )
+        self.fights.drop(
+            ["Format", "Fight_type", "last_round_time_seconds"], axis=1, inplace=True
+        )
+
+    def _create_winner_feature(self):
+        def get_renamed_winner(row):
+            if row["R_fighter"] == row["Winner"]:
+                return "Red"
+
+            elif row["B_fighter"] == row["Winner"]:
+                return "Blue"
+
+            elif row["Winner"] == "Draw":
+                return "Draw"
+
+        self.store["Winner"] = self.store[["R_fighter", "B_fighter", "Winner"]].apply(
+            get_renamed_winner, axis=1
+        )
+
+    def _create_fighter_age(self):
+        self.store["R_DOB"] = pd.to_datetime(self.store["R_DOB"])
+        self.store["B_DOB"] = pd.to_datetime(self.store["B_DOB"])
+        self.store["date"] = pd.to_datetime(self.store["date"])
+
+        def get_age(row):
+            B_age = (row["date"] - row["B_DOB"]).days
+            R_age = (row["date"] - row["R_DOB"]).days
+
+            if np.isnan(B_age) != True:
+                B_age = math.floor(B_age / 365.25)
+
+            if np.isnan(R_age) != True:
+                R_age = math.floor(R_age / 365.25)
+
+            return pd.Series([B_age, R_age], index=["B_age", "R_age"])
+
+        self.store[["B_age", "R_age"]] = self.store[["date", "R_DOB", "B_DOB"]].apply(
+            get_age, axis=1
+        )
+        self.store.drop(["R_DOB", "B_DOB"], axis=1, inplace=True)
+
+
+def run_step(step, frame, attribute="fights"):
+    # The step of both preprocessors on copies of the same frame
+    results = []
+    for preprocessor_type in (Preprocessor, RowWisePreprocessor):
+        preprocessor = preprocessor_type(export_csv=False)
+        setattr(preprocessor, attribute, frame.copy())
+        getattr(preprocessor, step)()
+        results.append(getattr(preprocessor, attribute))
+    return results
+
+
+FIGHT_TYPES = [
+    "UFC Light Heavyweight Title Bout",
+    "Women's Strawweight Bout",
+    "UFC Women's Bantamweight Title Bout",
+    "Women's Featherweight Bout",
+    "Women's Flyweight Bout",
+    "Lightweight Bout",
+    "Welterweight Bout",
+    "Middleweight Bout",
+    "Heavyweight Bout",
+    "Featherweight Bout",
+    "Bantamweight Bout",
+    "Flyweight Bout",
+    "Open Weight Bout",
+    "Catch Weight Bout",
+    "Catchweight Bout",
+    "UFC Superfight Championship",
+    "Ultimate Fighter 28 Heavyweight Tournament Title Bout",
+    "Lightweight Bout",
+]
+
+
+@pytest.mark.parametrize(
+    "step", ["_create_title_bout_feature", "_create_weight_classes"]
+)
+def test_fight_type_steps(step):
+    fights = pd.DataFrame({"Fight_type": FIGHT_TYPES, "R_KD": range(len(FIGHT_TYPES))})
+    vectorized, row_wise = run_step(step, fights)
+    pd.testing.assert_frame_equal(vectorized, row_wise)
+
+
+def test_only_catch_weight_bouts_are_catch_weight():
+    fights = pd.DataFrame({"Fight_type": FIGHT_TYPES, "R_KD": range(len(FIGHT_TYPES))})
+    weight_classes = dict(
+        zip(FIGHT_TYPES, run_step("_create_weight_classes", fights)[0]["weight_class"])
+    )
+    assert weight_classes["Catch Weight Bout"] == "CatchWeight"
+    assert weight_classes["Catchweight Bout"] == "CatchWeight"
+    assert weight_classes["UFC Superfight Championship"] == "OpenWeight"
+
+
+REGULAR_TIMES = [
+    ("3 Rnd (5-5-5)", 3, 300),
+    ("5 Rnd (5-5-5-5-5)", 2, 14),
+    ("No Time Limit", 1, 700),
+    ("1 Rnd + OT (31-5)", 2, 40),
+    ("1 Rnd (20)", 1, 20),
+    # The first round only, the second round and the overtime of uneven formats
+    ("1 Rnd + 2OT (15-3-3)", 1, 120),
+    ("1 Rnd + 2OT (15-3-3)", 2, 180),
+    ("1 Rnd + 2OT (24-3-3)", 3, 65),
+]
+
+
+def time_frame(rows, dtype=None):
+    formats, last_rounds, times = zip(*rows)
+    return pd.DataFrame(
+        {
+            "Fight_type": "Lightweight Bout",
+            "Format": formats,
+            "last_round": last_rounds,
+            "last_round_time_seconds": pd.Series(times, dtype=dtype),
+            "R_KD": 0,
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    "fights",
+    [
+        time_frame(REGULAR_TIMES),
+        time_frame([*REGULAR_TIMES, ("1 Rnd + 3OT (5-3-3-3)", 3, 100)]),
+        time_frame([*REGULAR_TIMES, ("3 Rnd (5-5-5)", 2, None)], dtype=float),
+        time_frame(REGULAR_TIMES, dtype=float),
+    ],
+    ids=["known formats", "unknown format", "missing time", "float times"],
+)
+def test_total_time_fought(fights):
+    vectorized, row_wise = run_step("_get_total_time_fought", fights)
+    pd.testing.assert_frame_equal(vectorized, row_wise)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_winner_feature(compact):
+    store = pd.DataFrame(
+        {
+            "R_fighter": ["Marcus Hale", "Carla Ruiz", "Jon Park", "Mei Lin"],
+            "B_fighter": ["Tomas Reyes", "Mei Lin", "Jon Park", "Ana Sousa"],
+            # A same name fight goes to red, and a winner nobody fought is no winner
+            "Winner": ["Tomas Reyes", "Draw", "Jon Park", "Dmitri Volkov"],
+        }
+    )
+    if compact:
+        names = pd.CategoricalDtype(sorted(set(store.values.ravel()) | {"Draw"}))
+        store = store.astype(names)
+    vectorized, row_wise = run_step("_create_winner_feature", store, "store")
+    pd.testing.assert_frame_equal(vectorized, row_wise)
+
+
+@pytest.mark.parametrize(
+    "r_dob, b_dob",
+    [
+        (
+            ["1987-07-22", "1992-02-29", "1990-03-27"],
+            ["1995-11-11", "1994-04-30", "1990-03-28"],
+        ),
+        (
+            ["1987-07-22", None, "1990-03-27"],
+            ["1995-11-11", "1994-04-30", "1990-03-28"],
+        ),
+        (
+            ["1987-07-22", "1991-02-28", "1990-03-27"],
+            [None, "1994-04-30", "1990-03-28"],
+        ),
+        ([None, "1991-02-28", "1990-03-27"], [None, "1994-04-30", None]),
+        ([None, None, None], ["1995-11-11", "1994-04-30", "1990-03-28"]),
+    ],
+    ids=["all known", "red missing", "blue missing", "both missing", "no red"],
+)
+def test_fighter_age(r_dob, b_dob):
+    store = pd.DataFrame(
+        {
+            "date": ["2024-04-13", "2024-02-28", "2020-03-27"],
+            "R_DOB": r_dob,
+            "B_DOB": b_dob,
+        }
+    )
+    vectorized, row_wise = run_step("_create_fighter_age", store, "store")
+    pd.testing.assert_frame_equal(vectorized, row_wise)
+
+
+class SyntheticPreprocessor(Preprocessor):
+    """Preprocesses the fights of make_fights, which come cleaned and coded."""
+
+    def __init__(self, fights, fighter_details, data_dir, **kwargs):
+        super().__init__(
+            feature_store=FighterFeatureStore(
+                features_path=data_dir / "fighter_features",
+                state_path=data_dir / "fighter_state",
+            ),
+            **kwargs,
+        )
+        for name in dir(self):
+            if name.endswith("_PATH"):
+                setattr(self, name, data_dir / name.lower()[: -len("_path")])
+        self.synthetic_fights = fights
+        self.synthetic_fighter_details = fighter_details
+
+    def _read_files(self):
+        return self.synthetic_fights, self.synthetic_fighter_details
+
+    def _skip(self):
+        pass
+
+    _code_fighters = _replacing_winner_nans_draw = _fill_missing_percentages = _skip
+    _create_title_bout_feature = _create_weight_classes = _skip
+    _fill_missing_CTRL_times = _get_total_time_fought = _skip
+
+
+@pytest.fixture
+def synthetic_fights(make_fights):
+    fights, fighter_details = make_fights(1500)
+    rng = np.random.RandomState(11)
+    fights["Referee"] = rng.choice(["Herb Dean", "Marc Goddard", None], len(fights))
+    fights["location"] = rng.choice(
+        ["Miami, Florida, USA", "Paris, France"], len(fights)
+    )
+    fights["weight_class"] = rng.choice(["Lightweight", "CatchWeight"], len(fights))
+    return fights, fighter_details
+
+
+def test_compact_mode_writes_the_same_files(synthetic_fights, tmp_path):
+    written = {}
+    for compact in (False, True):
+        data_dir = tmp_path / f"compact={compact}"
+        SyntheticPreprocessor(
+            *(frame.copy() for frame in synthetic_fights), data_dir, compact=compact
+        ).process_raw_data()
+        written[compact] = {
+            path.name: path.read_text() for path in data_dir.glob("*_data")
+        }
+    assert sorted(written[False]) == ["preprocessed_data", "ufc_data"]
+    assert written[True] == written[False]
+
+
+def test_memory_budget_is_counted(synthetic_fights, tmp_path, capsys):
+    def exceeded():
+        return sum(
+            counter["value"]
+            for counter in get_metrics().report()["counters"]
+            if counter["name"] == "ufc_memory_budget_exceeded_total"
+        )
+
+    before = exceeded()
+    SyntheticPreprocessor(
+        *synthetic_fights, tmp_path, memory_budget=2 ** 20
+    ).process_raw_data()
+    assert exceeded() == before + 1
+    assert "--compact keeps the tables smaller" in capsys.readouterr().out
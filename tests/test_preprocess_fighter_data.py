@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.createdata.preprocess_fighter_data import (
+    NUMERICAL_COLUMNS,
+    RESULT_STATS,
+    WIN_BY_COLUMNS,
+    FighterDetailProcessor,
+)
+
+
+class PerFighterProcessor(FighterDetailProcessor):
+    """
+    FighterDetailProcessor as it computed the features before the grouped passes, one
+    fighter and one fight at a time.
+    """
+
+    def _one_hot_encode_win(self):
+        self.fights = pd.concat(
+            [self.fights, pd.get_dummies(self.fights["win_by"], prefix="win_by")],
+            axis=1,
+        )
+        self.fights.drop(["win_by"], axis=1, inplace=True)
+
+    def _fighter_corner(self, fighter_id, hero, opp):
+        fights = self.fights[self.fights[hero + "fighter_id"] == fighter_id]
+        return fights.rename(
+            lambda column: self.lreplace(
+                opp, "opp_", self.lreplace(hero, "hero_", column)
+            ),
+            axis="columns",
+        )
+
+    def _calculate_fighter_data(self):
+        red_rows, blue_rows = [], []
+        fighters = set(self.fights["R_fighter_id"]) | set(self.fights["B_fighter_id"])
+        for fighter_id in sorted(fighters):
+            fighter_red = self._fighter_corner(fighter_id, "R_", "B_")
+            fighter_blue = self._fighter_corner(fighter_id, "B_", "R_")
+            fighter = pd.concat([fighter_red, fighter_blue]).sort_index()
+            fighter["Winner"] = np.where(
+                fighter["Winner"] == fighter["hero_fighter"], "hero", "opp"
+            )
+
+            for i, index in enumerate(fighter.index):
+                fighter_slice = fighter[(i + 1) :].sort_index(ascending=False)
+                s = (
+                    fighter_slice[NUMERICAL_COLUMNS]
+                    .ewm(span=3, adjust=False)
+                    .mean()
+                    .tail(1)
+                )
+                if len(s) == 0:
+                    s.loc[len(s)] = [np.NaN for _ in s.columns]
+                s["total_rounds_fought"] = fighter_slice["last_round"].sum()
+                s["total_title_bouts"] = fighter_slice[
+                    fighter_slice["title_bout"] == True
+                ]["title_bout"].count()
+                s["hero_fighter_id"] = fighter_id
+                results = self._get_result_stats(list(fighter_slice["Winner"]))
+                for result_stat, result in zip(RESULT_STATS, results):
+                    s[result_stat] = result
+                win_by_results = fighter_slice[fighter_slice["Winner"] == "hero"][
+                    WIN_BY_COLUMNS
+                ].sum()
+                # Counts, as pandas 1.0.3 gave them. Newer pandas sums no rows to 0.0
+                for win_by_column, win_by_result in zip(WIN_BY_COLUMNS, win_by_results):
+                    s[win_by_column] = int(win_by_result)
+
+                s.index = [index]
+                if index in fighter_red.index:
+                    red_rows.append(s)
+                else:
+                    blue_rows.append(s)
+
+        return (pd.concat(red_rows).sort_index(), pd.concat(blue_rows).sort_index())
+
+    @staticmethod
+    def _get_result_stats(result_list):
+        result_list.reverse()
+        current_win_streak = 0
+        current_lose_streak = 0
+        longest_win_streak = 0
+        wins = 0
+        losses = 0
+        draw = 0
+        for result in result_list:
+            if result == "hero":
+                wins += 1
+                current_win_streak += 1
+                current_lose_streak = 0
+                if longest_win_streak < current_win_streak:
+                    longest_win_streak += 1
+            elif result == "opp":
+                losses += 1
+                current_win_streak = 0
+                current_lose_streak += 1
+            elif result == "draw":
+                draw += 1
+                current_lose_streak = 0
+                current_win_streak = 0
+        return (
+            current_win_streak,
+            current_lose_streak,
+            longest_win_streak,
+            wins,
+            losses,
+            draw,
+        )
+
+
+@pytest.fixture(scope="module")
+def fights(make_fights):
+    fights, fighter_details = make_fights(300)
+    # Among them draws, title bouts, fights without a last round, fighters who fought
+    # in both corners and long streaks
+    assert (fights["Winner"] == "Draw").any()
+    assert fights["title_bout"].any()
+    assert fights["last_round"].isna().any()
+    return fights, fighter_details
+
+
+@pytest.fixture(scope="module")
+def per_fighter_frame(fights):
+    fights, fighter_details = fights
+    return PerFighterProcessor(fights.copy(), fighter_details.copy()).frame
+
+
+@pytest.mark.parametrize("processes", [1, 3])
+def test_grouped_features_match_the_per_fighter_loop(
+    fights, per_fighter_frame, processes
+):
+    fights, fighter_details = fights
+    frame = FighterDetailProcessor(
+        fights.copy(), fighter_details.copy(), processes=processes
+    ).frame
+    pd.testing.assert_frame_equal(frame, per_fighter_frame)
+    assert per_fighter_frame["R_longest_win_streak"].max() >= 4
+    assert per_fighter_frame["B_current_lose_streak"].max() >= 2
+
+
+def test_features_of_whole_rounds(fights):
+    fights, fighter_details = fights
+    fights = fights.dropna(subset=["last_round"]).reset_index(drop=True)
+    fights["last_round"] = fights["last_round"].astype(int)
+    frame = FighterDetailProcessor(fights.copy(), fighter_details.copy()).frame
+    pd.testing.assert_frame_equal(
+        frame, PerFighterProcessor(fights.copy(), fighter_details.copy()).frame
+    )
+    assert frame["R_total_rounds_fought"].dtype == np.int64
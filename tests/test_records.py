@@ -0,0 +1,195 @@
+import pandas as pd
+import pytest
+
+from src.createdata.fighter_dimension import known_fighter_ids
+from src.createdata.records import (
+    FIGHT_HEADER,
+    FIGHTER_SCHEMA,
+    LEGACY_FIGHT_COLUMNS,
+    LEGACY_FIGHT_HEADER,
+    fight_record_from_texts,
+    fight_record_to_row,
+    fighter_record_from_texts,
+    to_cms,
+    to_event_date,
+    to_fraction,
+    to_landed,
+    to_seconds,
+    upgrade_fight_row,
+    upgrade_legacy_fight_file,
+    upgrade_legacy_fighter_file,
+)
+from src.createdata.run_journal import RunJournal
+from src.createdata.scrape_fight_data import FightDataScraper
+from src.createdata.utils import parse_page
+
+
+@pytest.mark.parametrize(
+    "convert, text, value",
+    [
+        (to_landed, "45 of 98", 45),
+        (to_landed, "0 of 0", 0),
+        (to_fraction, "56%", 0.56),
+        (to_fraction, "100%", 1.0),
+        (to_fraction, "---", None),
+        (to_fraction, "--", None),
+        (to_fraction, "", None),
+        (to_seconds, "3:21", 201),
+        (to_seconds, "0:00", 0),
+        (to_seconds, "--", None),
+        (to_seconds, "", None),
+        (to_cms, "5' 11\"", 180.34),
+        (to_cms, "6' 0\"", 182.88),
+        (to_cms, '72"', 182.88),
+        (to_cms, "--", None),
+        (to_cms, "", None),
+        (to_event_date, "November 16, 2019", "2019-11-16"),
+        (to_event_date, "February 29, 2020", "2020-02-29"),
+        (to_event_date, "--", None),
+        (to_event_date, "", None),
+    ],
+)
+def test_converters(convert, text, value):
+    assert convert(text) == pytest.approx(value)
+
+
+@pytest.mark.parametrize(
+    "convert, text",
+    [
+        # Counts are always shown, a page without them fails and is retried
+        (to_landed, "--"),
+        (to_landed, ""),
+        (to_landed, "45 / 98"),
+        (to_fraction, "56 pct"),
+        (to_seconds, "3.21"),
+        (to_seconds, "3:21:00"),
+        (to_cms, "tall"),
+        (to_cms, "5' 11.5\""),
+        (to_event_date, "2019-11-16"),
+        (to_event_date, "February 30, 2020"),
+    ],
+)
+def test_converters_reject_malformed_texts(convert, text):
+    with pytest.raises(ValueError):
+        convert(text)
+
+
+def fight_texts(recorded_pages):
+    """The page texts of every recorded fight, as the scrapers read them."""
+    for url, text in sorted(recorded_pages.items()):
+        if "/fight-details/" in url:
+            soup = parse_page(text, "fight")
+            yield {
+                **FightDataScraper._get_fight_stats(soup),
+                **FightDataScraper._get_fight_details(soup),
+                "date": "April 13, 2024",
+                "location": "Miami, Florida, USA",
+                **FightDataScraper._get_fight_result_data(soup),
+            }
+
+
+def test_legacy_fight_file_round_trip(recorded_pages, tmp_path):
+    texts = list(fight_texts(recorded_pages))
+    # Two of the fighters are called Jon Park, their rows are left without ids
+    fighter_ids = known_fighter_ids(
+        {
+            fight[f"{corner}_fighter_link"]: fight[f"{corner}_fighter"]
+            for fight in texts
+            for corner in ("R", "B")
+        }
+    )
+    assert fighter_ids["Jon Park"] is None
+    current_rows = []
+    for fight in texts:
+        record = fight_record_from_texts(fight)
+        current_rows.append(
+            fight_record_to_row(
+                record._replace(
+                    R_ufcstats_id=fighter_ids[record.R_fighter],
+                    B_ufcstats_id=fighter_ids[record.B_fighter],
+                )
+            )
+        )
+    legacy_rows = [
+        ";".join(fight[column] for column in LEGACY_FIGHT_COLUMNS) for fight in texts
+    ]
+
+    filepath = tmp_path / "raw_total_fight_data.csv"
+    filepath.write_text(LEGACY_FIGHT_HEADER + "".join(r + "\n" for r in legacy_rows))
+    assert upgrade_legacy_fight_file(filepath, fighter_ids=fighter_ids)
+    assert filepath.read_text() == FIGHT_HEADER + "".join(
+        row + "\n" for row in current_rows
+    )
+    # Converted once, current rows are left as they are
+    assert not upgrade_legacy_fight_file(filepath, fighter_ids=fighter_ids)
+    assert upgrade_fight_row(current_rows[0]) == current_rows[0]
+
+    # Without ids for their names the fighters are only named
+    record = fight_record_from_texts(texts[0])
+    assert upgrade_fight_row(legacy_rows[0]) == fight_record_to_row(
+        record._replace(R_ufcstats_id=None, B_ufcstats_id=None)
+    )
+
+
+def test_legacy_fight_file_keeps_only_committed_rows(recorded_pages, tmp_path):
+    texts = list(fight_texts(recorded_pages))[:3]
+    legacy_rows = [
+        ";".join(fight[column] for column in LEGACY_FIGHT_COLUMNS) + "\n"
+        for fight in texts
+    ]
+    filepath = tmp_path / "new_fight_data.csv"
+    filepath.write_text(LEGACY_FIGHT_HEADER + "".join(legacy_rows))
+    journal = RunJournal(tmp_path / "journal.jsonl")
+    journal.record(
+        [
+            {
+                "kind": "offset",
+                "path": filepath.name,
+                "offset": len(LEGACY_FIGHT_HEADER + "".join(legacy_rows[:2])),
+            }
+        ]
+    )
+
+    assert upgrade_legacy_fight_file(filepath, journal)
+    assert len(filepath.read_text().splitlines()) == 3
+    assert (
+        journal.last("offset", path=filepath.name)["offset"] == filepath.stat().st_size
+    )
+    journal.close()
+
+
+def test_legacy_fighter_file_round_trip(tmp_path):
+    legacy_texts = {
+        "Ana Sousa": ["5' 5\"", "115 lbs.", '65"', "Orthodox", "Feb 14, 1997"]
+        + ["3.58", "49%", "1.34", "62%", "1.39", "1%", "69%", "0.5"],
+        "Jon Park": ["5' 9\"", "155 lbs.", "--", "", "--"]
+        + ["0.00", "0%", "0.00", "0%", "0.00", "0%", "0%", "0.0"],
+        "Tomas Reyes": ["6' 0\"", "170 lbs.", '74"', "Southpaw", "Jul 19, 1987"]
+        + ["4.10", "45%", "3.00", "55%", "1.00", "30%", "60%", "0.3"],
+    }
+    text_columns = [text for _, _, text, _ in FIGHTER_SCHEMA]
+    filepath = tmp_path / "raw_fighter_details.csv"
+    pd.DataFrame(
+        [[name, *texts] for name, texts in legacy_texts.items()],
+        columns=["fighter_name", *text_columns],
+    ).to_csv(filepath, index=False)
+
+    # Two fighters go by Tomas Reyes, there is no telling which one this is
+    fighter_ids = {"Ana Sousa": "01248e04cb8a3bcb", "Jon Park": "0fae55d2dc442aef"}
+    fighter_ids["Tomas Reyes"] = None
+    assert upgrade_legacy_fighter_file(filepath, fighter_ids) == ["Tomas Reyes"]
+
+    converted = pd.read_csv(filepath, dtype=str, keep_default_na=False)
+    assert converted.columns.tolist() == [
+        "ufcstats_id",
+        "fighter_name",
+        *[name for name, _, _, _ in FIGHTER_SCHEMA],
+    ]
+    for name in ("Ana Sousa", "Jon Park"):
+        row = converted[converted["fighter_name"] == name].iloc[0]
+        assert row["ufcstats_id"] == fighter_ids[name]
+        record = fighter_record_from_texts(dict(zip(text_columns, legacy_texts[name])))
+        assert row.tolist()[2:] == ["" if v is None else str(v) for v in record]
+
+    # Converted once, the file is left alone
+    assert upgrade_legacy_fighter_file(filepath, fighter_ids) == []
@@ -0,0 +1,68 @@
+import pytest
+
+from src.benchmark.fixture_server import FixtureServer
+from src.createdata.http_cache import ResponseCache
+
+EVENTS_URL = "http://ufcstats.com/statistics/events/completed?page=all"
+NEWEST_EVENT = "http://ufcstats.com/event-details/b345174a81c34a70"
+
+
+@pytest.fixture(scope="module")
+def earlier_cache(recorded_pages, tmp_path_factory):
+    """The recorded pages as they were before the newest event took place."""
+    cache_dir = tmp_path_factory.mktemp("earlier_cache")
+    cache = ResponseCache(cache_dir)
+    for url, text in recorded_pages.items():
+        if url == EVENTS_URL:
+            rows = text.split("<tr ")
+            text = "<tr ".join(row for row in rows if NEWEST_EVENT not in row)
+        cache.put(url, text)
+    return cache_dir
+
+
+@pytest.fixture
+def clean_fight_data(make_fight_scraper, fixture_server, tmp_path):
+    scraper = make_fight_scraper(fixture_server, tmp_path / "clean")
+    scraper.create_fight_data_csv()
+    return scraper.TOTAL_EVENT_AND_FIGHTS_PATH.read_text()
+
+
+@pytest.mark.parametrize(
+    "first_budget, second_budget",
+    [(2, None), (4, 2), (6, 3), (7, 1), (None, 2), (3, 6)],
+)
+def test_budgeted_runs_end_with_the_rows_of_a_single_run(
+    make_fight_scraper,
+    earlier_cache,
+    recorded_cache,
+    clean_fight_data,
+    tmp_path,
+    first_budget,
+    second_budget,
+):
+    data_dir = tmp_path / "budgeted"
+    # The first run only knows the two earlier events, and runs out of budget
+    with FixtureServer(earlier_cache) as server:
+        scraper = make_fight_scraper(server, data_dir, max_requests=first_budget)
+        scraper.create_fight_data_csv()
+    if first_budget is not None:
+        assert scraper.store.pending_events()
+
+    # The next finds the newest event, put in front of the fights scraped so far
+    # while the events left over go after them
+    with FixtureServer(recorded_cache) as server:
+        scraper = make_fight_scraper(server, data_dir, max_requests=second_budget)
+        scraper.full_discovery = True
+        scraper.create_fight_data_csv()
+        runs = 0
+        while scraper.store.pending_events():
+            runs += 1
+            assert runs < 10
+            # Rows are written by event, a run has to fit an event page and its fights
+            scraper = make_fight_scraper(server, data_dir, max_requests=4)
+            scraper.create_fight_data_csv()
+
+    assert scraper.TOTAL_EVENT_AND_FIGHTS_PATH.read_text() == clean_fight_data
+    assert not scraper.FAILED_URLS_PATH.exists()
+    assert not scraper.FIGHT_RUN_JOURNAL_PATH.exists()
+    assert scraper.store.seen_event_links()[0] == NEWEST_EVENT
@@ -0,0 +1,110 @@
+import pytest
+
+from src.createdata.scrape_store import SQLiteScrapeStore
+
+EVENT = "http://ufcstats.com/event-details/{}".format
+FIGHT = "http://ufcstats.com/fight-details/{}".format
+FIGHTER = "http://ufcstats.com/fighter-details/{}".format
+
+
+@pytest.fixture(params=["files", "sqlite"])
+def store(request, file_store, tmp_path):
+    if request.param == "files":
+        yield file_store
+        return
+    # Started from the (empty) pickles of the file store
+    store = SQLiteScrapeStore(tmp_path / "scrape_store.sqlite3", file_store=file_store)
+    yield store
+    store.close()
+
+
+def test_stores_answer_alike(store):
+    assert not store.has_seen_events()
+    assert not store.has_known_fighters()
+
+    # A first run lists two events and scrapes them
+    store.save_event_fight_links(
+        {EVENT("e2"): [FIGHT("f3"), FIGHT("f4")], EVENT("e1"): [FIGHT("f1")]}
+    )
+    # Listed again, the fights of an event are replaced
+    store.save_event_fight_links({EVENT("e1"): [FIGHT("f1"), FIGHT("f2")]})
+    assert store.event_fight_links([EVENT("e1"), EVENT("e2"), EVENT("e3")]) == {
+        EVENT("e1"): [FIGHT("f1"), FIGHT("f2")],
+        EVENT("e2"): [FIGHT("f3"), FIGHT("f4")],
+    }
+    store.save_scraped_fights(
+        {
+            FIGHT("f1"): {FIGHTER("a"): "Ana", FIGHTER("b"): "Bea"},
+            FIGHT("f3"): {FIGHTER("a"): "Ana", FIGHTER("c"): "Cat"},
+        },
+        {EVENT("e1"): "2024-03-09", EVENT("e2"): "2024-04-06"},
+    )
+    store.add_discovered_fighter_links(
+        {FIGHTER("a"): "Ana", FIGHTER("b"): "Bea", FIGHTER("c"): "Cat"}
+    )
+    store.commit_event_links([EVENT("e2"), EVENT("e1")])
+    assert store.has_seen_events()
+    assert store.seen_event_links() == [EVENT("e2"), EVENT("e1")]
+    assert store.new_fighter_links() == {
+        FIGHTER("a"): "Ana",
+        FIGHTER("b"): "Bea",
+        FIGHTER("c"): "Cat",
+    }
+    store.commit_fighter_links(store.new_fighter_links())
+    assert store.has_known_fighters()
+    assert store.discovered_fighter_links() == {}
+
+    # The next run finds a newer event, the one it had no time for is pending
+    assert store.seen_events_among([EVENT("e3"), EVENT("e2")]) == {EVENT("e2")}
+    pending = [
+        {
+            "url": EVENT("e3"),
+            "fights": [FIGHT("f5")],
+            "after_row": "row",
+            "before_row": None,
+        }
+    ]
+    store.save_event_fight_links({EVENT("e3"): [FIGHT("f5")]})
+    store.save_pending_events(pending)
+    assert store.pending_events() == pending
+    store.commit_event_links([EVENT("e3"), EVENT("e2"), EVENT("e1")])
+    assert store.seen_event_links() == [EVENT("e3"), EVENT("e2"), EVENT("e1")]
+
+    # Known fighters that fight again are active, a renamed one under the new name
+    store.add_discovered_fighter_links({FIGHTER("a"): "Anna", FIGHTER("d"): "Dee"})
+    assert store.new_fighter_links() == {FIGHTER("d"): "Dee"}
+    assert store.active_fighter_links() == {FIGHTER("a"): "Anna"}
+    store.commit_fighter_links(store.discovered_fighter_links())
+    assert store.known_fighter_links() == {
+        FIGHTER("a"): "Anna",
+        FIGHTER("b"): "Bea",
+        FIGHTER("c"): "Cat",
+        FIGHTER("d"): "Dee",
+    }
+
+    store.save_pending_events([])
+    assert store.pending_events() == []
+
+    # Only the database records which fighters were in which fights
+    if isinstance(store, SQLiteScrapeStore):
+        assert store.events_since("2024-04-01") == [EVENT("e2")]
+        assert store.events_since("2024-01-01") == [EVENT("e2"), EVENT("e1")]
+        assert store.fights_of_fighter("a") == [FIGHT("f3"), FIGHT("f1")]
+        assert store.fights_of_fighter("b") == [FIGHT("f1")]
+        assert store.fights_of_fighter("z") == []
+
+
+def test_database_starts_from_the_pickles(file_store, tmp_path):
+    file_store.save_event_fight_links({EVENT("e1"): [FIGHT("f1"), FIGHT("f2")]})
+    file_store.commit_event_links([EVENT("e2"), EVENT("e1")])
+    file_store.commit_fighter_links({FIGHTER("a"): "Ana"})
+    file_store.add_discovered_fighter_links({FIGHTER("b"): "Bea"})
+
+    store = SQLiteScrapeStore(tmp_path / "scrape_store.sqlite3", file_store=file_store)
+    assert store.seen_event_links() == file_store.seen_event_links()
+    assert store.event_fight_links([EVENT("e1")]) == file_store.event_fight_links(
+        [EVENT("e1")]
+    )
+    assert store.known_fighter_links() == file_store.known_fighter_links()
+    assert store.new_fighter_links() == file_store.new_fighter_links()
+    store.close()
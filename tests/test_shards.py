@@ -0,0 +1,76 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from src.createdata import shards
+from src.createdata.failed_urls import FailedUrlQueue
+from src.createdata.records import FIGHT_HEADER
+from src.createdata.scrape_engine import ScrapeEngine
+from src.createdata.shards import ShardedScrape
+
+
+def scrape(fixture_server, data_dir, *args):
+    """Runs a scraper module against the recorded pages with its own data folder."""
+    data_dir.mkdir()
+    env = dict(os.environ)
+    env.pop("NO_PROXY", None)
+    env.pop("no_proxy", None)
+    env.update(
+        HTTP_PROXY=fixture_server.url,
+        http_proxy=fixture_server.url,
+        UFC_DATA_DIR=str(data_dir),
+    )
+    process = subprocess.run(
+        [sys.executable, "-m", *args, "--no-cache", "--parse-processes", "1"],
+        env=env,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    assert process.returncode == 0
+    return process.stdout
+
+
+def test_sharded_scrape_matches_a_single_run(fixture_server, tmp_path):
+    single = tmp_path / "single"
+    sharded = tmp_path / "sharded"
+    scrape(fixture_server, single, "src.create_ufc_data", "--run", "scrape")
+    output = scrape(
+        fixture_server, sharded, "src.scrape_shards", "run", "--shards", "3"
+    )
+    assert "Merged 3 shards" in output
+
+    for name in ["raw_total_fight_data.csv", "raw_fighter_details.csv"]:
+        single_text = (single / name).read_text()
+        assert single_text == (sharded / name).read_text()
+    # Nine fights and the fifteen fighters with complete profiles
+    assert len((single / "raw_total_fight_data.csv").read_text().splitlines()) == 10
+    assert len((single / "raw_fighter_details.csv").read_text().splitlines()) == 16
+
+
+def test_short_shard_is_named_and_leaves_no_file(file_store, tmp_path, monkeypatch):
+    event = "http://ufcstats.com/event-details/22b0e91b59581ac8"
+    fights = [
+        "http://ufcstats.com/fight-details/38ac1c386e870a83",
+        "http://ufcstats.com/fight-details/6bddbd0c3d653420",
+    ]
+    total_path = tmp_path / "raw_total_fight_data.csv"
+    monkeypatch.setattr(shards, "TOTAL_EVENT_AND_FIGHTS", total_path)
+    sharded_scrape = ShardedScrape(
+        engine=ScrapeEngine(parse_processes=1), shard_dir=tmp_path, store=file_store
+    )
+    with open(sharded_scrape._shard_path("fights", 0, ".json").as_posix(), "w") as f:
+        json.dump({"failed_fights": []}, f)
+    # One of the two fights of the plan has a row
+    row = ";".join(["Ana Sousa"] * (FIGHT_HEADER.count(";") + 1))
+    sharded_scrape._shard_path("fights", 0, ".csv").write_text(
+        FIGHT_HEADER + row + "\n"
+    )
+
+    plan = {"shard_count": 1, "events": {event: fights}}
+    with pytest.raises(ValueError, match=f"shard 0 ran out of rows at {event}"):
+        sharded_scrape._merge_fights(plan, FailedUrlQueue(tmp_path / "failed.json"))
+    assert not total_path.exists()
+    assert not list(tmp_path.glob("*.tmp"))
@@ -0,0 +1,174 @@
+import pytest
+
+from src.benchmark.fixture_server import FixtureServer
+from src.createdata import utils
+from src.createdata.throttle import (
+    AdaptiveRateLimiter,
+    CircuitBreaker,
+    CircuitOpenError,
+    HostThrottle,
+    get_retry_after,
+)
+from src.createdata.utils import FetchError, download_page
+
+EVENT_URL = "http://ufcstats.com/event-details/22b0e91b59581ac8"
+
+
+@pytest.fixture
+def download_with(scrape_from, monkeypatch, fake_clock):
+    """Downloads pages from `server` with `host_throttle`, on the fake clock."""
+
+    def use(server, host_throttle):
+        scrape_from(server)
+        monkeypatch.setattr(utils, "get_host_throttle", lambda url: host_throttle)
+
+    return use
+
+
+def test_rate_follows_the_host(fake_clock):
+    limiter = AdaptiveRateLimiter(rate=2.0, min_rate=0.5, max_rate=3.0, burst=2.0)
+    limiter.acquire()
+    limiter.acquire()
+    assert fake_clock.sleeps == []
+    # The bucket is empty, the next token takes 1 / rate seconds
+    limiter.acquire()
+    assert fake_clock.sleeps == [0.5]
+
+    limiter.on_success(0.1)
+    assert limiter.rate == 2.5
+    limiter.on_success(0.1)
+    limiter.on_success(0.1)
+    assert limiter.rate == 3.0
+    limiter.on_success(5.0)
+    assert limiter.rate == pytest.approx(2.7)
+    for _ in range(5):
+        limiter.on_failure()
+    assert limiter.rate == 0.5
+
+
+def test_retry_after_pauses_the_limiter(fake_clock):
+    limiter = AdaptiveRateLimiter()
+    start = fake_clock.now
+    limiter.on_failure(retry_after=7.0)
+    limiter.acquire()
+    assert fake_clock.now - start == 7.0
+
+
+def test_circuit_opens_and_lets_one_probe_through(fake_clock):
+    breaker = CircuitBreaker(
+        failure_threshold=2, reset_timeout=10.0, give_up_after=60.0
+    )
+    breaker.record_failure()
+    breaker.before_request()
+    breaker.record_failure()
+    assert fake_clock.sleeps == []
+
+    # Open, the probe waits out the reset timeout
+    start = fake_clock.now
+    breaker.before_request()
+    assert fake_clock.now - start == 10.0
+    # A failed probe opens the circuit for twice as long
+    breaker.record_failure()
+    start = fake_clock.now
+    breaker.before_request()
+    assert fake_clock.now - start == 20.0
+    # A successful probe closes it, the count of failures starts over
+    breaker.record_success()
+    breaker.record_failure()
+    sleeps = len(fake_clock.sleeps)
+    breaker.before_request()
+    assert len(fake_clock.sleeps) == sleeps
+
+
+def test_circuit_gives_up_on_a_dead_host(fake_clock):
+    breaker = CircuitBreaker(
+        failure_threshold=1, reset_timeout=10.0, give_up_after=60.0
+    )
+    breaker.record_failure()
+    start = fake_clock.now
+    breaker.before_request()
+    # Everyone else waits while the probe is out, until the breaker gives up
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+    assert fake_clock.now - start >= 60.0
+
+
+def test_backoff_is_capped():
+    host_throttle = HostThrottle(backoff_base=0.5, backoff_cap=3.0)
+    for attempt in range(10):
+        assert 0 <= host_throttle.backoff(attempt) <= min(3.0, 0.5 * 2 ** attempt)
+
+
+@pytest.mark.parametrize(
+    "value, seconds", [("3", 3.0), ("-1", 0.0), (None, None), ("Fri, 01 Mar", None)]
+)
+def test_get_retry_after(value, seconds):
+    headers = {} if value is None else {"Retry-After": value}
+    assert get_retry_after(headers) == seconds
+
+
+def test_download_waits_as_long_as_the_host_asks(
+    recorded_cache, download_with, fake_clock
+):
+    host_throttle = HostThrottle()
+    with FixtureServer(
+        recorded_cache,
+        fail_pattern=EVENT_URL,
+        fail_status=429,
+        retry_after=7,
+        fail_times=2,
+    ) as server:
+        download_with(server, host_throttle)
+        response = download_page(EVENT_URL)
+    assert response.status_code == 200
+    assert server.requests == 3
+    assert fake_clock.sleeps == [7.0, 7.0]
+    # Halved twice, then raised for the fast answer
+    assert host_throttle.limiter.rate == 2.5
+
+
+def test_download_respects_the_retry_limit(recorded_cache, download_with, fake_clock):
+    host_throttle = HostThrottle(max_retries=3, backoff_base=0.5)
+    with FixtureServer(
+        recorded_cache, fail_pattern=EVENT_URL, fail_status=503
+    ) as server:
+        download_with(server, host_throttle)
+        with pytest.raises(FetchError, match="failed after 4 attempts, HTTP 503"):
+            download_page(EVENT_URL)
+    assert server.requests == 4
+    # Backoff between the attempts only, growing with every attempt
+    assert len(fake_clock.sleeps) == 3
+    for attempt, seconds in enumerate(fake_clock.sleeps):
+        assert 0 <= seconds <= 0.5 * 2 ** attempt
+
+
+def test_download_stops_when_the_circuit_gives_up(
+    recorded_cache, download_with, fake_clock
+):
+    host_throttle = HostThrottle(max_retries=10)
+    host_throttle.breaker = CircuitBreaker(
+        failure_threshold=2, reset_timeout=10.0, give_up_after=60.0
+    )
+    with FixtureServer(recorded_cache, fail_pattern=EVENT_URL) as server:
+        download_with(server, host_throttle)
+        with pytest.raises(CircuitOpenError):
+            download_page(EVENT_URL)
+    # Two failures open the circuit, then two probes fail before it gives up
+    assert server.requests == 4
+
+
+def test_download_closes_the_circuit_when_the_host_recovers(
+    recorded_cache, download_with, fake_clock
+):
+    host_throttle = HostThrottle(max_retries=4)
+    host_throttle.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10.0)
+    with FixtureServer(recorded_cache, fail_pattern=EVENT_URL, fail_times=2) as server:
+        download_with(server, host_throttle)
+        start = fake_clock.now
+        assert download_page(EVENT_URL).status_code == 200
+        # The probe went out once the reset timeout was over
+        assert fake_clock.now - start >= 10.0
+        sleeps = len(fake_clock.sleeps)
+        assert download_page(EVENT_URL).status_code == 200
+    assert server.requests == 4
+    assert len(fake_clock.sleeps) == sleeps